@@ -0,0 +1,102 @@
+import io
+import lzma
+import os
+import tarfile
+import zipfile
+import zlib
+
+# 认为是图片的扩展名（压缩包中其他文件会被跳过）
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".gif", ".webp", ".tif", ".tiff"}
+
+ARCHIVE_CONTENT_TYPES = {
+    "application/zip",
+    "application/x-zip-compressed",
+    "application/x-tar",
+    "application/gzip",
+    "application/x-gzip",
+    "application/x-gtar",
+}
+
+ARCHIVE_SUFFIXES = (".zip", ".tar", ".tar.gz", ".tgz")
+
+# 压缩包损坏或被截断时，遍历成员和读取成员内容可能抛出的异常（gzip/bz2 的错误是 OSError 的子类）
+_CORRUPT_ERRORS = (tarfile.TarError, zipfile.BadZipFile, zlib.error, lzma.LZMAError, EOFError, OSError)
+
+
+class ArchiveError(ValueError):
+    """压缩包无法解析或超出限制"""
+
+
+def is_archive(filename, content_type):
+    """根据文件名或 Content-Type 判断上传的是否是 tar/zip 压缩包"""
+    name = (filename or "").lower()
+    if name.endswith(ARCHIVE_SUFFIXES):
+        return True
+    return (content_type or "").split(";")[0].strip().lower() in ARCHIVE_CONTENT_TYPES
+
+
+def is_image_name(name):
+    return os.path.splitext(name.lower())[1] in IMAGE_EXTENSIONS
+
+
+def iter_archive_images(data, filename="", max_images=256, max_image_bytes=5 * 1024 * 1024, max_total_bytes=None):
+    """依次产出压缩包中的 (文件名, 图片字节)
+
+    按压缩包内的顺序返回，跳过目录、非图片文件和 macOS 的 __MACOSX 元数据。
+    图片数超过 max_images、单张图片超过 max_image_bytes 或解压后的图片总字节数超过 max_total_bytes 时抛出 ArchiveError
+    （按成员头中的大小在解压之前检查，高压缩比的小压缩包不会先占满内存）；
+    压缩包损坏（包括遍历到一半才发现的截断、CRC 错误）时同样抛出 ArchiveError。
+    解压是 CPU 密集操作，在异步代码中要放到线程中调用。
+    """
+    count = 0
+    total = 0
+    members = _iter_members(data, filename)
+    while True:
+        try:
+            member = next(members, None)
+        except _CORRUPT_ERRORS as e:
+            raise ArchiveError(f"压缩包 {filename} 已损坏: {e}")
+        if member is None:
+            break
+        name, size, read = member
+        if name.startswith("__MACOSX/") or os.path.basename(name).startswith("._"):
+            continue
+        if not is_image_name(name):
+            continue
+        count += 1
+        if count > max_images:
+            raise ArchiveError(f"压缩包中的图片超过{max_images}张")
+        if size > max_image_bytes:
+            raise ArchiveError(f"压缩包中的图片 {name} 超过{max_image_bytes // (1024 * 1024)}MB")
+        total += size
+        if max_total_bytes is not None and total > max_total_bytes:
+            raise ArchiveError(f"压缩包解压后的图片总大小超过{max_total_bytes // (1024 * 1024)}MB")
+        try:
+            content = read()
+        except _CORRUPT_ERRORS as e:
+            raise ArchiveError(f"压缩包 {filename} 中的 {name} 已损坏: {e}")
+        yield name, content
+
+
+def _iter_members(data, filename):
+    buffer = io.BytesIO(data)
+    if zipfile.is_zipfile(buffer):
+        buffer.seek(0)
+        with zipfile.ZipFile(buffer) as zf:
+            for info in zf.infolist():
+                if info.is_dir():
+                    continue
+                yield info.filename, info.file_size, (lambda info=info: zf.read(info))
+        return
+
+    buffer.seek(0)
+    try:
+        # mode="r:*" 自动识别 gzip/bz2/xz 压缩
+        tf = tarfile.open(fileobj=buffer, mode="r:*")
+    except tarfile.TarError as e:
+        raise ArchiveError(f"无法解析压缩包 {filename}: {e}")
+    with tf:
+        for member in tf:
+            if not member.isfile():
+                continue
+            yield member.name, member.size, (lambda member=member: tf.extractfile(member).read())
@@ -0,0 +1,79 @@
+import json
+import os
+
+import numpy as np
+import torch
+
+# 本地模型文件格式（可内存映射）：
+#   <name>.weights.bin   所有参数/缓冲区按顺序拼接的原始字节（64字节对齐）
+#   <name>.weights.json  每个张量的 偏移/形状/类型，以及模型版本等元数据
+# 加载时用 np.memmap 映射整个文件，张量直接指向映射的页面，不经过反序列化；
+# 多个进程映射同一个文件时共享操作系统的页缓存。
+
+_ALIGN = 64
+
+
+def weights_paths(model_dir, name):
+    return (os.path.join(model_dir, f"{name}.weights.bin"),
+            os.path.join(model_dir, f"{name}.weights.json"))
+
+
+def has_weights(model_dir, name):
+    return all(os.path.exists(p) for p in weights_paths(model_dir, name))
+
+
+def save_weights(model, model_dir, name, version):
+    """把模型的 state_dict 写成可内存映射的本地模型文件"""
+    os.makedirs(model_dir, exist_ok=True)
+    bin_path, meta_path = weights_paths(model_dir, name)
+    tensors = {}
+    offset = 0
+    with open(bin_path, "wb") as f:
+        for key, tensor in model.state_dict().items():
+            array = tensor.detach().cpu().contiguous().numpy()
+            padding = (-offset) % _ALIGN
+            f.write(b"\0" * padding)
+            offset += padding
+            f.write(array.tobytes())
+            tensors[key] = {"offset": offset, "shape": list(array.shape), "dtype": array.dtype.str}
+            offset += array.nbytes
+    with open(meta_path, "w", encoding="utf-8") as f:
+        json.dump({"name": name, "version": version, "tensors": tensors}, f, indent=1)
+    return bin_path, meta_path
+
+
+def load_weights(model, model_dir, name):
+    """把本地模型文件映射到内存并直接作为模型参数使用，返回元数据
+
+    使用 copy-on-write 映射（mode="c"）：推理只读权重，各进程共享同一份页缓存；
+    万一有代码写入参数，也只会复制被写的页，不会改动磁盘上的文件。
+    """
+    bin_path, meta_path = weights_paths(model_dir, name)
+    with open(meta_path, encoding="utf-8") as f:
+        meta = json.load(f)
+    mapped = np.memmap(bin_path, dtype=np.uint8, mode="c")
+
+    expected = set(model.state_dict().keys())
+    missing = expected - set(meta["tensors"])
+    if missing:
+        raise ValueError(f"模型文件 {bin_path} 缺少参数: {sorted(missing)[:5]}")
+
+    for key, info in meta["tensors"].items():
+        dtype = np.dtype(info["dtype"])
+        count = int(np.prod(info["shape"])) if info["shape"] else 1
+        start = info["offset"]
+        array = mapped[start:start + count * dtype.itemsize].view(dtype).reshape(info["shape"])
+        _assign(model, key, torch.from_numpy(array))
+    return meta
+
+
+def _assign(model, key, tensor):
+    # 直接替换参数/缓冲区对象，而不是 load_state_dict 的逐个拷贝
+    module_path, _, attr = key.rpartition(".")
+    module = model.get_submodule(module_path) if module_path else model
+    if attr in module._parameters:
+        module._parameters[attr] = torch.nn.Parameter(tensor, requires_grad=False)
+    elif attr in module._buffers:
+        module._buffers[attr] = tensor
+    else:
+        raise ValueError(f"模型中没有参数 {key}")
@@ -0,0 +1,211 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+
+import numpy as np
+import torch
+
+# 可选的推理后端（INFERENCE_BACKEND）
+BACKENDS = ("eager", "channels_last", "torchscript", "int8_dynamic", "int8_static", "onnxruntime")
+
+# 导出的 .onnx 文件：<arch>-<指纹>.onnx + 同名 .json 元数据。指纹由权重的 sha256、torch 版本、opset
+# 和下面的导出格式版本决定，任何一项变化都会重新导出，不会继续使用按旧权重导出的文件。
+# 导出方式（输入输出名、动态维度等）改变时把 ONNX_EXPORT_VERSION 加 1
+ONNX_EXPORT_VERSION = 1
+ONNX_OPSET = 13
+
+
+class InferenceBackend:
+    """推理后端：接收 [N, 3, 224, 224] float32 批次，返回 [N, 1000] logits"""
+
+    def __init__(self, name, fn, description=""):
+        self.name = name
+        self.description = description
+        self._fn = fn
+
+    def __call__(self, batch):
+        with torch.no_grad():
+            return self._fn(batch)
+
+
+def build_backend(name, model, arch="resnet18", calibration_batches=None, work_dir=None):
+    """根据名称构建推理后端；model 是已加载权重的 eager FP32 模型（不会被修改）
+
+    calibration_batches: int8_static 量化校准使用的批次列表
+    work_dir: onnxruntime 导出 .onnx 文件的目录
+    """
+    if name not in BACKENDS:
+        raise ValueError(f"未知的推理后端 {name!r}，可选: {', '.join(BACKENDS)}")
+    example = torch.zeros(1, 3, 224, 224)
+
+    if name == "eager":
+        return InferenceBackend(name, model, "PyTorch eager FP32")
+
+    if name == "channels_last":
+        converted = _copy_model(model, arch).to(memory_format=torch.channels_last)
+        return InferenceBackend(
+            name,
+            lambda batch: converted(batch.contiguous(memory_format=torch.channels_last)),
+            "eager FP32 + channels_last 内存布局")
+
+    if name == "torchscript":
+        with torch.no_grad():
+            traced = torch.jit.trace(model, example)
+        frozen = torch.jit.freeze(traced.eval())
+        try:
+            # 融合 conv+bn 等推理期优化，旧版本可能不支持
+            frozen = torch.jit.optimize_for_inference(frozen)
+        except Exception as e:
+            print(f"⚠ optimize_for_inference 不可用: {e}")
+        return InferenceBackend(name, frozen, "TorchScript trace + freeze")
+
+    if name == "int8_dynamic":
+        quantized = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        return InferenceBackend(name, quantized, "动态 int8 量化（仅全连接层）")
+
+    if name == "int8_static":
+        quantized = _quantize_static(model, arch, calibration_batches or [])
+        return InferenceBackend(name, quantized, "静态 int8 量化（conv/bn/relu 融合 + 校准）")
+
+    return _build_onnxruntime(model, arch, example, work_dir)
+
+
+def _copy_model(model, arch):
+    import torchvision.models as models
+    copied = models.__dict__[arch](weights=None)
+    copied.load_state_dict(model.state_dict())
+    return copied.eval()
+
+
+def _quantize_static(model, arch, calibration_batches):
+    """eager 模式静态量化：使用 torchvision 的可量化模型结构，融合后用校准数据统计激活范围"""
+    import torchvision.models.quantization as qmodels
+    if arch not in qmodels.__dict__:
+        raise ValueError(f"{arch} 没有可量化的 torchvision 实现，不能使用 int8_static")
+
+    engines = torch.backends.quantized.supported_engines
+    engine = "fbgemm" if "fbgemm" in engines else "qnnpack"
+    torch.backends.quantized.engine = engine
+
+    qmodel = qmodels.__dict__[arch](weights=None, quantize=False)
+    qmodel.load_state_dict(model.state_dict())
+    qmodel.eval()
+    qmodel.fuse_model()
+    qmodel.qconfig = torch.ao.quantization.get_default_qconfig(engine)
+    torch.ao.quantization.prepare(qmodel, inplace=True)
+
+    if not calibration_batches:
+        print("⚠ 没有校准图片，使用随机噪声校准（精度会明显下降，请设置 CALIBRATION_DIR）")
+        calibration_batches = [torch.randn(8, 3, 224, 224) for _ in range(4)]
+    with torch.no_grad():
+        for batch in calibration_batches:
+            qmodel(batch)
+    torch.ao.quantization.convert(qmodel, inplace=True)
+    print(f"✓ 静态 int8 量化完成（引擎 {engine}，校准 {sum(len(b) for b in calibration_batches)} 张）")
+    return qmodel
+
+
+def _build_onnxruntime(model, arch, example, work_dir):
+    try:
+        import onnxruntime as ort
+    except ImportError:
+        raise ImportError("onnxruntime 后端需要安装 onnxruntime: pip install onnxruntime")
+
+    work_dir = work_dir if work_dir and os.access(work_dir, os.W_OK) else tempfile.gettempdir()
+    meta = {
+        "arch": arch,
+        "weights_sha256": _weights_digest(model),
+        "torch": torch.__version__,
+        "opset": ONNX_OPSET,
+        "export_version": ONNX_EXPORT_VERSION,
+    }
+    fingerprint = hashlib.sha256(json.dumps(meta, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+    onnx_path = os.path.join(work_dir, f"{arch}-{fingerprint}.onnx")
+    if _read_onnx_meta(onnx_path) != meta:
+        print(f"正在导出 ONNX 模型: {onnx_path}")
+        # 先导出到临时目录（文件名与最终相同：新版导出器把权重写到引用该文件名的 .onnx.data 中）再改名，
+        # 多个推理进程同时导出、或导出中途退出时都不会留下不完整的文件
+        export_dir = tempfile.mkdtemp(prefix=f".{arch}-export-", dir=work_dir)
+        try:
+            exported = os.path.join(export_dir, os.path.basename(onnx_path))
+            torch.onnx.export(
+                model, example, exported,
+                input_names=["input"], output_names=["logits"],
+                dynamic_axes={"input": {0: "batch"}, "logits": {0: "batch"}},
+                opset_version=ONNX_OPSET
+            )
+            # .onnx 最后改名，它出现时引用的权重文件已经就位
+            for name in sorted(os.listdir(export_dir), key=lambda n: n.endswith(".onnx")):
+                os.replace(os.path.join(export_dir, name), os.path.join(work_dir, name))
+        finally:
+            shutil.rmtree(export_dir, ignore_errors=True)
+        # 元数据最后写入：有元数据且与当前一致才说明 .onnx 文件完整可用
+        with open(f"{onnx_path}.json.tmp", "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=1)
+        os.replace(f"{onnx_path}.json.tmp", f"{onnx_path}.json")
+        _remove_stale_onnx(work_dir, arch, keep=os.path.basename(onnx_path))
+
+    options = ort.SessionOptions()
+    # 与 PyTorch 使用相同的线程预算，避免和预处理线程抢占CPU
+    options.intra_op_num_threads = torch.get_num_threads()
+    options.inter_op_num_threads = 1
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    session = ort.InferenceSession(onnx_path, options, providers=["CPUExecutionProvider"])
+
+    def run(batch):
+        outputs = session.run(None, {"input": np.ascontiguousarray(batch.numpy())})
+        return torch.from_numpy(outputs[0])
+
+    return InferenceBackend("onnxruntime", run, f"ONNX Runtime {ort.__version__} (CPU)")
+
+
+def _weights_digest(model):
+    """模型参数和缓冲区（名称、类型、形状、数据）的 sha256"""
+    digest = hashlib.sha256()
+    for key, tensor in model.state_dict().items():
+        array = np.ascontiguousarray(tensor.detach().cpu().numpy())
+        digest.update(f"{key}:{array.dtype.str}:{list(array.shape)};".encode("utf-8"))
+        digest.update(array.reshape(-1).view(np.uint8))
+    return digest.hexdigest()
+
+
+def _read_onnx_meta(onnx_path):
+    """.onnx 文件对应的元数据；文件或元数据不存在、不可读时返回 None"""
+    if not os.path.exists(onnx_path):
+        return None
+    try:
+        with open(f"{onnx_path}.json", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _remove_stale_onnx(work_dir, arch, keep):
+    # 同一模型按旧权重/旧版本导出的文件（包括没有指纹的旧文件名 <arch>.onnx）
+    pattern = re.compile(rf"^{re.escape(arch)}(-[0-9a-f]{{16}})?\.onnx(\.json|\.data)?$")
+    for name in os.listdir(work_dir):
+        if pattern.match(name) and not name.startswith(keep):
+            try:
+                os.unlink(os.path.join(work_dir, name))
+            except OSError:
+                pass
+
+
+def load_calibration_batches(classifier, image_dir, max_images=64, batch_size=8):
+    """从目录读取校准图片，按分类器的预处理方式组成批次"""
+    if not image_dir or not os.path.isdir(image_dir):
+        return []
+    images = []
+    for filename in sorted(os.listdir(image_dir)):
+        if len(images) >= max_images:
+            break
+        path = os.path.join(image_dir, filename)
+        try:
+            with open(path, "rb") as f:
+                images.append(classifier.preprocess(f.read()))
+        except Exception:
+            continue
+    return [classifier.make_batch(images[i:i + batch_size]) for i in range(0, len(images), batch_size)]
@@ -0,0 +1,193 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+from app import metrics, profiling
+from app.executor import LANES, DeadlineExceededError
+
+
+class MicroBatcher:
+    """动态微批处理器
+
+    并发请求把预处理好的图像放进队列，后台线程把它们合并成一个批次，
+    只调用一次 classifier.predict_batch（即一次 self.model(batch)），
+    再把每张图各自的 top-k 结果交还给对应的调用方。
+    批次在达到 max_batch_size 或第一张图等待超过 max_wait_ms 时提交。
+
+    队列按优先级分通道（interactive 在前，bulk 在后），组批时先取 interactive；
+    截止时间已过的图像在前向推理之前直接失败（DeadlineExceededError），不占用批次位置。
+    """
+
+    def __init__(self, classifier, max_batch_size=8, max_wait_ms=5.0):
+        self.classifier = classifier
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+
+        self._lanes = {lane: deque() for lane in LANES}
+        self._cond = threading.Condition()
+        self._stopping = False
+        self._thread = None
+        self._stats_lock = threading.Lock()
+        self._reset_stats()
+
+    def _reset_stats(self):
+        self._total_requests = 0
+        self._total_batches = 0
+        self._max_batch_seen = 0
+        self._expired = 0
+        # 批大小 -> 出现次数
+        self._size_counts = {}
+
+    def start(self):
+        """启动后台批处理线程（必须在 fork 之后、事件循环启动时调用）"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._loop, name="micro-batcher", daemon=True)
+        self._thread.start()
+        print(f"✓ 微批处理已启动 (max_batch_size={self.max_batch_size}, "
+              f"max_wait_ms={self.max_wait * 1000:g})")
+
+    def stop(self, timeout=5.0):
+        """停止后台线程，队列中尚未处理的请求会先处理完"""
+        if self._thread is None:
+            return
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def wait_ready(self, timeout=None):
+        """可以开始推理时返回 True（进程内推理总是立即就绪，见 worker_pool.WorkerPoolBatcher）"""
+        return True
+
+    def memory_bytes(self):
+        """在其他进程中加载的模型占用的内存（进程内推理时为 0，模型内存按分类器估算）"""
+        return 0
+
+    def submit(self, image, top_k=5, deadline=None, priority="interactive", trace=None):
+        """提交一张预处理好的图像（张量或 uint8 数组），返回 concurrent.futures.Future
+
+        top_k: 结果中包含的预测个数
+        deadline: time.monotonic() 时间，到组批时已经过期则不再推理
+        priority: interactive / bulk
+        trace: profiling.RequestTrace，不为 None 时所在批次在 torch.profiler 下执行
+        """
+        future = Future()
+        lane = self._lanes.get(priority, self._lanes[LANES[0]])
+        with self._cond:
+            lane.append((image, future, top_k, deadline, trace))
+            self._cond.notify()
+        return future
+
+    def _pending(self):
+        return sum(len(lane) for lane in self._lanes.values())
+
+    def _take(self, limit):
+        # 在持有 self._cond 时调用：按通道优先级取出最多 limit 个
+        taken = []
+        for lane in LANES:
+            items = self._lanes[lane]
+            while items and len(taken) < limit:
+                taken.append(items.popleft())
+        return taken
+
+    def _loop(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                break
+            # 停止时剩余请求也会在后续循环中按批处理完，避免调用方一直等待
+            self._run_batch(batch)
+
+    def _next_batch(self):
+        """等待并取出下一个批次；已停止且队列为空时返回 None"""
+        with self._cond:
+            while not self._pending() and not self._stopping:
+                self._cond.wait()
+            if not self._pending():
+                return None
+            batch = self._take(self.max_batch_size)
+            flush_at = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size and not self._stopping:
+                remaining = flush_at - time.monotonic()
+                if remaining <= 0:
+                    break
+                if not self._pending():
+                    self._cond.wait(remaining)
+                batch.extend(self._take(self.max_batch_size - len(batch)))
+            return batch
+
+    def _predict(self, images, top_ks):
+        """一个批次的推理，返回每张图的结果（子类可以换成其他执行方式）"""
+        return self.classifier.predict_batch(images, top_k=top_ks)
+
+    def _profile(self, run, traces, batch_size):
+        """在 torch.profiler 下执行一个批次（子类可以改为在执行前向推理的进程中剖析）"""
+        return profiling.profile_call(run, traces, batch_size)
+
+    def _run_batch(self, batch):
+        # 调用方可能已经取消（例如客户端断开）
+        batch = [item for item in batch if item[1].set_running_or_notify_cancel()]
+        now = time.monotonic()
+        live = []
+        for item in batch:
+            deadline = item[3]
+            if deadline is not None and deadline <= now:
+                item[1].set_exception(DeadlineExceededError("batch"))
+                metrics.DEADLINE_EXPIRED.inc("batch")
+                with self._stats_lock:
+                    self._expired += 1
+            else:
+                live.append(item)
+        batch = live
+        if not batch:
+            return
+
+        def run():
+            return self._predict([item[0] for item in batch], [item[2] for item in batch])
+
+        traces = [item[4] for item in batch if item[4] is not None]
+        try:
+            results = self._profile(run, traces, len(batch)) if traces else run()
+        except Exception as e:
+            for item in batch:
+                item[1].set_exception(e)
+        else:
+            for item, result in zip(batch, results):
+                item[1].set_result(result)
+
+        self._record(len(batch))
+
+    def _record(self, size):
+        with self._stats_lock:
+            self._total_requests += size
+            self._total_batches += 1
+            self._max_batch_seen = max(self._max_batch_seen, size)
+            self._size_counts[size] = self._size_counts.get(size, 0) + 1
+        metrics.BATCH_SIZE.observe(size, getattr(self.classifier, "arch", "default"))
+
+    def queue_depth(self):
+        with self._cond:
+            return self._pending()
+
+    def stats(self):
+        """批大小统计，供 /health 展示"""
+        with self._cond:
+            lanes = {lane: len(items) for lane, items in self._lanes.items()}
+        with self._stats_lock:
+            avg = self._total_requests / self._total_batches if self._total_batches else 0.0
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000,
+                "queue_depth": sum(lanes.values()),
+                "queue_depth_by_lane": lanes,
+                "total_requests": self._total_requests,
+                "total_batches": self._total_batches,
+                "avg_batch_size": round(avg, 2),
+                "max_batch_seen": self._max_batch_seen,
+                "expired": self._expired,
+                "batch_size_histogram": {str(k): v for k, v in sorted(self._size_counts.items())},
+            }
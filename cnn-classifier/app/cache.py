@@ -0,0 +1,128 @@
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+
+from app.responses import dumps_json
+
+# 小于该大小的图片直接在事件循环中计算哈希，更大的放到线程中（hashlib 会释放 GIL）
+_INLINE_HASH_BYTES = 64 * 1024
+
+
+def _digest(image_bytes):
+    return hashlib.blake2b(image_bytes, digest_size=20).hexdigest()
+
+
+async def content_digest(image_bytes):
+    """上传字节的 blake2b 哈希（十六进制），缓存键和预测日志使用同一个值"""
+    if len(image_bytes) <= _INLINE_HASH_BYTES:
+        return _digest(image_bytes)
+    return await asyncio.to_thread(_digest, image_bytes)
+
+
+class ResultCache:
+    """按内容寻址的识别结果缓存（LRU + TTL + 内存上限），并合并并发的相同请求
+
+    键 = 上传字节的 blake2b 哈希 + 模型版本 + 预处理版本，
+    相同图片同时到达时只计算一次，其余请求等待同一个结果。
+    只在 asyncio 事件循环中使用，不需要加锁。
+    """
+
+    def __init__(self, max_entries=10000, max_bytes=64 * 1024 * 1024, ttl_seconds=3600.0):
+        self.max_entries = max(1, int(max_entries))
+        self.max_bytes = max(1, int(max_bytes))
+        self.ttl = float(ttl_seconds)
+
+        # key -> (过期时间, 估算大小, 结果)
+        self._entries = OrderedDict()
+        self._bytes = 0
+        # (key, group) -> 正在计算中的 asyncio.Task
+        self._in_flight = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    async def make_key(self, image_bytes, version):
+        return f"{await content_digest(image_bytes)}:{version}"
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, size, result = entry
+        if self.ttl > 0 and expires_at < time.monotonic():
+            self._remove(key)
+            self.expirations += 1
+            return None
+        self._entries.move_to_end(key)
+        return result
+
+    def put(self, key, result):
+        size = len(dumps_json(result))
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (time.monotonic() + self.ttl, size, result)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    async def get_or_compute(self, key, compute, group=None):
+        """命中缓存直接返回；否则执行 compute()（协程函数），key 和 group 都相同的并发请求共享同一次计算
+
+        group 是 compute 中除 key 之外影响计算过程的参数（例如截止时间、优先级），
+        只用于合并并发请求，结果仍按 key 写入缓存。识别失败（success=False）的结果不会写入缓存。
+        """
+        result = self.get(key)
+        if result is not None:
+            self.hits += 1
+            return result
+
+        flight = (key, group)
+        pending = self._in_flight.get(flight)
+        if pending is not None:
+            self.coalesced += 1
+            # shield: 某个等待者被取消时不影响其他等待者
+            return await asyncio.shield(pending)
+
+        self.misses += 1
+        # 计算放在独立的任务中：发起请求的客户端断开时，其他等待者仍能拿到结果
+        task = asyncio.ensure_future(compute())
+        self._in_flight[flight] = task
+        task.add_done_callback(lambda t: self._finish(flight, t))
+        return await asyncio.shield(task)
+
+    def _finish(self, flight, task):
+        self._in_flight.pop(flight, None)
+        if task.cancelled() or task.exception() is not None:
+            return
+        result = task.result()
+        if result.get("success"):
+            self.put(flight[0], result)
+
+    def stats(self):
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "in_flight": len(self._in_flight),
+            "hit_rate": round((self.hits + self.coalesced) / lookups, 4) if lookups else 0.0,
+        }
@@ -0,0 +1,68 @@
+import threading
+
+from app import metrics
+
+# 置信度门控的模型级联：先用小模型（例如 MobileNetV3-Small）识别，
+# top-1 置信度或 top-1 与 top-2 的差距低于阈值时再交给大模型（ResNet18）。
+# 两个模型的预处理参数相同时只解码一次，第二级直接复用第一级的预处理结果。
+# 阈值和结果中的 confidence 一样是百分比（0~100）。
+
+# /predict?model=cascade 使用级联
+CASCADE_MODEL_NAME = "cascade"
+
+STAGES = metrics.Counter("cnn_cascade_total", "Cascade predictions by answering stage", ("stage",))
+
+
+class Cascade:
+    def __init__(self, first, final, min_confidence=60.0, min_margin=0.0):
+        self.first = first
+        self.final = final
+        self.min_confidence = float(min_confidence)
+        self.min_margin = float(min_margin)
+        self._lock = threading.Lock()
+        self._answered = {first: 0, final: 0}
+
+    def should_escalate(self, result):
+        """第一级结果不够确定（或识别失败）时返回 True"""
+        if not result.get("success"):
+            return True
+        confidence, margin = confidence_and_margin(result)
+        return confidence < self.min_confidence or margin < self.min_margin
+
+    def cache_version(self, first_version, final_version):
+        """级联结果的缓存版本：两个模型的版本 + 阈值，任何一个变化时旧结果失效"""
+        return (f"cascade({first_version};{final_version};"
+                f"conf>={self.min_confidence:g};margin>={self.min_margin:g})")
+
+    def annotate(self, result, first_result, escalated):
+        """在结果中注明由哪一级给出，以及第一级的置信度/差距"""
+        stage = self.final if escalated else self.first
+        with self._lock:
+            self._answered[stage] += 1
+        STAGES.inc(stage)
+        info = {"stage": stage, "escalated": escalated}
+        if first_result.get("success"):
+            confidence, margin = confidence_and_margin(first_result)
+            info.update(first_confidence=confidence, first_margin=margin)
+        return dict(result, cascade=info)
+
+    def stats(self):
+        with self._lock:
+            answered = dict(self._answered)
+        total = sum(answered.values())
+        return {
+            "first": self.first,
+            "final": self.final,
+            "min_confidence": self.min_confidence,
+            "min_margin": self.min_margin,
+            "answered": answered,
+            "escalation_rate": round(answered[self.final] / total, 4) if total else 0.0,
+        }
+
+
+def confidence_and_margin(result):
+    """top-1 置信度，以及 top-1 与 top-2 的差距（百分比）"""
+    predictions = result["predictions"]
+    confidence = predictions[0]["confidence"]
+    runner_up = predictions[1]["confidence"] if len(predictions) > 1 else 0.0
+    return confidence, round(confidence - runner_up, 2)
@@ -0,0 +1,197 @@
+import os
+
+# 所有可调参数都通过环境变量配置（docker-compose.yml 的 environment 中设置）
+
+
+def _env_int(name, default):
+    value = os.environ.get(name)
+    if value is None or value.strip() == "":
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        print(f"⚠ 环境变量 {name}={value!r} 不是整数，使用默认值 {default}")
+        return default
+
+
+def _env_float(name, default):
+    value = os.environ.get(name)
+    if value is None or value.strip() == "":
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        print(f"⚠ 环境变量 {name}={value!r} 不是数字，使用默认值 {default}")
+        return default
+
+
+# ==== 模型文件 ====
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# 本地模型目录（scripts/export_model.py 生成），存在时启动完全不访问网络
+MODEL_DIR = os.environ.get("MODEL_DIR", os.path.join(PROJECT_DIR, "models"))
+# 本地没有模型文件时是否允许通过 torchvision 下载（离线环境设为 0）
+ALLOW_MODEL_DOWNLOAD = _env_int("ALLOW_MODEL_DOWNLOAD", 1) != 0
+
+# ==== 多模型 ====
+# 默认模型（/predict 不带 model 参数时使用，启动时预加载，不会被淘汰）
+DEFAULT_MODEL = os.environ.get("DEFAULT_MODEL", "resnet18").strip()
+# 允许通过 /predict?model= 选择的模型，逗号分隔（名称见 model_handler.MODEL_SPECS）
+AVAILABLE_MODELS = [name.strip() for name in
+                    os.environ.get("AVAILABLE_MODELS", "resnet18,resnet50,mobilenet_v3_large,mobilenet_v3_small").split(",")
+                    if name.strip()]
+if DEFAULT_MODEL not in AVAILABLE_MODELS:
+    AVAILABLE_MODELS.insert(0, DEFAULT_MODEL)
+# 已加载模型的权重内存预算（MB），超出后淘汰最久未使用且空闲的模型
+MODEL_MEMORY_BUDGET_MB = max(1, _env_int("MODEL_MEMORY_BUDGET_MB", 512))
+
+# ==== 模型级联（见 app/cascade.py） ====
+# 1: 可以通过 /predict?model=cascade 使用级联：先用小模型识别，不够确定时再交给大模型
+CASCADE_ENABLED = _env_int("CASCADE_ENABLED", 0) != 0
+# 1: 不带 model 参数的图片识别请求（/predict、/predict/batch、/jobs）也走级联
+CASCADE_DEFAULT = CASCADE_ENABLED and _env_int("CASCADE_DEFAULT", 0) != 0
+CASCADE_FIRST_MODEL = os.environ.get("CASCADE_FIRST_MODEL", "mobilenet_v3_small").strip()
+CASCADE_FINAL_MODEL = os.environ.get("CASCADE_FINAL_MODEL", DEFAULT_MODEL).strip()
+# 第一级 top-1 置信度（百分比）低于该值时升级到第二级
+CASCADE_MIN_CONFIDENCE = _env_float("CASCADE_MIN_CONFIDENCE", 60.0)
+# 第一级 top-1 与 top-2 置信度之差（百分比）低于该值时升级，0 表示不检查
+CASCADE_MIN_MARGIN = max(0.0, _env_float("CASCADE_MIN_MARGIN", 0.0))
+if CASCADE_ENABLED:
+    for _name in (CASCADE_FIRST_MODEL, CASCADE_FINAL_MODEL):
+        if _name not in AVAILABLE_MODELS:
+            AVAILABLE_MODELS.append(_name)
+
+# ==== 推理后端 ====
+# eager / channels_last / torchscript / int8_dynamic / int8_static / onnxruntime（见 app/backends.py）
+INFERENCE_BACKEND = os.environ.get("INFERENCE_BACKEND", "eager").strip().lower()
+# int8_static 量化的校准图片目录及最多使用的图片数
+CALIBRATION_DIR = os.environ.get("CALIBRATION_DIR", "")
+CALIBRATION_IMAGES = max(1, _env_int("CALIBRATION_IMAGES", 64))
+
+# ==== 动态微批处理 ====
+# 一个批次最多合并多少张图
+BATCH_MAX_SIZE = max(1, _env_int("BATCH_MAX_SIZE", 8))
+# 第一张图入队后最多等待多久（毫秒）就强制推理
+BATCH_MAX_WAIT_MS = max(0.0, _env_float("BATCH_MAX_WAIT_MS", 5.0))
+
+# ==== 独立推理进程（见 app/worker_pool.py） ====
+# >0: 分类模型的前向推理放到这么多个独立的推理进程中，服务进程只做 HTTP、解码和组批；0: 在服务进程内推理
+INFERENCE_PROCESSES = max(0, _env_int("INFERENCE_PROCESSES", 0))
+# 每个推理进程的 intra-op 线程数，0 表示按 CPU 核数平均分配
+INFERENCE_PROCESS_THREADS = max(0, _env_int("INFERENCE_PROCESS_THREADS", 0))
+# 每个推理进程在共享内存环中的批次缓冲区数：>1 时进程计算当前批次的同时，服务进程已经写好了下一批
+INFERENCE_RING_DEPTH = max(1, _env_int("INFERENCE_RING_DEPTH", 2))
+# 一个批次超过这么多秒没有返回时认为推理进程卡死，杀掉并重启
+INFERENCE_PROCESS_TIMEOUT = max(1.0, _env_float("INFERENCE_PROCESS_TIMEOUT", 30.0))
+# 推理进程启动（加载模型 + 预热）最多等待多少秒；超时或启动失败时该模型加载失败（默认模型则服务加载失败）
+INFERENCE_PROCESS_STARTUP_TIMEOUT = max(1.0, _env_float("INFERENCE_PROCESS_STARTUP_TIMEOUT", 600.0))
+
+# ==== 多进程服务 ====
+CPU_COUNT = os.cpu_count() or 1
+# HTTP 工作进程数：>1 时父进程先加载模型，再 fork 出工作进程共享同一份权重（见 app/serving.py）
+WORKERS = max(1, _env_int("WORKERS", 1))
+# 每个工作进程可用的 CPU 核数，下面的线程数默认值都按这个预算计算
+CPU_PER_WORKER = max(1, CPU_COUNT // WORKERS)
+HOST = os.environ.get("HOST", "0.0.0.0")
+PORT = _env_int("PORT", 8000)
+
+# ==== 推理执行器（让解码/预处理/推理离开 asyncio 事件循环） ====
+# thread: 线程池（PIL 解码会释放 GIL）；process: 进程池（fork 出的子进程共享已加载的模型）
+INFERENCE_EXECUTOR = os.environ.get("INFERENCE_EXECUTOR", "thread").strip().lower()
+# 解码/预处理的工作线程（进程）数
+INFERENCE_WORKERS = max(1, _env_int("INFERENCE_WORKERS", max(1, CPU_PER_WORKER // 2)))
+# 同时处于 预处理+排队+推理 阶段的请求上限，超出的请求在事件循环中异步等待
+INFERENCE_MAX_CONCURRENCY = max(1, _env_int("INFERENCE_MAX_CONCURRENCY",
+                                            max(2 * BATCH_MAX_SIZE, INFERENCE_WORKERS)))
+# 等待推理名额的请求上限（有界队列），队列满时返回 429 + Retry-After；0 表示不限制
+INFERENCE_MAX_QUEUE = max(0, _env_int("INFERENCE_MAX_QUEUE", 4 * INFERENCE_MAX_CONCURRENCY))
+# 优先级通道：interactive 请求优先获得推理名额、优先进入批次；bulk 请求（/predict/batch 等）排在后面
+PRIORITY_LANES = _env_int("PRIORITY_LANES", 1) != 0
+# 每个工作进程前向推理使用的 intra-op 线程数，0 表示自动（见 executor.configure_torch_threads）
+TORCH_NUM_THREADS = max(0, _env_int("TORCH_NUM_THREADS", 0))
+# inter-op 线程数，0 表示保持 PyTorch 默认
+TORCH_NUM_INTEROP_THREADS = max(0, _env_int("TORCH_NUM_INTEROP_THREADS", 1))
+# 1: 启动时在本机上测量几种 intra-op 线程数的推理吞吐量，使用最快的（TORCH_NUM_THREADS 作为上限参考，见 executor.thread_candidates）
+THREAD_AUTOTUNE = _env_int("THREAD_AUTOTUNE", 0) != 0
+# 自动调优时每种线程数测量多少秒
+THREAD_AUTOTUNE_SECONDS = max(0.1, _env_float("THREAD_AUTOTUNE_SECONDS", 1.0))
+
+# ==== 启动预热 ====
+# 1: 模型加载后（多进程模式下在每个工作进程中）用合成输入按各个批大小预热，完成后 /ready 才返回 200
+WARMUP_ENABLED = _env_int("WARMUP_ENABLED", 1) != 0
+# 预热的批大小（逗号分隔），默认是 1、2、4... 直到 BATCH_MAX_SIZE
+WARMUP_BATCH_SIZES = sorted({max(1, int(size)) for size in os.environ.get("WARMUP_BATCH_SIZES", "").split(",")
+                             if size.strip().isdigit()}) or sorted(
+    {min(2 ** i, BATCH_MAX_SIZE) for i in range(BATCH_MAX_SIZE.bit_length() + 1)})
+# 每个批大小跑几次（第一次通常明显更慢）
+WARMUP_ITERATIONS = max(2, _env_int("WARMUP_ITERATIONS", 3))
+
+# ==== 上传限制 ====
+# 单张图片大小上限（MB，可以是小数）
+MAX_IMAGE_BYTES = int(max(0.01, _env_float("MAX_IMAGE_MB", 5.0)) * 1024 * 1024)
+# /predict/batch 整个请求（多张图片或压缩包）的大小上限
+MAX_BATCH_REQUEST_BYTES = int(max(0.01, _env_float("MAX_BATCH_REQUEST_MB", 200.0)) * 1024 * 1024)
+# /predict/batch 一次请求最多包含的图片数（multipart 多文件或压缩包内的图片）
+BATCH_REQUEST_MAX_IMAGES = max(1, _env_int("BATCH_REQUEST_MAX_IMAGES", 256))
+# /predict/batch 一次请求中所有图片（压缩包解压后）的总大小上限
+BATCH_REQUEST_MAX_EXPANDED_BYTES = int(max(0.01, _env_float("BATCH_REQUEST_MAX_EXPANDED_MB", 512.0)) * 1024 * 1024)
+
+# ==== 图像嵌入与相似图片索引 ====
+# 向量索引目录（内存映射文件，重启后继续使用）
+EMBEDDING_INDEX_DIR = os.environ.get("EMBEDDING_INDEX_DIR", os.path.join(PROJECT_DIR, "data", "index"))
+# 粗量化器（IVF）的聚类数，0 表示始终精确搜索；向量数达到 32*INDEX_NLIST 时自动训练
+INDEX_NLIST = max(0, _env_int("INDEX_NLIST", 0))
+# 查询时搜索的最近聚类数，越大越准、越慢
+INDEX_NPROBE = max(1, _env_int("INDEX_NPROBE", 8))
+# /index/add 返回的近似重复图片的相似度阈值（余弦相似度）
+DUPLICATE_THRESHOLD = _env_float("DUPLICATE_THRESHOLD", 0.95)
+
+# ==== 异步识别任务（/jobs） ====
+# 任务、图片和结果保存在 SQLite 数据库中，服务重启后继续执行
+JOBS_DB_PATH = os.environ.get("JOBS_DB_PATH", os.path.join(PROJECT_DIR, "data", "jobs.sqlite3"))
+# 每个工作进程同时执行的任务数
+JOBS_MAX_CONCURRENT = max(1, _env_int("JOBS_MAX_CONCURRENT", 1))
+# 每个任务同时在识别中的图片数（走 bulk 通道，不会挤占交互式请求）
+JOB_ITEM_CONCURRENCY = max(1, _env_int("JOB_ITEM_CONCURRENCY", 2 * BATCH_MAX_SIZE))
+# 排队中的任务数上限，超出时 POST /jobs 返回 429
+JOBS_MAX_QUEUED = max(1, _env_int("JOBS_MAX_QUEUED", 100))
+# 一个任务最多包含的图片数，以及上传请求的大小上限
+JOB_MAX_IMAGES = max(1, _env_int("JOB_MAX_IMAGES", 10000))
+JOB_MAX_REQUEST_BYTES = int(max(0.01, _env_float("JOB_MAX_REQUEST_MB", 2048.0)) * 1024 * 1024)
+# 一个任务中所有图片（压缩包解压后）的总大小上限，防止高压缩比的压缩包解压出远超上传大小的数据
+JOB_MAX_EXPANDED_BYTES = int(max(0.01, _env_float("JOB_MAX_EXPANDED_MB", 4096.0)) * 1024 * 1024)
+# 已结束的任务保留多久（小时），0 表示一直保留
+JOBS_TTL_HOURS = max(0.0, _env_float("JOBS_TTL_HOURS", 72.0))
+
+# ==== 管理接口与请求剖析（见 app/profiling.py） ====
+# 管理员令牌（请求头 X-Admin-Token），为空时管理接口和 ?profile=1 都不可用
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+# /predict 请求的抽样剖析比例（0~1），0 表示只剖析管理员指定的请求
+PROFILE_SAMPLE_RATE = min(1.0, max(0.0, _env_float("PROFILE_SAMPLE_RATE", 0.0)))
+# Chrome trace 文件目录，最多保留 PROFILE_MAX_TRACES 个，超出时删除最旧的
+PROFILE_DIR = os.environ.get("PROFILE_DIR", os.path.join(PROJECT_DIR, "data", "profiles"))
+PROFILE_MAX_TRACES = max(1, _env_int("PROFILE_MAX_TRACES", 50))
+
+# ==== 预测日志（见 app/prediction_log.py） ====
+# 1: 把每次识别的结果（图片哈希、top-k、耗时、模型、后端）写入压缩的 JSONL 文件，供离线分析
+PREDICTION_LOG_ENABLED = _env_int("PREDICTION_LOG_ENABLED", 0) != 0
+PREDICTION_LOG_DIR = os.environ.get("PREDICTION_LOG_DIR", os.path.join(PROJECT_DIR, "data", "predictions"))
+# 单个 .jsonl.gz 文件（压缩后）的大小上限，超出后换新文件；最多保留的文件数，超出时删除最旧的
+PREDICTION_LOG_MAX_MB = max(0.01, _env_float("PREDICTION_LOG_MAX_MB", 64.0))
+PREDICTION_LOG_MAX_FILES = max(1, _env_int("PREDICTION_LOG_MAX_FILES", 20))
+# 等待写入的记录上限，写入跟不上时丢弃新记录（不阻塞识别）
+PREDICTION_LOG_QUEUE = max(1, _env_int("PREDICTION_LOG_QUEUE", 10000))
+# 攒够这么多条或距上次写入超过这么多秒时写入一次
+PREDICTION_LOG_FLUSH_RECORDS = max(1, _env_int("PREDICTION_LOG_FLUSH_RECORDS", 256))
+PREDICTION_LOG_FLUSH_SECONDS = max(0.1, _env_float("PREDICTION_LOG_FLUSH_SECONDS", 1.0))
+
+# ==== 识别结果缓存 ====
+CACHE_ENABLED = _env_int("CACHE_ENABLED", 1) != 0
+CACHE_MAX_ENTRIES = max(1, _env_int("CACHE_MAX_ENTRIES", 10000))
+CACHE_MAX_MB = max(1, _env_int("CACHE_MAX_MB", 64))
+# 缓存有效期（秒），0 表示不过期
+CACHE_TTL_SECONDS = max(0.0, _env_float("CACHE_TTL_SECONDS", 3600.0))
+
+# ==== 预处理 ====
+# 1: 使用快速预处理（JPEG 缩小解码 + NumPy 归一化）；0（默认）: 使用 torchvision 标准预处理
+# 快速预处理的结果与标准预处理有细微差别（见 app/preprocess.py 的误差容限），需要显式开启
+FAST_PREPROCESS = _env_int("FAST_PREPROCESS", 0) != 0
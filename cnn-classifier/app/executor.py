@@ -0,0 +1,250 @@
+import asyncio
+import math
+import multiprocessing
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import torch
+
+from app import metrics
+
+# 优先级通道：前面的优先
+LANES = ("interactive", "bulk")
+
+
+class QueueFullError(Exception):
+    """等待推理名额的请求已达上限（返回 429）"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"推理队列已满，请 {retry_after} 秒后重试")
+        self.retry_after = retry_after
+
+
+class DeadlineExceededError(Exception):
+    """请求的截止时间已过，不再计算（返回 504）"""
+
+    def __init__(self, stage="queue"):
+        super().__init__("请求已超过截止时间")
+        self.stage = stage
+
+
+def configure_torch_threads(num_threads=0, num_interop_threads=1, cpu_count=1, preprocess_workers=0):
+    """设置 PyTorch 线程数，避免 预处理工作线程 + 推理线程 超出 CPU 核数
+
+    前向推理由微批处理线程串行执行（同一时刻只有一个批次在跑），
+    所以推理可以使用除预处理工作线程之外的全部核心。
+    返回实际生效的 (intra_op, inter_op) 线程数。
+    """
+    if num_threads <= 0:
+        num_threads = max(1, cpu_count - preprocess_workers)
+    torch.set_num_threads(num_threads)
+
+    if num_interop_threads > 0:
+        try:
+            # 只能在任何并行任务开始前设置一次
+            torch.set_num_interop_threads(num_interop_threads)
+        except RuntimeError as e:
+            print(f"⚠ 无法设置 inter-op 线程数: {e}")
+
+    intra, inter = torch.get_num_threads(), torch.get_num_interop_threads()
+    print(f"✓ PyTorch 线程: intra-op={intra}, inter-op={inter} "
+          f"(CPU核数={cpu_count}, 预处理工作线程={preprocess_workers})")
+    return intra, inter
+
+
+def thread_candidates(cpu_count=1, preprocess_workers=0):
+    """线程自动调优要测量的 intra-op 线程数：1、2、4...，加上 configure_torch_threads 的自动值和全部核数"""
+    candidates = {2 ** i for i in range(cpu_count.bit_length()) if 2 ** i <= cpu_count}
+    candidates.update({max(1, cpu_count - preprocess_workers), cpu_count})
+    return sorted(candidates)
+
+
+def _init_process_worker():
+    # 子进程只做解码/预处理，单线程即可，避免每个子进程都开满 CPU 核数的线程
+    torch.set_num_threads(1)
+
+
+def _noop():
+    return None
+
+
+class InferenceExecutor:
+    """把 CPU 密集的解码/预处理放到线程池或进程池中执行，并限制并发请求数
+
+    - kind="thread": 线程池，PIL 解码期间会释放 GIL
+    - kind="process": 进程池（fork），子进程继承父进程已加载的分类器
+    前向推理本身在微批处理线程中进行，同样不占用事件循环。
+
+    准入控制：同时最多 max_concurrency 个请求持有名额，最多 max_queue 个请求等待名额（0 表示不限），
+    队列满时直接拒绝（QueueFullError）；等待中的 interactive 请求先于 bulk 请求获得名额；
+    带截止时间的请求等待超时后不再执行（DeadlineExceededError）。
+    """
+
+    def __init__(self, kind="thread", workers=2, max_concurrency=16, max_queue=0):
+        if kind not in ("thread", "process"):
+            print(f"⚠ 未知的执行器类型 {kind!r}，改用 thread")
+            kind = "thread"
+        self.kind = kind
+        self.workers = max(1, int(workers))
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.max_queue = max(0, int(max_queue))
+
+        self._pool = None
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._completed = 0
+        # 各通道等待名额的 asyncio.Future（只在事件循环中访问）
+        self._waiters = {lane: deque() for lane in LANES}
+        self._shed = 0
+        self._expired = 0
+        # 名额平均占用时间（指数滑动平均），用于估算 Retry-After
+        self._avg_hold = 0.0
+
+    def start(self):
+        """创建工作池（在事件循环中调用，必须早于启动任何后台线程）"""
+        if self._pool is not None:
+            return
+        if self.kind == "process":
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("fork"),
+                initializer=_init_process_worker
+            )
+            # 立即 fork 出全部子进程，而不是等到第一个请求
+            for future in [self._pool.submit(_noop) for _ in range(self.workers)]:
+                future.result()
+        else:
+            self._pool = ThreadPoolExecutor(max_workers=self.workers,
+                                            thread_name_prefix="inference")
+        queue = self.max_queue if self.max_queue else "不限"
+        print(f"✓ 推理执行器已启动 ({self.kind} x{self.workers}, "
+              f"最大并发请求={self.max_concurrency}, 最大排队={queue})")
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+            self._pool = None
+
+    def slot(self, priority="interactive", deadline=None, shed=True):
+        """并发限制：async with executor.slot(): ...
+
+        priority: interactive / bulk
+        deadline: time.monotonic() 时间，等待名额超过该时间时抛出 DeadlineExceededError
+        shed: 队列已满时是否拒绝（False 时不计入上限，用于已经被接纳的请求内部的子任务）
+        """
+        return _Slot(self, priority if priority in LANES else LANES[0], deadline, shed)
+
+    @property
+    def waiting(self):
+        return sum(len(waiters) for waiters in self._waiters.values())
+
+    def retry_after(self):
+        """按当前排队长度和名额平均占用时间估算的重试等待秒数"""
+        estimate = (self.waiting + 1) * self._avg_hold / self.max_concurrency
+        return int(min(60, max(1, math.ceil(estimate))))
+
+    def check_admission(self):
+        """队列已满时抛出 QueueFullError（请求开始处理前调用，例如批量请求整体的准入）"""
+        if self.max_queue and self.waiting >= self.max_queue:
+            self._shed += 1
+            metrics.REJECTIONS.inc("queue_full")
+            raise QueueFullError(self.retry_after())
+
+    def record_expired(self, stage):
+        """统计过期请求（arrival: 到达时已过期；queue: 等待名额时过期）"""
+        self._expired += 1
+        metrics.DEADLINE_EXPIRED.inc(stage)
+
+    async def _acquire(self, priority, deadline, shed):
+        if self._in_flight < self.max_concurrency and not self.waiting:
+            self._in_flight += 1
+            return
+        if shed:
+            self.check_admission()
+        timeout = None
+        if deadline is not None:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                self.record_expired("queue")
+                raise DeadlineExceededError("queue")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters[priority].append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                # 名额已经交给了这个请求，归还
+                self._release()
+            else:
+                waiter.cancel()
+                self._remove_waiter(priority, waiter)
+            if isinstance(e, asyncio.TimeoutError):
+                self.record_expired("queue")
+                raise DeadlineExceededError("queue")
+            raise
+
+    def _remove_waiter(self, priority, waiter):
+        try:
+            self._waiters[priority].remove(waiter)
+        except ValueError:
+            pass
+
+    def _release(self):
+        # 名额直接交给下一个等待者（interactive 优先），in_flight 不变
+        for lane in LANES:
+            waiters = self._waiters[lane]
+            while waiters:
+                waiter = waiters.popleft()
+                if not waiter.done():
+                    waiter.set_result(None)
+                    return
+        self._in_flight -= 1
+
+    async def run(self, fn, *args):
+        """在工作池中执行 fn(*args)，不阻塞事件循环"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._pool, fn, *args)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "kind": self.kind,
+                "workers": self.workers,
+                "max_concurrency": self.max_concurrency,
+                "max_queue": self.max_queue,
+                "in_flight": self._in_flight,
+                "waiting": self.waiting,
+                "waiting_by_lane": {lane: len(waiters) for lane, waiters in self._waiters.items()},
+                "completed": self._completed,
+                "shed": self._shed,
+                "expired": self._expired,
+                "avg_slot_seconds": round(self._avg_hold, 4),
+                "torch_threads": torch.get_num_threads(),
+                "torch_interop_threads": torch.get_num_interop_threads(),
+            }
+
+
+class _Slot:
+    def __init__(self, executor, priority, deadline, shed):
+        self.executor = executor
+        self.priority = priority
+        self.deadline = deadline
+        self.shed = shed
+        self._acquired_at = None
+
+    async def __aenter__(self):
+        await self.executor._acquire(self.priority, self.deadline, self.shed)
+        self._acquired_at = time.monotonic()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        ex = self.executor
+        held = time.monotonic() - self._acquired_at
+        with ex._lock:
+            ex._completed += 1
+            ex._avg_hold = held if ex._completed == 1 else 0.9 * ex._avg_hold + 0.1 * held
+        ex._release()
+        return False
@@ -0,0 +1,104 @@
+"""独立推理进程（由 app/worker_pool.py 启动，不需要手动运行）
+
+    python -m app.inference_worker --fd 5 --arch resnet18 --shm psm_xxx --segments 4 --batch-size 8 ...
+
+就绪后回复 ("ready", 编号, 预热耗时, 后端/模型版本/权重内存)，加载失败时回复 ("failed", 编号, 原因) 后退出；之后从控制连接（socketpair 的一端，通过 --fd 传入）接收 (序号, 缓冲区编号, 图片数, 是否剖析)，
+对共享内存中该缓冲区的输入做前向推理和 softmax，把概率写回同一缓冲区的输出区，再回复 (序号, 错误, 推理秒数, 剖析结果)。
+需要剖析的批次在 torch.profiler 下执行，剖析结果是 (开始时的 perf_counter 时间, Chrome trace 事件)，否则为 None。
+收到 None 或连接断开（服务进程退出）时退出。
+"""
+import argparse
+import functools
+import signal
+import sys
+import time
+from multiprocessing.connection import Connection
+
+import torch
+
+from app import config, profiling
+from app.executor import configure_torch_threads
+from app.model_handler import ImageClassifier
+from app.registry import estimate_model_bytes
+from app.worker_pool import TensorRing
+
+
+def _forward(classifier, inputs, outputs):
+    """一个批次的前向推理：inputs/outputs 是共享内存段中本批次的视图，概率直接写入 outputs"""
+    with torch.no_grad():
+        logits = classifier.backend(inputs)
+        outputs.copy_(torch.softmax(logits.float(), dim=1))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="独立推理进程")
+    parser.add_argument("--fd", type=int, required=True, help="控制连接的文件描述符")
+    parser.add_argument("--index", type=int, default=0)
+    parser.add_argument("--arch", required=True)
+    parser.add_argument("--shm", required=True, help="共享内存名")
+    parser.add_argument("--segments", type=int, required=True)
+    parser.add_argument("--batch-size", type=int, required=True)
+    parser.add_argument("--crop", type=int, required=True)
+    parser.add_argument("--classes", type=int, required=True)
+    parser.add_argument("--threads", type=int, default=1)
+    args = parser.parse_args()
+
+    # Ctrl+C 由服务进程处理，推理进程等服务进程通知或连接断开后再退出
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    conn = Connection(args.fd)
+    configure_torch_threads(args.threads, num_interop_threads=1, cpu_count=args.threads)
+
+    try:
+        classifier = ImageClassifier(arch=args.arch)
+        ring = TensorRing(args.segments, args.batch_size, args.crop, args.classes, name=args.shm)
+        warmup = None
+        if config.WARMUP_ENABLED:
+            warmup = classifier.warmup(config.WARMUP_BATCH_SIZES, config.WARMUP_ITERATIONS)
+    except Exception as e:
+        # 把失败原因告诉服务进程（模型加载失败时服务进程不再等待，直接报错）
+        conn.send(("failed", args.index, f"{type(e).__name__}: {e}"))
+        return 1
+    # 实际使用的后端（构建失败时可能回退到 eager）、模型版本和权重内存，由服务进程记录
+    conn.send(("ready", args.index, warmup, {
+        "backend": classifier.backend.name,
+        "backend_description": classifier.backend.description,
+        "model_version": classifier.model_version,
+        "memory_bytes": estimate_model_bytes(classifier),
+    }))
+
+    # 输入/输出直接映射到共享内存，不复制
+    inputs = torch.from_numpy(ring.inputs)
+    outputs = torch.from_numpy(ring.outputs)
+    run = None
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            break
+        if message is None:
+            break
+        seq, segment, count, profile = message
+        run = functools.partial(_forward, classifier, inputs[segment, :count], outputs[segment, :count])
+        started = time.perf_counter()
+        captured = None
+        try:
+            if profile:
+                _, profile_started, profiler = profiling.capture(run)
+                seconds = time.perf_counter() - started
+                # 导出在回复之前完成，被剖析的批次会多等这一段时间
+                captured = (profile_started, profiling.export_events(profiler))
+            else:
+                run()
+                seconds = time.perf_counter() - started
+        except Exception as e:
+            conn.send((seq, f"推理失败: {e}", time.perf_counter() - started, None))
+        else:
+            conn.send((seq, None, seconds, captured))
+    # 关闭共享内存之前释放所有指向它的张量视图
+    del inputs, outputs, run
+    ring.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,375 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+# 异步识别任务（/jobs）：
+#   POST /jobs 把图片（或压缩包中的图片）写入 SQLite 后立即返回任务 id，后台工作协程按优先级领取任务，
+#   分页读出待识别的图片、通过微批处理推理（bulk 通道）、把结果写回数据库。
+#   图片和结果都在数据库中，服务重启后未完成的任务会继续执行，结果可以分页查询。
+# 多个工作进程（WORKERS>1）共用同一个数据库：领取任务在写事务中完成，同一个任务只会被一个进程执行；
+# 进程异常退出后，它正在执行的任务在心跳超时后重新排队。
+
+STATUSES = ("queued", "running", "completed", "failed", "cancelled")
+# 上传中的任务（图片正在分批写入）不会被领取，上传完成后变为 queued
+UPLOADING = "uploading"
+FINISHED = ("completed", "failed", "cancelled")
+MIN_PRIORITY, MAX_PRIORITY, DEFAULT_PRIORITY = 0, 9, 5
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    priority INTEGER NOT NULL,
+    model TEXT,
+    top_k INTEGER NOT NULL,
+    total INTEGER NOT NULL,
+    done INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    worker TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    heartbeat_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (status, priority DESC, created_at);
+CREATE TABLE IF NOT EXISTS job_items (
+    job_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    filename TEXT,
+    data BLOB,
+    success INTEGER,
+    result TEXT,
+    PRIMARY KEY (job_id, idx)
+);
+"""
+
+
+class JobStore:
+    """任务和图片/结果的 SQLite 存储（所有方法都是同步的，由调用方放到线程中执行）"""
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock:
+            # WAL：读（查询进度）和写（保存结果）互不阻塞
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(_SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _transaction(self, fn):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(self._conn)
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            return result
+
+    def _query(self, sql, args=()):
+        with self._lock:
+            return self._conn.execute(sql, args).fetchall()
+
+    # 创建任务分三步：begin -> add_items（可多次，每次一个短事务）-> submit，
+    # 图片不需要全部放在内存中，写入大任务期间其他查询也不会长时间等待数据库锁
+    def begin(self, model=None, top_k=5, priority=DEFAULT_PRIORITY):
+        """创建一个上传中的任务，返回任务 id"""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        self._transaction(lambda conn: conn.execute(
+            "INSERT INTO jobs (id, status, priority, model, top_k, total, created_at, heartbeat_at) "
+            "VALUES (?, ?, ?, ?, ?, 0, ?, ?)", (job_id, UPLOADING, priority, model, top_k, now, now)))
+        return job_id
+
+    def add_items(self, job_id, start, items):
+        """items: [(文件名, 图片字节)]，编号从 start 开始"""
+        def insert(conn):
+            conn.executemany("INSERT INTO job_items (job_id, idx, filename, data) VALUES (?, ?, ?, ?)",
+                             ((job_id, start + i, name, data) for i, (name, data) in enumerate(items)))
+            conn.execute("UPDATE jobs SET total = total + ?, heartbeat_at = ? WHERE id = ?",
+                         (len(items), time.time(), job_id))
+        self._transaction(insert)
+
+    def submit(self, job_id):
+        """上传完成，任务开始排队"""
+        self._transaction(lambda conn: conn.execute(
+            "UPDATE jobs SET status = 'queued', heartbeat_at = NULL WHERE id = ? AND status = ?", (job_id, UPLOADING)))
+
+    def discard(self, job_id):
+        """删除上传失败的任务"""
+        def discard(conn):
+            conn.execute("DELETE FROM job_items WHERE job_id = ?", (job_id,))
+            conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+        self._transaction(discard)
+
+    def claim(self, worker):
+        """领取优先级最高、最早提交的排队任务，返回任务字典或 None"""
+        def claim(conn):
+            row = conn.execute("SELECT * FROM jobs WHERE status = 'queued' "
+                               "ORDER BY priority DESC, created_at LIMIT 1").fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            conn.execute("UPDATE jobs SET status = 'running', worker = ?, started_at = COALESCE(started_at, ?), "
+                         "heartbeat_at = ? WHERE id = ?", (worker, now, now, row["id"]))
+            return dict(row, status="running")
+        return self._transaction(claim)
+
+    def pending_items(self, job_id, limit):
+        return self._query("SELECT idx, data FROM job_items WHERE job_id = ? AND success IS NULL "
+                           "ORDER BY idx LIMIT ?", (job_id, limit))
+
+    def save_results(self, job_id, results):
+        """results: [(idx, 是否成功, 结果字典)]；图片数据在识别完成后删除，返回任务当前状态"""
+        def save(conn):
+            conn.executemany("UPDATE job_items SET success = ?, result = ?, data = NULL WHERE job_id = ? AND idx = ?",
+                             ((int(ok), json.dumps(result, ensure_ascii=False), job_id, idx)
+                              for idx, ok, result in results))
+            failed = sum(1 for _, ok, _ in results if not ok)
+            conn.execute("UPDATE jobs SET done = done + ?, failed = failed + ?, heartbeat_at = ? WHERE id = ?",
+                         (len(results), failed, time.time(), job_id))
+            return conn.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()["status"]
+        return self._transaction(save)
+
+    def finish(self, job_id, status, error=None):
+        """结束任务（已取消的任务保持 cancelled）"""
+        def finish(conn):
+            conn.execute("UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ? AND status = 'running'",
+                         (status, error, time.time(), job_id))
+            if status in FINISHED:
+                # 没有识别的图片不再需要
+                conn.execute("UPDATE job_items SET data = NULL WHERE job_id = ? AND success IS NULL", (job_id,))
+        self._transaction(finish)
+
+    def requeue(self, job_id):
+        """服务停止时把正在执行的任务放回队列，下次启动继续"""
+        self._transaction(lambda conn: conn.execute(
+            "UPDATE jobs SET status = 'queued', worker = NULL WHERE id = ? AND status = 'running'", (job_id,)))
+
+    def cancel(self, job_id):
+        """取消排队中或执行中的任务，返回取消后的任务（不存在时返回 None）"""
+        def cancel(conn):
+            conn.execute("UPDATE jobs SET status = 'cancelled', finished_at = ? "
+                         "WHERE id = ? AND status IN ('queued', 'running')", (time.time(), job_id))
+            conn.execute("UPDATE job_items SET data = NULL WHERE job_id = ? AND success IS NULL", (job_id,))
+        self._transaction(cancel)
+        return self.get(job_id)
+
+    def get(self, job_id):
+        rows = self._query("SELECT * FROM jobs WHERE id = ?", (job_id,))
+        return dict(rows[0]) if rows else None
+
+    def results(self, job_id, offset=0, limit=100):
+        """已完成的图片结果，按输入顺序分页：[(idx, 文件名, 结果字典)]"""
+        rows = self._query("SELECT idx, filename, result FROM job_items WHERE job_id = ? AND success IS NOT NULL "
+                           "ORDER BY idx LIMIT ? OFFSET ?", (job_id, limit, offset))
+        return [(row["idx"], row["filename"], json.loads(row["result"])) for row in rows]
+
+    def list(self, limit=50, status=None):
+        if status:
+            rows = self._query("SELECT * FROM jobs WHERE status = ? ORDER BY created_at DESC LIMIT ?", (status, limit))
+        else:
+            rows = self._query("SELECT * FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,))
+        return [dict(row) for row in rows]
+
+    def counts(self):
+        rows = self._query("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status")
+        counts = {status: 0 for status in STATUSES}
+        counts.update({row["status"]: row["n"] for row in rows})
+        return counts
+
+    def recover(self, stale_seconds):
+        """把心跳超时的 running 任务（执行它的进程已经退出）放回队列，返回数量；
+        同时删除上传到一半时进程退出而留下的任务"""
+        def recover(conn):
+            cutoff = time.time() - stale_seconds
+            cursor = conn.execute("UPDATE jobs SET status = 'queued', worker = NULL "
+                                  "WHERE status = 'running' AND COALESCE(heartbeat_at, 0) < ?", (cutoff,))
+            recovered = cursor.rowcount
+            abandoned = [row["id"] for row in conn.execute(
+                "SELECT id FROM jobs WHERE status = ? AND COALESCE(heartbeat_at, 0) < ?", (UPLOADING, cutoff))]
+            for job_id in abandoned:
+                conn.execute("DELETE FROM job_items WHERE job_id = ?", (job_id,))
+                conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+            return recovered
+        return self._transaction(recover)
+
+    def heartbeat(self, job_id):
+        self._transaction(lambda conn: conn.execute(
+            "UPDATE jobs SET heartbeat_at = ? WHERE id = ?", (time.time(), job_id)))
+
+    def purge(self, ttl_seconds):
+        """删除结束超过 ttl_seconds 的任务及其结果，返回删除的任务数"""
+        def purge(conn):
+            expired = [row["id"] for row in conn.execute(
+                "SELECT id FROM jobs WHERE status IN ('completed', 'failed', 'cancelled') AND finished_at < ?",
+                (time.time() - ttl_seconds,))]
+            for job_id in expired:
+                conn.execute("DELETE FROM job_items WHERE job_id = ?", (job_id,))
+                conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+            return len(expired)
+        return self._transaction(purge)
+
+
+def job_view(job):
+    """接口返回的任务状态"""
+    total = job["total"]
+    return {
+        "job_id": job["id"],
+        "status": job["status"],
+        "priority": job["priority"],
+        "model": job["model"],
+        "top_k": job["top_k"],
+        "total": total,
+        "done": job["done"],
+        "failed": job["failed"],
+        "progress": round(job["done"] / total, 4) if total else 1.0,
+        "error": job["error"],
+        "created_at": job["created_at"],
+        "started_at": job["started_at"],
+        "finished_at": job["finished_at"],
+    }
+
+
+class JobManager:
+    """在事件循环中运行的任务工作协程
+
+    同时最多执行 max_concurrent 个任务；每个任务同时最多 item_concurrency 张图片在识别中，
+    这些图片走微批处理的 bulk 通道，交互式请求（/predict）总是先拿到推理名额、先进入批次。
+    classify(contents, model, top_k) 是识别单张图片的协程函数。
+    """
+
+    def __init__(self, store, classify, max_concurrent=1, item_concurrency=16, page_size=64,
+                 stale_seconds=120.0, ttl_seconds=0.0, poll_seconds=5.0):
+        self.store = store
+        self.classify = classify
+        self.max_concurrent = max(1, int(max_concurrent))
+        self.item_concurrency = max(1, int(item_concurrency))
+        self.page_size = max(1, int(page_size))
+        self.stale_seconds = stale_seconds
+        self.ttl_seconds = ttl_seconds
+        self.poll_seconds = poll_seconds
+        self.worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._tasks = []
+        self._wakeup = None
+        self._running = {}
+        self.completed = 0
+        # 各状态的任务数：由工作协程在线程中刷新，/health 只读这份快照，不在事件循环中查询数据库
+        self._counts = None
+        self._counts_at = None
+
+    async def start(self):
+        recovered = await asyncio.to_thread(self.store.recover, self.stale_seconds)
+        await self.counts()
+        if recovered:
+            print(f"✓ {recovered} 个未完成的识别任务重新排队")
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.max_concurrent)]
+        print(f"✓ 异步识别任务已启动 (并发任务={self.max_concurrent}, 每个任务并发图片={self.item_concurrency})")
+
+    async def stop(self):
+        # 没做完的任务在取消时放回队列，重启后继续（已保存的结果不会重复计算）
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def counts(self):
+        """查询各状态的任务数（在线程中），同时更新 stats() 中的快照"""
+        counts = await asyncio.to_thread(self.store.counts)
+        self._counts, self._counts_at = counts, time.time()
+        return counts
+
+    def notify(self):
+        """有新任务时唤醒空闲的工作协程"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _worker(self):
+        while True:
+            job = await asyncio.to_thread(self.store.claim, self.worker_id)
+            if job is None:
+                # 其他进程提交的任务只能靠轮询发现；顺便清理过期任务、回收心跳超时的任务
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_seconds)
+                except asyncio.TimeoutError:
+                    await asyncio.to_thread(self._housekeeping)
+                    await self.counts()
+                continue
+            await self.counts()
+            await self._run(job)
+            await self.counts()
+
+    def _housekeeping(self):
+        self.store.recover(self.stale_seconds)
+        if self.ttl_seconds:
+            self.store.purge(self.ttl_seconds)
+
+    async def _run(self, job):
+        job_id = job["id"]
+        self._running[job_id] = job
+        limit = asyncio.Semaphore(self.item_concurrency)
+        # 一页图片在繁忙时可能要等很久（bulk 通道让位给交互式请求），心跳单独维持
+        heartbeat = asyncio.ensure_future(self._heartbeat(job_id))
+
+        async def run_one(idx, data):
+            async with limit:
+                try:
+                    result = await self.classify(data, job["model"], job["top_k"])
+                except Exception as e:
+                    result = {"success": False, "error": str(e)}
+            return idx, bool(result.get("success")), result
+
+        try:
+            while True:
+                rows = await asyncio.to_thread(self.store.pending_items, job_id, self.page_size)
+                if not rows:
+                    break
+                results = await asyncio.gather(*[run_one(row["idx"], row["data"]) for row in rows])
+                status = await asyncio.to_thread(self.store.save_results, job_id, results)
+                if status != "running":
+                    # 已被取消
+                    break
+            await asyncio.to_thread(self.store.finish, job_id, "completed")
+            self.completed += 1
+        except asyncio.CancelledError:
+            self.store.requeue(job_id)
+            raise
+        except Exception as e:
+            print(f"✗ 识别任务 {job_id} 失败: {e}")
+            await asyncio.to_thread(self.store.finish, job_id, "failed", str(e))
+        finally:
+            heartbeat.cancel()
+            self._running.pop(job_id, None)
+
+    async def _heartbeat(self, job_id):
+        while True:
+            await asyncio.sleep(self.stale_seconds / 4)
+            await asyncio.to_thread(self.store.heartbeat, job_id)
+
+    def stats(self):
+        return {
+            "worker": self.worker_id,
+            "max_concurrent": self.max_concurrent,
+            "item_concurrency": self.item_concurrency,
+            "running": list(self._running),
+            "completed_here": self.completed,
+            "jobs": self._counts,
+            "jobs_counted_at": self._counts_at,
+        }
@@ -1,19 +1,83 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi import FastAPI, File, UploadFile, HTTPException, Query, Request, WebSocket
+from fastapi.responses import FileResponse, HTMLResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-import uvicorn
+from starlette.background import BackgroundTask
+import asyncio
+import hashlib
+import hmac
+import json
 import os
+import random
 import sys
+import time
+from typing import List, Optional
 
 # 添加当前目录到Python路径
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-try:
-    from app.model_handler import classifier
-    MODEL_LOADED = True
-except Exception as e:
-    print(f"模型加载失败: {e}")
-    MODEL_LOADED = False
+from app import config, metrics
+from app.archive import ArchiveError, is_archive, iter_archive_images
+from app.batcher import MicroBatcher
+from app.cache import ResultCache, content_digest
+from app.cascade import CASCADE_MODEL_NAME, Cascade
+from app.jobs import DEFAULT_PRIORITY, MAX_PRIORITY, MIN_PRIORITY, STATUSES, JobManager, JobStore, job_view
+from app.executor import (LANES, DeadlineExceededError, InferenceExecutor, QueueFullError, configure_torch_threads,
+                          thread_candidates)
+from app.prediction_log import PredictionLog, make_record
+from app.profiling import RequestTrace, TraceStore
+from app.serving import process_memory, serve
+from app.streams import POLICIES, STREAMS, FrameStream
+from app.tensors import MAX_NPY_HEADER_BYTES, NPY_MEDIA_TYPES, TensorError, parse_npy, parse_raw, split_images
+from app.uploads import UploadError, UploadLimitMiddleware, UploadTooLargeError, format_size, read_image_upload
+from app.vector_index import VectorIndex, VectorIndexError
+
+# 在加载模型之前设置PyTorch线程数（inter-op线程数只能在开始并行计算前设置）
+_intra_op_threads, _inter_op_threads = configure_torch_threads(
+    num_threads=config.TORCH_NUM_THREADS,
+    num_interop_threads=config.TORCH_NUM_INTEROP_THREADS,
+    cpu_count=config.CPU_PER_WORKER,
+    preprocess_workers=config.INFERENCE_WORKERS
+)
+
+from app import model_handler
+from app.model_handler import EmbeddingModel, ImageClassifier, preprocess_image_timed
+from app.registry import ModelRegistry, UnknownModelError
+from app.responses import (DEFAULT_TOP_K, JSON_ENCODER, MAX_TOP_K, dumps_json, encode, encoded_response, parse_fields,
+                           shape_result, wants_msgpack)
+from app.worker_pool import WorkerPoolBatcher
+
+# 进程启动时间，用于统计 启动 -> 就绪 -> 首次识别 的耗时
+PROCESS_START = time.time()
+
+# 模型在服务开始监听之后才在后台加载，下面这些对象加载完成后才创建
+# classifier 是默认模型；其他模型由 registry 按需加载，每个模型有自己的微批处理队列
+classifier = None
+registry = None
+result_cache = None
+executor = None
+# 模型级联（CASCADE_ENABLED=1 时创建）
+cascade = None
+# 默认模型的嵌入（倒数第二层特征）微批处理队列，以及磁盘上的相似图片索引
+embedding_batcher = None
+vector_index = None
+index_error = None
+# 异步识别任务（/jobs）
+job_manager = None
+jobs_error = None
+# 请求剖析的 trace 目录（第一次用到时创建）
+trace_store = None
+# 预测日志（PREDICTION_LOG_ENABLED=1 时创建）
+prediction_log = None
+MODEL_LOADED = False
+# loading / ready / failed
+model_status = "loading"
+startup_timings = {}
+# 实际使用的 PyTorch 线程配置（THREAD_AUTOTUNE=1 时启动后更新），/health 中展示
+thread_config = {
+    "intra_op": _intra_op_threads,
+    "inter_op": _inter_op_threads,
+    "source": "config" if config.TORCH_NUM_THREADS else "auto",
+}
 
 app = FastAPI(
     title="CNN图像分类API服务",
@@ -23,7 +87,18 @@ app = FastAPI(
     redoc_url="/redoc"
 )
 
-# 允许跨域请求
+# 上传大小限制：Content-Length 超限直接返回413，分块上传边接收边检查
+app.add_middleware(UploadLimitMiddleware, limits={
+    "/predict": config.MAX_IMAGE_BYTES,
+    "/embed": config.MAX_IMAGE_BYTES,
+    "/index/add": config.MAX_IMAGE_BYTES,
+    "/index/query": config.MAX_IMAGE_BYTES,
+    "/predict/batch": config.MAX_BATCH_REQUEST_BYTES,
+    "/jobs": config.JOB_MAX_REQUEST_BYTES,
+    # 最多 BATCH_REQUEST_MAX_IMAGES 张 224x224x3 uint8 图像
+    "/predict/tensor": config.BATCH_REQUEST_MAX_IMAGES * 3 * 224 * 224 + MAX_NPY_HEADER_BYTES,
+})
+# 允许跨域请求（后添加的中间件在外层：上传限制返回的413也带有跨域响应头）
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -31,6 +106,231 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# 请求数/状态码/耗时统计（/metrics）
+app.add_middleware(metrics.MetricsMiddleware)
+
+# 抓取 /metrics 时才计算的指标
+metrics.Gauge("cnn_inference_in_flight", "Requests holding an inference slot",
+              lambda: executor.stats()["in_flight"] if executor is not None else 0)
+metrics.Gauge("cnn_inference_waiting", "Requests waiting for an inference slot",
+              lambda: executor.stats()["waiting"] if executor is not None else 0)
+def _batch_queue_depths():
+    if registry is None:
+        return {}
+    return {(name,): registry.entry(name).batcher.queue_depth()
+            for name in registry.names if registry.entry(name).loaded}
+
+metrics.Gauge("cnn_batch_queue_depth", "Images queued for the micro-batcher, per model",
+              _batch_queue_depths, labelnames=("model",))
+metrics.Gauge("cnn_model_ready", "1 once the default model is loaded",
+              lambda: 1 if MODEL_LOADED else 0)
+
+@app.on_event("startup")
+async def start_inference():
+    global prediction_log
+    if config.PREDICTION_LOG_ENABLED:
+        # 写入线程在 fork 之后（每个工作进程各自）启动
+        prediction_log = PredictionLog(
+            config.PREDICTION_LOG_DIR,
+            max_file_bytes=config.PREDICTION_LOG_MAX_MB * 1024 * 1024,
+            max_files=config.PREDICTION_LOG_MAX_FILES,
+            queue_size=config.PREDICTION_LOG_QUEUE,
+            flush_records=config.PREDICTION_LOG_FLUSH_RECORDS,
+            flush_seconds=config.PREDICTION_LOG_FLUSH_SECONDS
+        )
+        prediction_log.start()
+    # 不在这里等待模型加载：先让服务监听端口，/health 立即可用，/ready 在加载完成后才返回200
+    app.state.model_loader = asyncio.ensure_future(_load_model_in_background())
+
+@app.on_event("shutdown")
+async def stop_inference():
+    if registry is not None:
+        registry.stop()
+    if job_manager is not None:
+        await job_manager.stop()
+    if embedding_batcher is not None:
+        embedding_batcher.stop()
+    if executor is not None:
+        executor.shutdown()
+    if prediction_log is not None:
+        prediction_log.stop()
+
+def _create_batcher(model_classifier, in_process=False):
+    # 动态微批处理：并发请求合并成一次前向推理（每个模型一个队列）
+    if config.INFERENCE_PROCESSES > 0 and not in_process:
+        # 前向推理放到独立的推理进程中，输入/输出经共享内存传递
+        return WorkerPoolBatcher(
+            model_classifier,
+            max_batch_size=config.BATCH_MAX_SIZE,
+            max_wait_ms=config.BATCH_MAX_WAIT_MS,
+            processes=config.INFERENCE_PROCESSES,
+            depth=config.INFERENCE_RING_DEPTH,
+            threads=config.INFERENCE_PROCESS_THREADS,
+            timeout=config.INFERENCE_PROCESS_TIMEOUT,
+            startup_timeout=config.INFERENCE_PROCESS_STARTUP_TIMEOUT
+        )
+    return MicroBatcher(
+        model_classifier,
+        max_batch_size=config.BATCH_MAX_SIZE,
+        max_wait_ms=config.BATCH_MAX_WAIT_MS
+    )
+
+async def _load_model_in_background():
+    global classifier, registry, result_cache, executor, cascade, embedding_batcher, MODEL_LOADED, model_status
+    started = time.time()
+    # 模型加载是CPU/IO密集操作，放到线程中执行，不阻塞事件循环
+    loaded = await asyncio.to_thread(model_handler.load_classifier)
+    startup_timings["model_load_seconds"] = round(time.time() - started, 3)
+    if loaded is None:
+        model_status = "failed"
+        return
+    
+    classifier = loaded
+    
+    # 按图片内容缓存识别结果，并合并同时到达的相同图片
+    if config.CACHE_ENABLED:
+        result_cache = ResultCache(
+            max_entries=config.CACHE_MAX_ENTRIES,
+            max_bytes=config.CACHE_MAX_MB * 1024 * 1024,
+            ttl_seconds=config.CACHE_TTL_SECONDS
+        )
+    
+    # 解码/预处理在工作池中执行，事件循环只负责收发请求
+    # 先创建执行器（进程池需要在启动后台线程之前fork）
+    executor = InferenceExecutor(
+        kind=config.INFERENCE_EXECUTOR,
+        workers=config.INFERENCE_WORKERS,
+        max_concurrency=config.INFERENCE_MAX_CONCURRENCY,
+        max_queue=config.INFERENCE_MAX_QUEUE
+    )
+    executor.start()
+    
+    # 推理后端构建、线程调优和预热在进程池 fork 之后进行（父进程做过多线程计算后再 fork，子进程里的 OpenMP 线程池不可用）
+    started = time.time()
+    await asyncio.to_thread(model_handler.build_deferred_backend)
+    await asyncio.to_thread(_tune_threads, classifier)
+    await asyncio.to_thread(_warm_up, classifier)
+    startup_timings["warmup_seconds"] = round(time.time() - started, 3)
+    
+    # 多模型注册表：默认模型常驻，其他模型在第一次被请求时加载
+    registry = ModelRegistry(
+        config.AVAILABLE_MODELS,
+        default=classifier.arch,
+        # 独立推理进程模式下服务进程中只需要标签和结果整理数据，权重只在推理进程中加载
+        loader=lambda name: _warm_up(ImageClassifier(arch=name, load_model=not config.INFERENCE_PROCESSES)),
+        batcher_factory=_create_batcher,
+        memory_budget_bytes=config.MODEL_MEMORY_BUDGET_MB * 1024 * 1024
+    )
+    entry = registry.adopt(classifier.arch, classifier)
+    # 使用独立推理进程时等它们加载完模型并预热；推理进程加载失败或超时时服务加载失败（/ready 给出原因）
+    try:
+        await registry.wait_ready(entry)
+    except RuntimeError as e:
+        model_handler.load_error = str(e)
+        model_status = "failed"
+        return
+    cascade = _create_cascade()
+    
+    # 嵌入请求使用默认模型，有自己的微批处理队列（输出特征而不是 top-k），始终在服务进程内推理
+    embedding_batcher = _create_batcher(EmbeddingModel(classifier), in_process=True)
+    embedding_batcher.start()
+    await asyncio.to_thread(_open_vector_index, classifier)
+    
+    MODEL_LOADED = True
+    model_status = "ready"
+    await _start_jobs()
+    startup_timings["ready_after_seconds"] = round(time.time() - PROCESS_START, 3)
+    print(f"✓ 服务就绪，启动耗时 {startup_timings['ready_after_seconds']}s")
+
+def _tune_threads(model_classifier):
+    """THREAD_AUTOTUNE=1 时在本机上测量几种 intra-op 线程数，使用吞吐量最高的（阻塞，在线程中调用）"""
+    if not config.THREAD_AUTOTUNE or config.INFERENCE_PROCESSES:
+        return
+    candidates = thread_candidates(config.CPU_PER_WORKER, config.INFERENCE_WORKERS)
+    chosen, results = model_classifier.autotune_threads(candidates, config.BATCH_MAX_SIZE,
+                                                        seconds=config.THREAD_AUTOTUNE_SECONDS)
+    thread_config.update(intra_op=chosen, source="autotune", autotune=results)
+    print(f"✓ 线程自动调优: intra-op={chosen} ("
+          + ", ".join(f"{r['intra_op']}线程 {r['images_per_second']}img/s" for r in results) + ")")
+
+def _warm_up(model_classifier):
+    """用合成输入按 WARMUP_BATCH_SIZES 预热（阻塞，在线程中调用），返回分类器本身
+
+    使用独立推理进程时服务进程内不做分类推理，由各推理进程自己预热。
+    """
+    if config.WARMUP_ENABLED and not config.INFERENCE_PROCESSES:
+        timings = model_classifier.warmup(config.WARMUP_BATCH_SIZES, config.WARMUP_ITERATIONS)
+        print(f"✓ 模型 {model_classifier.arch} 预热完成: "
+              + ", ".join(f"batch={size} {t['first_ms']}ms -> {t['steady_ms']}ms" for size, t in timings.items()))
+    return model_classifier
+
+def _create_cascade():
+    if not config.CASCADE_ENABLED:
+        return None
+    for name in (config.CASCADE_FIRST_MODEL, config.CASCADE_FINAL_MODEL):
+        if name not in model_handler.MODEL_SPECS:
+            print(f"✗ 模型级联不可用: 不支持的模型 {name}")
+            return None
+    print(f"✓ 模型级联: {config.CASCADE_FIRST_MODEL} -> {config.CASCADE_FINAL_MODEL} "
+          f"(置信度<{config.CASCADE_MIN_CONFIDENCE:g}% 或差距<{config.CASCADE_MIN_MARGIN:g}% 时升级)")
+    return Cascade(config.CASCADE_FIRST_MODEL, config.CASCADE_FINAL_MODEL,
+                   min_confidence=config.CASCADE_MIN_CONFIDENCE, min_margin=config.CASCADE_MIN_MARGIN)
+
+def _open_vector_index(model_classifier):
+    global vector_index, index_error
+    try:
+        vector_index = VectorIndex(
+            config.EMBEDDING_INDEX_DIR,
+            dim=model_classifier.embedding_dim,
+            model_version=model_classifier.model_version,
+            nlist=config.INDEX_NLIST,
+            nprobe=config.INDEX_NPROBE
+        )
+        index_error = None
+        print(f"✓ 相似图片索引: {config.EMBEDDING_INDEX_DIR}（{vector_index.count} 条）")
+    except Exception as e:
+        index_error = str(e)
+        print(f"✗ 相似图片索引不可用: {e}")
+
+async def _start_jobs():
+    global job_manager, jobs_error
+    try:
+        store = await asyncio.to_thread(JobStore, config.JOBS_DB_PATH)
+    except Exception as e:
+        jobs_error = str(e)
+        print(f"✗ 异步识别任务不可用: {e}")
+        return
+    # 任务中的图片总是走 bulk 通道，且已被接纳的任务不再被 429
+    bulk = LANES[-1] if config.PRIORITY_LANES else LANES[0]
+    job_manager = JobManager(
+        store,
+        classify=lambda contents, model, top_k: classify_bytes(contents, model, top_k, priority=bulk, shed=False),
+        max_concurrent=config.JOBS_MAX_CONCURRENT,
+        item_concurrency=config.JOB_ITEM_CONCURRENCY,
+        ttl_seconds=config.JOBS_TTL_HOURS * 3600
+    )
+    await job_manager.start()
+
+def _require_model():
+    """模型未就绪时拒绝请求：加载中返回503（可重试），加载失败返回500"""
+    if MODEL_LOADED:
+        return
+    metrics.REJECTIONS.inc("not_ready")
+    if model_status == "loading":
+        raise HTTPException(status_code=503, detail="模型加载中，请稍后重试", headers={"Retry-After": "5"})
+    raise HTTPException(status_code=500, detail="模型加载失败，服务不可用")
+
+def _record_first_prediction(result):
+    if "first_prediction_after_seconds" not in startup_timings and result.get("success"):
+        startup_timings["first_prediction_after_seconds"] = round(time.time() - PROCESS_START, 3)
+
+async def _log_prediction(contents, digest, model, result, started, **extra):
+    """把识别结果交给预测日志（只入队，不等待写入）；digest 为 None 时计算内容哈希"""
+    if prediction_log is None:
+        return
+    if digest is None:
+        digest = await content_digest(contents)
+    prediction_log.record(make_record(digest, model, result, time.perf_counter() - started, **extra))
 
 @app.get("/", response_class=HTMLResponse)
 async def home():
@@ -282,7 +582,7 @@ async def home():
                 <div class="upload-area" id="uploadArea" onclick="document.getElementById('fileInput').click()">
                     <div class="upload-icon">📁</div>
                     <div class="upload-text">点击选择或拖拽图片到此处</div>
-                    <div class="upload-hint">支持 JPG, PNG, BMP 格式 | 最大5MB</div>
+                    <div class="upload-hint">支持 JPG, PNG, BMP 格式 | 最大__MAX_IMAGE_SIZE__</div>
                 </div>
                 
                 <input type="file" id="fileInput" accept="image/*">
@@ -375,8 +675,8 @@ async def home():
                     return;
                 }
                 
-                if (file.size > 5 * 1024 * 1024) {
-                    showStatus('图片大小不能超过5MB！', 'error');
+                if (file.size > __MAX_IMAGE_BYTES__) {
+                    showStatus('图片大小不能超过__MAX_IMAGE_SIZE__！', 'error');
                     return;
                 }
                 
@@ -420,7 +720,7 @@ async def home():
                         displayResults(data.predictions);
                         showStatus(`识别成功！模型: ${data.model} | 设备: ${data.device}`, 'success');
                     } else {
-                        showStatus('识别失败：' + data.message, 'error');
+                        showStatus('识别失败：' + (data.message || data.detail), 'error');
                     }
                 } catch (error) {
                     showStatus('请求失败：' + error.message, 'error');
@@ -487,36 +787,783 @@ async def home():
     </body>
     </html>
     """
+    # 上传大小限制与服务端配置（MAX_IMAGE_MB）保持一致
+    html = html.replace("__MAX_IMAGE_BYTES__", str(config.MAX_IMAGE_BYTES))
+    html = html.replace("__MAX_IMAGE_SIZE__", format_size(config.MAX_IMAGE_BYTES))
     return HTMLResponse(content=html)
 
-@app.post("/predict")
-async def predict_image(file: UploadFile = File(...)):
-    """API端点：接收图像并返回分类结果"""
-    if not MODEL_LOADED:
-        raise HTTPException(status_code=500, detail="模型加载失败，服务不可用")
-    
-    if not file.content_type.startswith("image/"):
-        raise HTTPException(status_code=400, detail="请上传图像文件")
+# /predict 的请求体自己流式解析（见 app/uploads.py），这里只用于生成 API 文档
+_PREDICT_REQUEST_BODY = {
+    "required": True,
+    "content": {
+        "multipart/form-data": {
+            "schema": {"type": "object", "required": ["file"],
+                       "properties": {"file": {"type": "string", "format": "binary"}}}
+        },
+        "image/*": {"schema": {"type": "string", "format": "binary"}},
+    },
+}
+
+@app.exception_handler(QueueFullError)
+async def queue_full_handler(request: Request, exc: QueueFullError):
+    # 推理队列已满：告诉客户端多久之后再试，而不是让请求无限排队
+    return JSONResponse(status_code=429, content={"detail": str(exc)},
+                        headers={"Retry-After": str(exc.retry_after)})
+
+@app.exception_handler(UnknownModelError)
+async def unknown_model_handler(request: Request, exc: UnknownModelError):
+    # 请求参数已由 _check_model_name 检查过；这里是其他来源的模型名，例如重启后已不在 AVAILABLE_MODELS 中的任务模型
+    return JSONResponse(status_code=404, content={"detail": str(exc)})
+
+@app.exception_handler(DeadlineExceededError)
+async def deadline_exceeded_handler(request: Request, exc: DeadlineExceededError):
+    return JSONResponse(status_code=504, content={"detail": str(exc), "stage": exc.stage})
+
+def _admission(request, default_priority="interactive"):
+    """从请求头读取截止时间和优先级，返回 (deadline, priority)
+
+    X-Request-Timeout-Ms: 相对超时（毫秒）；X-Request-Deadline: 绝对截止时间（Unix 时间戳，秒）
+    X-Priority: interactive / bulk（PRIORITY_LANES=0 时全部按 interactive 处理）
+    deadline 换算成 time.monotonic() 时间，没有设置时为 None；到达时已经过期直接返回 504。
+    """
+    headers = request.headers
+    deadline = None
+    try:
+        if headers.get("x-request-timeout-ms"):
+            deadline = time.monotonic() + float(headers["x-request-timeout-ms"]) / 1000.0
+        elif headers.get("x-request-deadline"):
+            deadline = time.monotonic() + float(headers["x-request-deadline"]) - time.time()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="X-Request-Timeout-Ms / X-Request-Deadline 必须是数字")
+    if deadline is not None and deadline <= time.monotonic():
+        executor.record_expired("arrival")
+        raise DeadlineExceededError("arrival")
     
-    # 检查文件大小（限制5MB）
-    contents = await file.read()
-    if len(contents) > 5 * 1024 * 1024:
-        raise HTTPException(status_code=400, detail="图片大小不能超过5MB")
+    priority = (headers.get("x-priority") or default_priority).strip().lower()
+    if priority not in LANES:
+        raise HTTPException(status_code=400, detail=f"X-Priority 必须是 {' / '.join(LANES)}")
+    if not config.PRIORITY_LANES:
+        priority = LANES[0]
+    return deadline, priority
+
+_TOP_K_QUERY = Query(DEFAULT_TOP_K, ge=1, le=MAX_TOP_K, description="返回的预测个数")
+_FIELDS_QUERY = Query(None, description="只返回这些字段（逗号分隔），例如 predictions.class_id,predictions.confidence")
+
+@app.post("/predict", openapi_extra={"requestBody": _PREDICT_REQUEST_BODY})
+async def predict_image(request: Request,
+                        model: Optional[str] = Query(None, description="模型名称，默认使用 DEFAULT_MODEL"),
+                        top_k: int = _TOP_K_QUERY,
+                        fields: Optional[str] = _FIELDS_QUERY,
+                        profile: bool = Query(False, description="管理员：剖析这次请求（需要 X-Admin-Token）")):
+    """API端点：接收图像并返回分类结果（multipart 的 file 字段，或 image/* 请求体）
+
+    Accept: application/msgpack 时返回 msgpack 编码的结果
+    推理队列已满时返回 429（带 Retry-After），超过 X-Request-Timeout-Ms 截止时间时返回 504
+    被剖析的请求在 X-Profile-Trace 响应头中返回 trace 文件名（见 /admin/traces）
+    """
+    request_started = time.perf_counter()
+    _require_model()
+    _check_model_name(model)
+    trace = _start_trace(request, profile, model)
+    use_msgpack = wants_msgpack(request.headers.get("accept"))
+    selected_fields = parse_fields(fields)
+    deadline, priority = _admission(request)
+    # 队列已满时在读取请求体之前拒绝
+    executor.check_admission()
+    started = time.perf_counter()
+    contents = await _read_upload(request)
+    if trace is not None:
+        trace.add_stage("upload_read", started, time.perf_counter(), bytes=len(contents))
     
     try:
-        result = classifier.predict(contents)
-        return JSONResponse(content=result)
+        result = await classify_bytes(contents, model, top_k, deadline, priority, trace=trace)
+    except (QueueFullError, DeadlineExceededError, UnknownModelError):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"预测失败: {str(e)}")
+    started = time.perf_counter()
+    response = encoded_response(shape_result(result, top_k, selected_fields), use_msgpack)
+    finished = time.perf_counter()
+    metrics.STAGE_SECONDS.observe(finished - started, "serialize")
+    if trace is not None:
+        trace.add_stage("serialize", started, finished)
+        trace.add_stage("total", request_started, finished)
+        response.headers["X-Profile-Trace"] = trace.name
+        if trace.trigger == "requested":
+            # 管理员拿到响应时 trace 已经可以下载
+            await asyncio.to_thread(_save_trace, trace)
+        else:
+            response.background = BackgroundTask(_save_trace, trace)
+    return response
+
+def _require_admin(request):
+    if not config.ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="管理接口未启用（没有设置 ADMIN_TOKEN）")
+    token = request.headers.get("x-admin-token") or ""
+    if not hmac.compare_digest(token.encode("utf-8"), config.ADMIN_TOKEN.encode("utf-8")):
+        raise HTTPException(status_code=403, detail="管理员令牌无效")
+
+def _start_trace(request, profile, model):
+    """管理员指定 ?profile=1，或按 PROFILE_SAMPLE_RATE 抽中时返回 RequestTrace，否则返回 None"""
+    if profile:
+        _require_admin(request)
+        trigger = "requested"
+    elif config.PROFILE_SAMPLE_RATE and random.random() < config.PROFILE_SAMPLE_RATE:
+        trigger = "sampled"
+    else:
+        return None
+    if model is None:
+        model = CASCADE_MODEL_NAME if _uses_cascade(None) else registry.default
+    return RequestTrace(model, trigger)
+
+def _trace_store():
+    global trace_store
+    if trace_store is None:
+        trace_store = TraceStore(config.PROFILE_DIR, config.PROFILE_MAX_TRACES)
+    return trace_store
+
+def _save_trace(trace):
+    # 在线程中执行：导出 torch.profiler 结果并写文件；失败不影响请求本身
+    try:
+        _trace_store().save(trace)
+    except Exception as e:
+        print(f"✗ 保存剖析结果失败: {e}")
+
+async def _read_upload(request):
+    """读取单张图片上传：边接收边检查类型和大小（MAX_IMAGE_MB），不合格的上传不会被完整读入内存"""
+    started = time.perf_counter()
+    try:
+        contents, _, _ = await read_image_upload(request, config.MAX_IMAGE_BYTES)
+    except UploadTooLargeError as e:
+        metrics.REJECTIONS.inc("too_large")
+        raise HTTPException(status_code=413, detail=str(e))
+    except UploadError as e:
+        metrics.REJECTIONS.inc("bad_content_type")
+        raise HTTPException(status_code=400, detail=str(e))
+    metrics.STAGE_SECONDS.observe(time.perf_counter() - started, "upload_read")
+    return contents
+
+def _check_model_name(model, allow_cascade=True):
+    """检查 model 参数；allow_cascade 为 True 时还接受 cascade（只用于图片识别接口）"""
+    names = registry.names
+    if allow_cascade and cascade is not None:
+        names = names + [CASCADE_MODEL_NAME]
+    if model is not None and model not in names:
+        metrics.REJECTIONS.inc("unknown_model")
+        raise HTTPException(status_code=400,
+                            detail=f"未知的模型 {model}，可选: {', '.join(names)}")
+
+def _uses_cascade(model):
+    return cascade is not None and (model == CASCADE_MODEL_NAME or (model is None and config.CASCADE_DEFAULT))
+
+async def classify_bytes(contents, model=None, top_k=DEFAULT_TOP_K, deadline=None, priority="interactive",
+                         shed=True, trace=None):
+    """完整的单图识别流程：选择模型 -> 结果缓存 -> 预处理 -> 微批处理推理，
+    返回 ImageClassifier.predict 同样格式的结果
+
+    结果中至少包含 top-5 预测（top_k 更小时由 shape_result 截断），
+    这样 top_k<=5 的请求共享同一条缓存；top_k>5 时缓存键中带上 k。
+    deadline / priority / shed 见 InferenceExecutor.slot。
+    model 为 cascade（或 CASCADE_DEFAULT=1 且没有指定模型）时走模型级联。
+    trace（profiling.RequestTrace）不为 None 时记录各阶段耗时并剖析前向推理，不使用结果缓存。
+    """
+    started = time.perf_counter()
+    k = max(DEFAULT_TOP_K, top_k)
+    if _uses_cascade(model):
+        result = await _classify_cascade(contents, k, deadline, priority, shed, trace)
+        _record_first_prediction(result)
+        await _log_prediction(contents, None, CASCADE_MODEL_NAME, result, started)
+        return result
+    # 内容哈希：走缓存时复用缓存键中的哈希
+    digest = None
+    async with registry.use(model) as entry:
+        if result_cache is None or trace is not None:
+            result = await _run_inference(entry, contents, k, deadline, priority, shed, trace)
+        else:
+            version = entry.classifier.cache_version
+            if k > DEFAULT_TOP_K:
+                version = f"{version}|top{k}"
+            key = await result_cache.make_key(contents, version)
+            digest = key.split(":", 1)[0]
+            # 截止时间 / 优先级不同的请求不合并：否则后来的请求会按第一个请求的截止时间和优先级计算
+            result = await result_cache.get_or_compute(
+                key, lambda: _run_inference(entry, contents, k, deadline, priority, shed),
+                group=(deadline, priority, shed))
+    _record_first_prediction(result)
+    await _log_prediction(contents, digest, entry.name, result, started)
+    return result
+
+@app.post("/predict/tensor", openapi_extra={"requestBody": {"required": True, "content": {
+    "application/x-npy": {"schema": {"type": "string", "format": "binary"}},
+    "application/octet-stream": {"schema": {"type": "string", "format": "binary"}},
+}}})
+async def predict_tensor(request: Request,
+                         model: Optional[str] = Query(None, description="模型名称，默认使用 DEFAULT_MODEL"),
+                         layout: Optional[str] = Query(None, description="hwc / chw，默认根据形状推断"),
+                         top_k: int = _TOP_K_QUERY,
+                         fields: Optional[str] = _FIELDS_QUERY):
+    """已解码图像识别：请求体是 uint8 RGB 数组（.npy，或原始字节 + X-Tensor-Shape 头），
+    不经过 PIL 解码和缩放，直接归一化后送入微批处理推理
+
+    单张输入（HWC / CHW）返回与 /predict 相同的结果；
+    堆叠输入（NHWC / NCHW）返回 {"success", "count", "results": [...]}，顺序与输入一致。
+    """
+    _require_model()
+    _check_model_name(model, allow_cascade=False)
+    use_msgpack = wants_msgpack(request.headers.get("accept"))
+    selected_fields = parse_fields(fields)
+    deadline, priority = _admission(request)
+    executor.check_admission()
+    
+    received = time.perf_counter()
+    body = await request.body()
+    metrics.STAGE_SECONDS.observe(time.perf_counter() - received, "upload_read")
+    
+    content_type = (request.headers.get("content-type") or "").split(";")[0].strip().lower()
+    async with registry.use(model) as entry:
+        try:
+            if content_type in NPY_MEDIA_TYPES:
+                array = parse_npy(body)
+            else:
+                array = parse_raw(body, request.headers.get("x-tensor-shape"),
+                                  request.headers.get("x-tensor-dtype"))
+            images, stacked = split_images(array, entry.classifier.crop_size, layout,
+                                           max_images=config.BATCH_REQUEST_MAX_IMAGES)
+        except TensorError as e:
+            metrics.REJECTIONS.inc("bad_tensor")
+            raise HTTPException(status_code=400, detail=str(e))
+        
+        # 不需要解码，不经过执行器的工作池；所有图像同时提交，由微批处理器合并
+        k = max(DEFAULT_TOP_K, top_k)
+        async with executor.slot(priority, deadline):
+            futures = [asyncio.wrap_future(entry.batcher.submit(image, k, deadline, priority)) for image in images]
+            try:
+                results = await asyncio.gather(*futures)
+            except DeadlineExceededError:
+                for future in futures:
+                    future.cancel()
+                raise
+            except Exception as e:
+                for future in futures:
+                    future.cancel()
+                raise HTTPException(status_code=500, detail=f"预测失败: {str(e)}")
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+    for result in results:
+        metrics.PREDICTIONS.inc(entry.name, "success" if result.get("success") else "error")
+        _record_first_prediction(result)
+    # 整个请求体的哈希；堆叠输入用 index 区分每张图
+    digest = await content_digest(body) if prediction_log is not None else None
+    for i, result in enumerate(results):
+        await _log_prediction(body, digest, entry.name, result, received, source="tensor",
+                              **({"index": i} if stacked else {}))
+    
+    started = time.perf_counter()
+    shaped = [shape_result(result, top_k, selected_fields) for result in results]
+    if stacked:
+        body = {"success": all(r.get("success") for r in results), "count": len(shaped), "results": shaped}
+    else:
+        body = shaped[0]
+    response = encoded_response(body, use_msgpack)
+    metrics.STAGE_SECONDS.observe(time.perf_counter() - started, "serialize")
+    return response
+
+async def _run_inference(entry, contents, top_k=DEFAULT_TOP_K, deadline=None, priority="interactive", shed=True,
+                         trace=None):
+    # 解码、预处理、推理都不在事件循环中执行，/health 等接口在推理饱和时仍能及时响应
+    waited = time.perf_counter()
+    async with executor.slot(priority, deadline, shed):
+        if trace is not None:
+            trace.add_stage("slot_wait", waited, time.perf_counter())
+        try:
+            image = await _decode(entry, contents, trace)
+        except Exception as e:
+            return entry.classifier.error_result(e)
+        return await _predict_decoded(entry, image, top_k, deadline, priority, trace)
+
+async def _decode(entry, contents, trace=None):
+    """在工作池中解码并预处理（每个模型使用自己的预处理参数）"""
+    submitted = time.perf_counter()
+    try:
+        image, decode_seconds, transform_seconds = await executor.run(
+            preprocess_image_timed, contents, *entry.classifier.preprocess_args)
+    except Exception:
+        metrics.PREDICTIONS.inc(entry.name, "decode_error")
+        raise
+    metrics.STAGE_SECONDS.observe(decode_seconds, "decode")
+    metrics.STAGE_SECONDS.observe(transform_seconds, "transform")
+    if trace is not None:
+        # 解码/缩放在工作池中计时，这里按“结束时刻往前推”放到时间轴上，
+        # 剩下的部分是等待工作池（进程池时还包括结果回传）
+        finished = time.perf_counter()
+        decoded = finished - transform_seconds
+        trace.add_stage("preprocess_wait", submitted, decoded - decode_seconds)
+        trace.add_stage("decode", decoded - decode_seconds, decoded, model=entry.name)
+        trace.add_stage("transform", decoded, finished, model=entry.name)
+    return image
+
+async def _predict_decoded(entry, image, top_k, deadline, priority, trace=None):
+    submitted = time.perf_counter()
+    try:
+        result = await asyncio.wrap_future(entry.batcher.submit(image, top_k, deadline, priority, trace))
+    except DeadlineExceededError:
+        metrics.PREDICTIONS.inc(entry.name, "expired")
+        raise
+    except Exception:
+        metrics.PREDICTIONS.inc(entry.name, "error")
+        raise
+    metrics.PREDICTIONS.inc(entry.name, "success" if result.get("success") else "error")
+    if trace is not None:
+        # 包括在微批处理队列中等待组批的时间；前向推理本身见 trace 中的算子事件
+        trace.add_stage("batch", submitted, time.perf_counter(), model=entry.name)
+    return result
+
+async def _classify_cascade(contents, top_k, deadline, priority, shed, trace=None):
+    """模型级联：缓存键包含两个模型的版本和阈值，结果中的 cascade 字段说明由哪一级给出"""
+    async with registry.use(cascade.first) as first, registry.use(cascade.final) as final:
+        if result_cache is None or trace is not None:
+            return await _run_cascade(first, final, contents, top_k, deadline, priority, shed, trace)
+        version = cascade.cache_version(first.classifier.cache_version, final.classifier.cache_version)
+        if top_k > DEFAULT_TOP_K:
+            version = f"{version}|top{top_k}"
+        key = await result_cache.make_key(contents, version)
+        return await result_cache.get_or_compute(
+            key, lambda: _run_cascade(first, final, contents, top_k, deadline, priority, shed),
+            group=(deadline, priority, shed))
+
+async def _run_cascade(first, final, contents, top_k, deadline, priority, shed, trace=None):
+    # 两级共用一个执行器名额；预处理参数相同时第二级直接复用第一级解码的图像
+    waited = time.perf_counter()
+    async with executor.slot(priority, deadline, shed):
+        if trace is not None:
+            trace.add_stage("slot_wait", waited, time.perf_counter())
+        try:
+            image = await _decode(first, contents, trace)
+        except Exception as e:
+            return first.classifier.error_result(e)
+        first_result = await _predict_decoded(first, image, top_k, deadline, priority, trace)
+        if not cascade.should_escalate(first_result):
+            return cascade.annotate(first_result, first_result, escalated=False)
+        
+        if final.classifier.preprocess_args != first.classifier.preprocess_args:
+            try:
+                image = await _decode(final, contents, trace)
+            except Exception as e:
+                return final.classifier.error_result(e)
+        result = await _predict_decoded(final, image, top_k, deadline, priority, trace)
+        return cascade.annotate(result, first_result, escalated=True)
+
+@app.websocket("/ws/predict")
+async def predict_stream(websocket: WebSocket,
+                         model: Optional[str] = None,
+                         input_kind: str = Query("image", alias="input"),
+                         policy: str = "drop_stale",
+                         max_in_flight: int = 2,
+                         top_k: int = DEFAULT_TOP_K,
+                         fields: Optional[str] = None,
+                         response_format: str = Query("json", alias="format")):
+    """逐帧识别：一个连接上连续发送帧（协议见 app/streams.py），每帧的结果带着序列号返回
+
+    input: image（编码后的图片）/ tensor（uint8 HWC 数组，尺寸为模型输入尺寸）
+    policy: drop_stale（识别跟不上时只保留最新帧）/ queue（全部识别，反压客户端）
+    所有连接的帧与 HTTP 请求共用同一个微批处理队列。
+    """
+    if not MODEL_LOADED:
+        # 1013: Try Again Later
+        await websocket.close(code=1013, reason="model not ready")
+        return
+    if model is not None and model not in registry.names:
+        # 逐帧识别不支持模型级联（帧率要求稳定的延迟）
+        await websocket.close(code=1008, reason=f"unknown model {model}")
+        return
+    if (input_kind not in ("image", "tensor") or policy not in POLICIES or response_format not in ("json", "msgpack")
+            or not 1 <= top_k <= MAX_TOP_K or max_in_flight < 1):
+        await websocket.close(code=1008, reason="invalid parameters")
+        return
+    try:
+        selected_fields = parse_fields(fields)
+        use_msgpack = response_format == "msgpack" and wants_msgpack("application/msgpack")
+    except HTTPException as e:
+        await websocket.close(code=1008, reason=str(e.detail)[:120])
+        return
+    
+    await websocket.accept()
+    k = max(DEFAULT_TOP_K, top_k)
+    async with registry.use(model) as entry:
+        crop = entry.classifier.crop_size
+        
+        async def process(seq, payload):
+            started = time.perf_counter()
+            if input_kind == "tensor":
+                try:
+                    array = parse_raw(payload, f"{crop},{crop},3")
+                except TensorError as e:
+                    return {"success": False, "error": str(e)}
+                async with executor.slot():
+                    result = await asyncio.wrap_future(entry.batcher.submit(array, k))
+                metrics.PREDICTIONS.inc(entry.name, "success" if result.get("success") else "error")
+            else:
+                result = await _run_inference(entry, bytes(payload), k)
+            _record_first_prediction(result)
+            await _log_prediction(payload, None, entry.name, result, started, source="stream")
+            return shape_result(result, top_k, selected_fields)
+        
+        def encode_message(obj):
+            if use_msgpack:
+                return encode(obj, True)[0]
+            return dumps_json(obj).decode("utf-8")
+        
+        stream = FrameStream(websocket, process, encode_message, policy=policy, max_in_flight=max_in_flight,
+                             max_frame_bytes=config.MAX_IMAGE_BYTES)
+        await stream.run()
+
+@app.post("/predict/batch")
+async def predict_batch(request: Request,
+                        files: List[UploadFile] = File(...),
+                        model: Optional[str] = Query(None, description="模型名称，默认使用 DEFAULT_MODEL"),
+                        top_k: int = _TOP_K_QUERY,
+                        fields: Optional[str] = _FIELDS_QUERY):
+    """批量识别：接收多张图片（multipart 多个 files 字段）或一个 tar/zip 压缩包，
+    以 NDJSON 流式返回，每张图识别完成后立即输出一行
+    （Accept: application/msgpack 时依次输出 msgpack 对象）
+
+    默认走 bulk 优先级通道（X-Priority 可以覆盖），截止时间对整个请求生效，过期的图片返回失败行"""
+    _require_model()
+    _check_model_name(model)
+    use_msgpack = wants_msgpack(request.headers.get("accept"))
+    selected_fields = parse_fields(fields)
+    deadline, priority = _admission(request, default_priority="bulk")
+    # 整个批量请求一次性准入，接纳之后其中的图片不再被拒绝
+    executor.check_admission()
+    
+    items = await _collect_images(files, config.BATCH_REQUEST_MAX_IMAGES, config.BATCH_REQUEST_MAX_EXPANDED_BYTES)
+    
+    stream = _stream_batch_results(items, model, top_k, selected_fields, use_msgpack, deadline, priority)
+    media_type = "application/msgpack" if use_msgpack else "application/x-ndjson"
+    return StreamingResponse(stream, media_type=media_type)
+
+def _expand_upload(upload, contents, max_images, max_bytes):
+    """逐张产出一个上传文件（图片或压缩包）中的 (文件名, 图片字节)；类型、大小或数量不合格时抛出 4xx
+
+    max_images / max_bytes 是这个文件还能使用的图片数 / 解压后的总字节数。
+    压缩包在迭代时才解压，是阻塞操作，要在线程中迭代。
+    """
+    if is_archive(upload.filename, upload.content_type):
+        try:
+            yield from iter_archive_images(contents, upload.filename, max_images=max_images,
+                                           max_image_bytes=config.MAX_IMAGE_BYTES, max_total_bytes=max_bytes)
+        except ArchiveError as e:
+            metrics.REJECTIONS.inc("bad_archive")
+            raise HTTPException(status_code=400, detail=str(e))
+        return
+    if not (upload.content_type or "").startswith("image/"):
+        metrics.REJECTIONS.inc("bad_content_type")
+        raise HTTPException(status_code=400, detail=f"请上传图像文件或压缩包: {upload.filename}")
+    if len(contents) > config.MAX_IMAGE_BYTES:
+        metrics.REJECTIONS.inc("too_large")
+        raise HTTPException(status_code=413,
+                            detail=f"图片大小不能超过{format_size(config.MAX_IMAGE_BYTES)}: {upload.filename}")
+    if max_images < 1:
+        metrics.REJECTIONS.inc("too_many_images")
+        raise HTTPException(status_code=400, detail="图片数量超过上限")
+    if len(contents) > max_bytes:
+        metrics.REJECTIONS.inc("too_large")
+        raise HTTPException(status_code=413, detail=f"图片总大小超过{format_size(max_bytes)}")
+    yield upload.filename, contents
+
+async def _collect_images(files, max_images, max_bytes):
+    """展开上传的图片和压缩包，返回 [(文件名, 图片字节)]；类型、大小或数量不合格时返回 4xx"""
+    items = []
+    total = 0
+    for upload in files:
+        contents = await upload.read()
+        # 解压可能要几秒，放到线程中，不阻塞事件循环
+        expanded = await asyncio.to_thread(
+            lambda: list(_expand_upload(upload, contents, max_images - len(items), max_bytes - total)))
+        items.extend(expanded)
+        total += sum(len(data) for _, data in expanded)
+    
+    if not items:
+        raise HTTPException(status_code=400, detail="没有找到可识别的图片")
+    return items
+
+# 异步任务的图片按批写入数据库：每批最多这么多张 / 字节，每批一个短事务
+_JOB_CHUNK_IMAGES = 64
+_JOB_CHUNK_BYTES = 64 * 1024 * 1024
+
+def _store_job_upload(store, job_id, upload, contents, count, total):
+    """把一个上传文件中的图片分批写入任务（阻塞，在线程中调用），返回更新后的 (图片数, 总字节数)"""
+    chunk, chunk_bytes = [], 0
+    for name, data in _expand_upload(upload, contents, config.JOB_MAX_IMAGES - count,
+                                     config.JOB_MAX_EXPANDED_BYTES - total):
+        chunk.append((name, data))
+        chunk_bytes += len(data)
+        if len(chunk) >= _JOB_CHUNK_IMAGES or chunk_bytes >= _JOB_CHUNK_BYTES:
+            store.add_items(job_id, count, chunk)
+            count, total = count + len(chunk), total + chunk_bytes
+            chunk, chunk_bytes = [], 0
+    if chunk:
+        store.add_items(job_id, count, chunk)
+        count, total = count + len(chunk), total + chunk_bytes
+    return count, total
+
+async def _stream_batch_results(items, model=None, top_k=DEFAULT_TOP_K, fields=None, use_msgpack=False,
+                                deadline=None, priority="bulk"):
+    # 一个批量请求同时排队的图片数不超过推理并发上限，避免一个大请求占满等待队列
+    limit = asyncio.Semaphore(config.INFERENCE_MAX_CONCURRENCY)
+    
+    async def run_one(index, name, contents):
+        try:
+            async with limit:
+                result = await classify_bytes(contents, model, top_k, deadline, priority, shed=False)
+        except Exception as e:
+            result = classifier.error_result(e)
+        return {"index": index, "filename": name, **shape_result(result, top_k, fields)}
+    
+    # 图片并发提交，由微批处理器合并成批次推理；按完成先后输出
+    tasks = [asyncio.ensure_future(run_one(i, name, data)) for i, (name, data) in enumerate(items)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            line = await next_done
+            started = time.perf_counter()
+            encoded, _ = encode(line, use_msgpack)
+            if not use_msgpack:
+                encoded += b"\n"
+            metrics.STAGE_SECONDS.observe(time.perf_counter() - started, "serialize")
+            yield encoded
+    finally:
+        # 客户端中途断开时取消尚未完成的识别
+        for task in tasks:
+            task.cancel()
+
+def _require_jobs():
+    _require_model()
+    if job_manager is None:
+        raise HTTPException(status_code=503, detail=f"异步识别任务不可用: {jobs_error}")
+
+@app.post("/jobs", status_code=202)
+async def create_job(files: List[UploadFile] = File(...),
+                     model: Optional[str] = Query(None, description="模型名称，默认使用 DEFAULT_MODEL"),
+                     top_k: int = _TOP_K_QUERY,
+                     priority: int = Query(DEFAULT_PRIORITY, ge=MIN_PRIORITY, le=MAX_PRIORITY,
+                                           description="任务优先级，越大越先执行")):
+    """提交异步识别任务：接收多张图片或 tar/zip 压缩包，保存后立即返回任务 id，
+    后台按优先级执行，用 GET /jobs/{job_id} 查询进度和结果"""
+    _require_jobs()
+    _check_model_name(model)
+    store = job_manager.store
+    counts = await job_manager.counts()
+    if counts["queued"] >= config.JOBS_MAX_QUEUED:
+        metrics.REJECTIONS.inc("jobs_full")
+        raise HTTPException(status_code=429, detail=f"排队中的任务已达上限（{config.JOBS_MAX_QUEUED}），请稍后重试",
+                            headers={"Retry-After": "60"})
+    
+    # 逐个文件读取、解压并分批写入数据库，不把整个任务的图片同时放在内存中
+    job_id = await asyncio.to_thread(store.begin, model, max(DEFAULT_TOP_K, top_k), priority)
+    try:
+        count = total = 0
+        for upload in files:
+            contents = await upload.read()
+            count, total = await asyncio.to_thread(_store_job_upload, store, job_id, upload, contents, count, total)
+            del contents
+        if not count:
+            raise HTTPException(status_code=400, detail="没有找到可识别的图片")
+    except BaseException:
+        await asyncio.to_thread(store.discard, job_id)
+        raise
+    await asyncio.to_thread(store.submit, job_id)
+    job_manager.notify()
+    job = await asyncio.to_thread(store.get, job_id)
+    return dict(job_view(job), status_url=f"/jobs/{job_id}")
+
+@app.get("/jobs")
+async def list_jobs(status: Optional[str] = Query(None, description=f"只列出该状态的任务: {' / '.join(STATUSES)}"),
+                    limit: int = Query(50, ge=1, le=500)):
+    """最近提交的任务"""
+    _require_jobs()
+    if status is not None and status not in STATUSES:
+        raise HTTPException(status_code=400, detail=f"status 必须是 {' / '.join(STATUSES)}")
+    jobs = await asyncio.to_thread(job_manager.store.list, limit, status)
+    return {"jobs": [job_view(job) for job in jobs]}
+
+@app.get("/jobs/{job_id}")
+async def get_job(request: Request, job_id: str,
+                  offset: int = Query(0, ge=0, description="结果分页：跳过前多少条"),
+                  limit: int = Query(100, ge=0, le=1000, description="结果分页：每页条数，0 表示只返回进度"),
+                  top_k: int = _TOP_K_QUERY,
+                  fields: Optional[str] = _FIELDS_QUERY):
+    """任务进度和已完成的结果（按输入顺序分页；next_offset 为空表示当前没有更多结果）"""
+    _require_jobs()
+    use_msgpack = wants_msgpack(request.headers.get("accept"))
+    selected_fields = parse_fields(fields)
+    store = job_manager.store
+    job = await asyncio.to_thread(store.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"任务 {job_id} 不存在")
+    
+    rows = await asyncio.to_thread(store.results, job_id, offset, limit) if limit else []
+    results = [{"index": idx, "filename": filename, **shape_result(result, top_k, selected_fields)}
+               for idx, filename, result in rows]
+    body = dict(job_view(job), offset=offset, results=results,
+                next_offset=offset + len(results) if len(results) == limit and limit else None)
+    return encoded_response(body, use_msgpack)
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """取消排队中或执行中的任务（已完成的结果保留）"""
+    _require_jobs()
+    job = await asyncio.to_thread(job_manager.store.cancel, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"任务 {job_id} 不存在")
+    return job_view(job)
+
+async def embed_bytes(contents, deadline=None, priority="interactive"):
+    """解码 + 预处理 + 默认模型的倒数第二层特征，返回未归一化的 float32 向量"""
+    async with executor.slot(priority, deadline):
+        try:
+            image, decode_seconds, transform_seconds = await executor.run(
+                preprocess_image_timed, contents, *classifier.preprocess_args)
+        except Exception as e:
+            metrics.PREDICTIONS.inc(embedding_batcher.classifier.arch, "decode_error")
+            raise HTTPException(status_code=400, detail=f"图片解码失败: {e}")
+        metrics.STAGE_SECONDS.observe(decode_seconds, "decode")
+        metrics.STAGE_SECONDS.observe(transform_seconds, "transform")
+        vector = await asyncio.wrap_future(embedding_batcher.submit(image, None, deadline, priority))
+    metrics.PREDICTIONS.inc(embedding_batcher.classifier.arch, "success")
+    return vector
+
+def _require_index():
+    _require_model()
+    if vector_index is None:
+        raise HTTPException(status_code=503, detail=f"相似图片索引不可用: {index_error}")
+
+@app.post("/embed", openapi_extra={"requestBody": _PREDICT_REQUEST_BODY})
+async def embed_image(request: Request,
+                      normalize: bool = Query(True, description="是否做 L2 归一化（余弦相似度可直接用点积计算）")):
+    """图像嵌入：返回默认模型倒数第二层的池化特征（ResNet18 为 512 维）"""
+    _require_model()
+    use_msgpack = wants_msgpack(request.headers.get("accept"))
+    deadline, priority = _admission(request)
+    executor.check_admission()
+    contents = await _read_upload(request)
+    
+    vector = await embed_bytes(contents, deadline, priority)
+    if normalize:
+        vector = vector / max(float((vector * vector).sum()) ** 0.5, 1e-12)
+    return encoded_response({
+        "success": True,
+        "model": classifier.display_name,
+        "dim": int(vector.shape[0]),
+        "normalized": normalize,
+        "embedding": vector.tolist(),
+    }, use_msgpack)
+
+def _parse_metadata(metadata):
+    if metadata is None:
+        return None
+    try:
+        return json.loads(metadata)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="metadata 必须是 JSON")
+
+@app.post("/index/add", openapi_extra={"requestBody": _PREDICT_REQUEST_BODY})
+async def index_add(request: Request,
+                    id: Optional[str] = Query(None, description="图片标识，默认使用图片内容的 SHA-256 前 16 位"),
+                    metadata: Optional[str] = Query(None, description="与图片一起保存的 JSON（查询时原样返回）"),
+                    duplicates: int = Query(5, ge=0, le=MAX_TOP_K, description="同时返回的近似重复图片数上限")):
+    """把图片的嵌入加入相似图片索引；返回加入前索引中相似度不低于 DUPLICATE_THRESHOLD 的图片（近似重复检测）"""
+    _require_index()
+    use_msgpack = wants_msgpack(request.headers.get("accept"))
+    item_metadata = _parse_metadata(metadata)
+    deadline, priority = _admission(request)
+    executor.check_admission()
+    contents = await _read_upload(request)
+    item_id = id or hashlib.sha256(contents).hexdigest()[:16]
+    
+    vector = await embed_bytes(contents, deadline, priority)
+    
+    def add():
+        similar = vector_index.search(vector, duplicates) if duplicates else []
+        rows = vector_index.add(vector[None], [item_id], [item_metadata])
+        return rows[0], [hit for hit in similar if hit["score"] >= config.DUPLICATE_THRESHOLD]
+    
+    row, similar = await asyncio.to_thread(add)
+    return encoded_response({
+        "success": True,
+        "id": item_id,
+        "index": row,
+        "count": row + 1,
+        "duplicates": similar,
+    }, use_msgpack)
+
+@app.post("/index/query", openapi_extra={"requestBody": _PREDICT_REQUEST_BODY})
+async def index_query(request: Request,
+                      k: int = Query(10, ge=1, le=MAX_TOP_K, description="返回的相似图片数"),
+                      nprobe: Optional[int] = Query(None, ge=1, description="搜索的聚类数（只在启用粗量化器时有效）")):
+    """相似图片搜索：返回索引中与上传图片最相似的 k 张（score 为余弦相似度）"""
+    _require_index()
+    use_msgpack = wants_msgpack(request.headers.get("accept"))
+    deadline, priority = _admission(request)
+    executor.check_admission()
+    contents = await _read_upload(request)
+    
+    vector = await embed_bytes(contents, deadline, priority)
+    started = time.perf_counter()
+    neighbours = await asyncio.to_thread(vector_index.search, vector, k, nprobe)
+    metrics.STAGE_SECONDS.observe(time.perf_counter() - started, "index_search")
+    return encoded_response({"success": True, "count": len(neighbours), "results": neighbours}, use_msgpack)
+
+@app.get("/index")
+async def index_stats():
+    """相似图片索引的状态"""
+    _require_index()
+    return await asyncio.to_thread(vector_index.stats)
+
+@app.post("/index/train")
+async def index_train(request: Request,
+                      nlist: int = Query(..., ge=0, description="聚类数，0 表示删除粗量化器，恢复精确搜索")):
+    """管理员：（重新）训练粗量化器（IVF）；向量很多时可能需要几十秒，训练期间搜索和写入照常进行"""
+    _require_admin(request)
+    _require_index()
+    try:
+        return await asyncio.to_thread(vector_index.train, nlist)
+    except VectorIndexError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/admin/traces")
+async def list_traces(request: Request, limit: int = Query(100, ge=1, le=1000)):
+    """管理员：最近的剖析结果（最新的在前）"""
+    _require_admin(request)
+    traces = await asyncio.to_thread(_trace_store().list, limit)
+    return {
+        "directory": config.PROFILE_DIR,
+        "max_traces": config.PROFILE_MAX_TRACES,
+        "sample_rate": config.PROFILE_SAMPLE_RATE,
+        "traces": [dict(t, url=f"/admin/traces/{t['name']}") for t in traces],
+    }
+
+@app.get("/admin/traces/{name}")
+async def get_trace(request: Request, name: str):
+    """管理员：下载一个 Chrome trace 文件（chrome://tracing 或 https://ui.perfetto.dev 打开）"""
+    _require_admin(request)
+    path = _trace_store().path(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail=f"剖析结果 {name} 不存在（可能已被轮转删除）")
+    return FileResponse(path, media_type="application/json", filename=name)
 
 @app.get("/health")
 async def health_check():
     """健康检查端点"""
     import platform
+    # 存活检查：进程能响应即为 healthy；模型是否可用请看 /ready
     status = {
-        "status": "healthy" if MODEL_LOADED else "unhealthy",
+        "status": "healthy" if model_status != "failed" else "unhealthy",
         "service": "CNN Image Classification API",
         "model_loaded": MODEL_LOADED,
+        "model_status": model_status,
+        "startup": startup_timings,
         "system": platform.system(),
         "python_version": platform.python_version(),
         "torch_version": "unknown",
@@ -529,12 +1576,51 @@ async def health_check():
         status.update({
             "torch_version": torch.__version__,
             "torchvision_version": torchvision.__version__,
-            "device": str(classifier.device),
-            "model": "ResNet18"
+            "device": classifier.device_label,
+            "model": classifier.display_name,
+            "backend": classifier.backend.name,
+            "json_encoder": JSON_ENCODER,
+            "streams": dict(STREAMS),
+            "batching": registry.entry().batcher.stats(),
+            "models": registry.stats(),
+            "executor": executor.stats(),
+            "threads": thread_config,
+            "warmup": {
+                "enabled": config.WARMUP_ENABLED,
+                "batch_sizes": config.WARMUP_BATCH_SIZES,
+                "iterations": config.WARMUP_ITERATIONS,
+                "timings_ms": classifier.warmup_timings,
+            },
+            "cascade": cascade.stats() if cascade is not None else {"enabled": False},
+            "profiling": {"admin_enabled": bool(config.ADMIN_TOKEN), "sample_rate": config.PROFILE_SAMPLE_RATE},
+            "prediction_log": prediction_log.stats() if prediction_log is not None else {"enabled": False},
+            "embedding": embedding_batcher.stats(),
+            "jobs": job_manager.stats() if job_manager is not None else {"enabled": False, "error": jobs_error},
+            "index": vector_index.stats() if vector_index is not None else {"enabled": False, "error": index_error},
+            "cache": result_cache.stats() if result_cache is not None else {"enabled": False},
+            "process": process_memory()
         })
     
     return status
 
+@app.get("/ready")
+async def readiness_check():
+    """就绪检查端点：模型加载完成前返回503，供编排系统的 readiness probe 使用"""
+    body = {
+        "ready": MODEL_LOADED,
+        "model_status": model_status,
+        "startup": startup_timings,
+        "uptime_seconds": round(time.time() - PROCESS_START, 3)
+    }
+    if model_status == "failed":
+        body["error"] = model_handler.load_error
+    return JSONResponse(content=body, status_code=200 if MODEL_LOADED else 503)
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Prometheus 指标（文本格式），多进程模式下是处理本次请求的工作进程的数据"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 @app.get("/test")
 async def test_endpoint():
     """测试端点"""
@@ -545,20 +1631,39 @@ async def test_endpoint():
     }
 
 if __name__ == "__main__":
+    import torch
+    
     print("=" * 60)
     print("         CNN图像分类服务启动中")
     print("=" * 60)
-    print(f"模型加载状态: {'成功' if MODEL_LOADED else '失败'}")
+    print(f"工作进程数: {config.WORKERS}")
+    print(f"模型目录: {config.MODEL_DIR}")
     print("访问地址:")
-    print("  Web界面: http://localhost:8000")
-    print("  API文档: http://localhost:8000/docs")
-    print("  健康检查: http://localhost:8000/health")
-    print("  测试端点: http://localhost:8000/test")
+    print(f"  Web界面: http://localhost:{config.PORT}")
+    print(f"  API文档: http://localhost:{config.PORT}/docs")
+    print(f"  健康检查: http://localhost:{config.PORT}/health")
+    print(f"  就绪检查: http://localhost:{config.PORT}/ready")
+    print(f"  监控指标: http://localhost:{config.PORT}/metrics")
+    print(f"  测试端点: http://localhost:{config.PORT}/test")
     print("=" * 60)
     
-    uvicorn.run(
+    # 单进程：模型在服务监听端口后于后台加载
+    # 多进程：父进程只加载一次权重，fork 出的工作进程直接复用；
+    # 父进程不做任何前向计算，非 eager 推理后端的构建和预热都在各工作进程中进行
+    shared_model = None
+    if config.WORKERS > 1:
+        loaded = model_handler.load_classifier(defer_backend=True)
+        # 内存映射的本地权重本身就由各进程共享页缓存，不需要再复制到共享内存
+        if loaded is not None and not loaded.weights_mmapped:
+            shared_model = loaded.model
+    
+    serve(
         app,
-        host="0.0.0.0",
-        port=8000,
+        host=config.HOST,
+        port=config.PORT,
+        workers=config.WORKERS,
+        # 已按每个工作进程的CPU预算设置过（见 configure_torch_threads）
+        torch_threads=torch.get_num_threads(),
+        model=shared_model,
         log_level="info"
-    )
\ No newline at end of file
+    )
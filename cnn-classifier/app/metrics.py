@@ -0,0 +1,218 @@
+import bisect
+import threading
+import time
+
+from app.serving import process_memory
+
+# 轻量的 Prometheus 指标实现（文本格式 0.0.4），不引入额外依赖。
+# 每次记录只是一次加锁的加法/二分查找，可以在生产环境常开。
+# 多进程模式（WORKERS>1）下每个工作进程各自统计，/metrics 返回的是处理该请求的进程的数据。
+
+# 延迟直方图的桶（秒）：覆盖 0.1ms 的解码到秒级的排队
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} 需要标签 {self.labelnames}")
+        return tuple(str(v) for v in labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+
+    def inc(self, *labels, amount=1):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in items]
+
+
+class Gauge(_Metric):
+    """取值在抓取时通过回调计算，记录时没有任何开销
+
+    fn 返回一个数值，或者 {标签值元组: 数值} 的字典（有标签时）。
+    """
+    kind = "gauge"
+
+    def __init__(self, name, documentation, fn, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._fn = fn
+
+    def _samples(self):
+        try:
+            value = self._fn()
+        except Exception:
+            return []
+        if not isinstance(value, dict):
+            value = {(): value}
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in value.items()]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [每个桶的计数..., +Inf 桶的计数, 总和]
+        self._values = {}
+
+    def observe(self, value, *labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    def _samples(self):
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._values.items()]
+        lines = []
+        for key, counts in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts[:-1]):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, ("le", _format_value(float(bound))))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(counts[-1])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+REGISTRY = []
+
+
+def render():
+    """生成 /metrics 的文本内容"""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    """ASGI 中间件：统计每个接口的请求数、状态码、耗时和正在处理的请求数
+
+    endpoint 标签只使用已注册的路由路径，其余路径记为 other，避免标签数量无限增长；
+    带路径参数的路由（例如 /jobs/{job_id}）记为路由模板本身。
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._endpoints = None
+        self._templates = None
+
+    def _endpoint(self, scope):
+        if self._endpoints is None:
+            routes = [route for route in scope["app"].routes if getattr(route, "path", None)]
+            self._endpoints = {route.path for route in routes if "{" not in route.path}
+            self._templates = [(route.path_regex, route.path) for route in routes
+                               if "{" in route.path and hasattr(route, "path_regex")]
+        path = scope["path"]
+        if path in self._endpoints:
+            return path
+        for regex, template in self._templates:
+            if regex.match(path):
+                return template
+        return "other"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        endpoint = self._endpoint(scope)
+        status = [500]
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        HTTP_IN_FLIGHT["value"] += 1
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            HTTP_IN_FLIGHT["value"] -= 1
+            REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint)
+            REQUESTS.inc(endpoint, status[0])
+            if status[0] >= 500:
+                ERRORS.inc(endpoint)
+
+
+# ==== 全局指标 ====
+
+# 各阶段耗时。每张图一次: upload_read, decode, transform, serialize；
+# 每个批次一次: batch_assemble（归一化写入批次张量）, forward, postprocess（softmax/topk/整理结果）
+STAGE_SECONDS = Histogram(
+    "cnn_stage_duration_seconds", "Time spent in each stage of the predict path", ("stage",))
+REQUEST_SECONDS = Histogram(
+    "cnn_http_request_duration_seconds", "HTTP request latency", ("endpoint",))
+REQUESTS = Counter(
+    "cnn_http_requests_total", "HTTP requests by endpoint and status code", ("endpoint", "status"))
+ERRORS = Counter(
+    "cnn_http_errors_total", "HTTP responses with a 5xx status", ("endpoint",))
+REJECTIONS = Counter(
+    "cnn_rejections_total", "Requests rejected before inference", ("reason",))
+PREDICTIONS = Counter(
+    "cnn_predictions_total", "Images classified, by model and outcome", ("model", "outcome"))
+DEADLINE_EXPIRED = Counter(
+    "cnn_deadline_expired_total", "Requests dropped because their deadline passed, by stage", ("stage",))
+BATCH_SIZE = Histogram(
+    "cnn_batch_size", "Number of images per forward pass", ("model",), buckets=BATCH_SIZE_BUCKETS)
+HTTP_IN_FLIGHT = {"value": 0}
+Gauge("cnn_http_requests_in_flight", "HTTP requests currently being handled",
+      lambda: HTTP_IN_FLIGHT["value"])
+Gauge("process_resident_memory_bytes", "Resident memory size in bytes",
+      lambda: int(process_memory()["rss_mb"] * 1024 * 1024))
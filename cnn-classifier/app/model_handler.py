@@ -2,7 +2,15 @@ import torch
 import os
 import json
 import io
+import threading
+import time
+import numpy as np
 from PIL import Image
+from torch.profiler import record_function
+
+from app import artifacts, config, metrics
+from app.backends import InferenceBackend, build_backend, load_calibration_batches
+from app.preprocess import decode_reduced, normalize_into, preprocess_fast, resize_center_crop
 
 # 首先尝试导入torchvision，并明确捕获导入错误
 try:
@@ -18,10 +26,103 @@ except ImportError as e:
     models = None
     transforms = None
 
+# 支持的 torchvision 分类模型：名称 -> 显示名、权重枚举、预处理尺寸（与官方 IMAGENET1K_V1 权重一致）、嵌入维数
+MODEL_SPECS = {
+    'resnet18': {'display_name': 'ResNet18', 'weights': 'ResNet18_Weights', 'resize': 256, 'crop': 224,
+                 'embedding_dim': 512},
+    'resnet50': {'display_name': 'ResNet50', 'weights': 'ResNet50_Weights', 'resize': 256, 'crop': 224,
+                 'embedding_dim': 2048},
+    'mobilenet_v3_large': {'display_name': 'MobileNetV3-Large', 'weights': 'MobileNet_V3_Large_Weights',
+                           'resize': 256, 'crop': 224, 'embedding_dim': 1280},
+    'mobilenet_v3_small': {'display_name': 'MobileNetV3-Small', 'weights': 'MobileNet_V3_Small_Weights',
+                           'resize': 256, 'crop': 224, 'embedding_dim': 1024},
+}
+
+# torchvision ImageNet 分类模型的输出类别数
+NUM_CLASSES = 1000
+# 类别索引 -> 大类（动物、车辆、食物……）的映射文件
+SUPERCLASSES_PATH = os.path.join(config.PROJECT_DIR, 'imagenet_superclasses.json')
+
+def load_superclasses(path=SUPERCLASSES_PATH, num_classes=NUM_CLASSES):
+    """读取大类映射，返回 (大类名列表, [num_classes, 大类数] 的 0/1 float32 矩阵)
+
+    概率矩阵乘以它就得到每个大类的总概率。文件不存在或格式错误时返回空矩阵（不输出大类得分）。
+    """
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            groups = json.load(f)['superclasses']
+        matrix = torch.zeros((num_classes, len(groups)), dtype=torch.float32)
+        for column, spans in enumerate(groups.values()):
+            for span in spans:
+                start, end = (span, span) if isinstance(span, int) else span
+                matrix[start:end + 1, column] = 1.0
+        return list(groups), matrix
+    except Exception as e:
+        print(f"⚠ 无法加载大类映射 {path}: {e}")
+        return [], torch.zeros((num_classes, 0), dtype=torch.float32)
+
+_TRANSFORMS = {}
+
+def _standard_transform(resize_size=256, crop_size=224):
+    """标准预处理管道：Resize -> CenterCrop -> ToTensor -> Normalize（按尺寸缓存，复用同一个对象）"""
+    key = (resize_size, crop_size)
+    if key not in _TRANSFORMS:
+        _TRANSFORMS[key] = transforms.Compose([
+            transforms.Resize(resize_size),
+            transforms.CenterCrop(crop_size),
+            transforms.ToTensor(),
+            transforms.Normalize(
+                mean=[0.485, 0.456, 0.406],
+                std=[0.229, 0.224, 0.225]
+            )
+        ])
+    return _TRANSFORMS[key]
+
+def preprocess_image(image_bytes, resize_size=256, crop_size=224, fast=True):
+    """模块级的预处理入口，只依赖预处理参数、不依赖模型对象，
+    供推理执行器的线程池/进程池调用（进程池要求可pickle的函数，子进程中也不需要加载任何模型）
+    
+    快速路径返回 [crop, crop, 3] uint8 数组（归一化在组批时完成），
+    标准路径返回 [3, crop, crop] float32 张量，两者都可以交给 predict_batch。
+    """
+    if fast:
+        return preprocess_fast(image_bytes, resize_size, crop_size)
+    image = Image.open(io.BytesIO(image_bytes)).convert('RGB')
+    return _standard_transform(resize_size, crop_size)(image)
+
+def preprocess_image_timed(image_bytes, resize_size=256, crop_size=224, fast=True):
+    """与 preprocess_image 相同，另外返回 解码 和 缩放/裁剪 各自的耗时（秒）
+
+    计时在执行预处理的线程/子进程中完成，随结果一起带回，由调用方记录到 /metrics。
+    """
+    started = time.perf_counter()
+    if fast:
+        image = decode_reduced(image_bytes, resize_size)
+        # PIL 延迟解码，显式 load() 让解码耗时计入 decode 而不是 transform
+        image.load()
+        decoded = time.perf_counter()
+        result = resize_center_crop(image, resize_size, crop_size)
+    else:
+        image = Image.open(io.BytesIO(image_bytes)).convert('RGB')
+        decoded = time.perf_counter()
+        result = _standard_transform(resize_size, crop_size)(image)
+    return result, decoded - started, time.perf_counter() - decoded
+
 class ImageClassifier:
-    def __init__(self):
+    def __init__(self, arch=None, fast_preprocess=None, model_dir=None, backend=None, load_model=True):
+        """load_model=False 时不加载权重、不构建推理后端，只保留预处理参数、标签和结果整理所需的数据
+        （独立推理进程模式下服务进程中的分类器，推理进程就绪后用 set_remote_backend 填入实际的后端和版本；
+        需要在本进程内计算嵌入时由 ensure_weights 再加载权重）"""
+        self.arch = config.DEFAULT_MODEL if arch is None else arch
+        if self.arch not in MODEL_SPECS:
+            raise ValueError(f"不支持的模型 {self.arch}，可选: {', '.join(MODEL_SPECS)}")
+        spec = MODEL_SPECS[self.arch]
+        self.display_name = spec['display_name']
+        self.resize_size = spec['resize']
+        self.crop_size = spec['crop']
+        
         print("=" * 50)
-        print("正在初始化图像分类模型...")
+        print(f"正在初始化图像分类模型 {self.display_name}...")
         
         # 检查torchvision是否可用
         if not TORCHVISION_AVAILABLE:
@@ -35,43 +136,34 @@ class ImageClassifier:
         self.device = torch.device('cpu')
         print(f"使用设备: {self.device}")
         
-        # 加载ResNet18模型（更新为推荐方式）
-        try:
-            print("正在下载ResNet18预训练模型...")
-            # 对于torchvision 0.13+，使用新的weights API
-            from torchvision.models import ResNet18_Weights
-            
-            # 使用最新的预训练权重
-            weights = ResNet18_Weights.IMAGENET1K_V1
-            self.model = models.resnet18(weights=weights)
-            print("✓ 模型加载成功!")
-            
-            # 获取模型预期的预处理方法
-            self.transform = weights.transforms()
-            print("✓ 使用标准预处理管道")
-            
-        except Exception as e:
-            print(f"✗ 新API加载失败，尝试旧方法: {e}")
-            # 回退到旧方法
-            self.model = models.resnet18(pretrained=True)
-            self.transform = transforms.Compose([
-                transforms.Resize(256),
-                transforms.CenterCrop(224),
-                transforms.ToTensor(),
-                transforms.Normalize(
-                    mean=[0.485, 0.456, 0.406],
-                    std=[0.229, 0.224, 0.225]
-                )
-            ])
+        self.model_dir = config.MODEL_DIR if model_dir is None else model_dir
+        self.weights_mmapped = False
+        # 前向推理是否在其他进程中执行（见 set_remote_backend）
+        self.remote_inference = False
+        self._weights_lock = threading.Lock()
+        self.transform = _standard_transform(self.resize_size, self.crop_size)
+        self.preprocess_version = f"torchvision-resize{self.resize_size}-crop{self.crop_size}"
+        
+        if load_model:
+            self.model_version = self._load_weights()
+        else:
+            self.model = None
+            self.model_version = f"{self.arch}/remote"
+            print("✓ 只加载标签和结果整理数据，前向推理在独立推理进程中执行")
         
-        self.model.eval()
-        self.model.to(self.device)
+        # 快速预处理：JPEG缩小解码 + NumPy归一化（误差容限见 app/preprocess.py）
+        self.fast_preprocess = config.FAST_PREPROCESS if fast_preprocess is None else fast_preprocess
+        if self.fast_preprocess:
+            self.preprocess_version = f"fast-draft-boxresize{self.resize_size}-crop{self.crop_size}"
+            print("✓ 使用快速预处理（JPEG缩小解码 + NumPy归一化）")
         
         # 加载完整的1000个ImageNet类别
         print("正在加载ImageNet类别标签...")
         try:
-            # 读取下载的完整标签文件
-            labels_path = os.path.join(os.path.dirname(__file__), '..', 'imagenet_classes.json')
+            # 优先读取本地模型目录中的标签文件，其次是项目目录下载的完整标签文件
+            labels_path = os.path.join(self.model_dir, 'imagenet_classes.json')
+            if not os.path.exists(labels_path):
+                labels_path = os.path.join(os.path.dirname(__file__), '..', 'imagenet_classes.json')
             if not os.path.exists(labels_path):
                 # 如果文件不在上层目录，尝试当前目录
                 labels_path = 'imagenet_classes.json'
@@ -104,77 +196,375 @@ class ImageClassifier:
                 "猫 cat", "狗 dog", "马 horse"
             ]
         
+        # 按类别索引查标签的数组（标签不全时用占位名补齐），整批 top-k 的标签一次取出
+        self.label_array = np.array(
+            list(self.labels[:NUM_CLASSES]) + [f"未知类别 (索引: {i})" for i in range(len(self.labels), NUM_CLASSES)],
+            dtype=object)
+        self.superclass_names, superclass_matrix = load_superclasses()
+        self.superclass_matrix = superclass_matrix.to(self.device)
+        self._animal_column = (self.superclass_names.index('animal')
+                               if 'animal' in self.superclass_names else None)
+        
+        # 推理后端：eager / channels_last / TorchScript / int8 量化 / ONNX Runtime
+        backend = config.INFERENCE_BACKEND if backend is None else backend
+        if load_model:
+            self.backend = self._build_backend(backend)
+        else:
+            self.set_remote_backend(backend, "独立推理进程", self.model_version)
+        # warmup() 的耗时，/health 的 models 中展示
+        self.warmup_timings = None
+        
         print("模型初始化完成!")
         print("=" * 50)
     
-    def predict(self, image_bytes):
-        """预测图像类别"""
+    def _load_weights(self):
+        """加载权重到 self.model（eval 模式），返回模型版本"""
+        if artifacts.has_weights(self.model_dir, self.arch):
+            # 优先使用本地模型文件：不访问网络，权重通过内存映射直接使用
+            print(f"正在从本地模型目录加载{self.display_name}: {self.model_dir}")
+            model = getattr(models, self.arch)(weights=None)
+            meta = artifacts.load_weights(model, self.model_dir, self.arch)
+            self.weights_mmapped = True
+            version = meta.get('version', f'{self.arch}/local')
+            print("✓ 模型加载成功（内存映射本地权重）!")
+        elif not config.ALLOW_MODEL_DOWNLOAD:
+            raise FileNotFoundError(
+                f"本地模型目录 {self.model_dir} 中没有 {self.arch} 权重，且已禁止下载"
+                f"（ALLOW_MODEL_DOWNLOAD=0）。请先运行 python scripts/export_model.py --arch {self.arch}")
+        else:
+            model, version = self._download_model()
+        
+        model.eval()
+        model.to(self.device)
+        self.model = model
+        return version
+    
+    def ensure_weights(self):
+        """没有加载权重的分类器（load_model=False）第一次需要在本进程内推理（计算嵌入）时加载权重，
+        不构建推理后端，模型版本仍以推理进程报告的为准；返回 self.model"""
+        if self.model is None:
+            with self._weights_lock:
+                if self.model is None:
+                    self._load_weights()
+        return self.model
+    
+    def _download_model(self):
+        """没有本地模型文件时，通过 torchvision 下载预训练权重（需要网络），返回 (模型, 版本)"""
+        builder = getattr(models, self.arch)
+        # 加载预训练模型（更新为推荐方式）
         try:
-            # 1. 打开图像
-            image = Image.open(io.BytesIO(image_bytes)).convert('RGB')
-            
-            # 2. 预处理
-            image_tensor = self.transform(image).unsqueeze(0).to(self.device)
+            print(f"正在下载{self.display_name}预训练模型...")
+            # 对于torchvision 0.13+，使用新的weights API
+            weights_enum = getattr(models, MODEL_SPECS[self.arch]['weights'])
             
-            # 3. 推理
-            with torch.no_grad():
-                outputs = self.model(image_tensor)
-                probabilities = torch.nn.functional.softmax(outputs[0], dim=0)
+            # 使用与预处理尺寸一致的预训练权重
+            weights = weights_enum.IMAGENET1K_V1
+            model = builder(weights=weights)
+            print("✓ 模型加载成功!")
             
-            # 4. 获取top-5预测结果（原来top-3，现在显示更多）
-            top5_prob, top5_idx = torch.topk(probabilities, 5)
+            # 版本号用于结果缓存的键，模型权重或预处理变化时缓存自动失效
+            return model, f"{self.arch}/{weights.name}"
             
-            results = []
-            for i in range(top5_prob.size(0)):
-                idx = top5_idx[i].item()
-                # 确保索引在标签范围内
-                if idx < len(self.labels):
-                    label = self.labels[idx]
-                else:
-                    label = f"未知类别 (索引: {idx})"
-                    
-                prob = top5_prob[i].item() * 100  # 转换为百分比
-                
-                results.append({
-                    'class_id': idx,
-                    'class_name': label,
-                    'confidence': round(prob, 2),
-                    'rank': i + 1
-                })
+        except Exception as e:
+            print(f"✗ 新API加载失败，尝试旧方法: {e}")
+            # 回退到旧方法
+            return builder(pretrained=True), f"{self.arch}/pretrained"
+    
+    def _build_backend(self, name):
+        try:
+            calibration = None
+            if name == 'int8_static':
+                calibration = load_calibration_batches(self, config.CALIBRATION_DIR, config.CALIBRATION_IMAGES)
+            backend = build_backend(name, self.model, arch=self.arch,
+                                    calibration_batches=calibration, work_dir=self.model_dir)
+        except Exception as e:
+            print(f"✗ 推理后端 {name} 构建失败，回退到 eager: {e}")
+            backend = build_backend('eager', self.model)
+        print(f"✓ 推理后端: {backend.name} ({backend.description})")
+        return backend
+    
+    def set_remote_backend(self, name, description, model_version):
+        """前向推理在其他进程中执行：记录那边实际使用的后端和模型版本（用于结果缓存键和 /health）"""
+        def run(batch):
+            raise RuntimeError(f"模型 {self.arch} 的前向推理在独立推理进程中执行")
+        self.backend = InferenceBackend(name, run, description)
+        self.model_version = model_version
+        self.remote_inference = True
+    
+    @property
+    def cache_version(self):
+        """结果缓存键中的版本部分（不同后端的数值结果可能不同，也要区分）"""
+        return f"{self.model_version}+{self.backend.name}|{self.preprocess_version}"
+    
+    @property
+    def device_label(self):
+        """接口返回的 device 字段：非 eager 后端时注明实际运行的后端"""
+        if self.backend.name == 'eager':
+            return str(self.device)
+        return f"{self.device} ({self.backend.name})"
+    
+    @property
+    def preprocess_args(self):
+        """本模型的预处理参数，与图片字节一起传给模块级的 preprocess_image"""
+        return (self.resize_size, self.crop_size, self.fast_preprocess)
+    
+    def preprocess(self, image_bytes):
+        """解码并预处理单张图像（格式见 preprocess_image）"""
+        return preprocess_image(image_bytes, *self.preprocess_args)
+    
+    def preprocess_standard(self, image_bytes):
+        """torchvision 标准预处理：全尺寸解码 -> Resize -> CenterCrop -> Normalize"""
+        image = Image.open(io.BytesIO(image_bytes)).convert('RGB')
+        return self.transform(image)
+    
+    def predict(self, image_bytes):
+        """预测图像类别"""
+        try:
+            # 1. 打开图像 + 2. 预处理
+            image_tensor = self.preprocess(image_bytes)
             
-            # 5. 添加一些分析信息
-            top_prediction = results[0]
-            is_animal = any(keyword in top_prediction['class_name'].lower() 
-                          for keyword in ['tiger', 'cat', 'dog', 'lion', 'bear', 'animal'])
+            # 3. 推理 + 4. 整理结果
+            return self.predict_batch([image_tensor])[0]
             
-            return {
+        except Exception as e:
+            return self.error_result(e)
+    
+    def make_batch(self, images):
+        """把预处理结果组成 [N, 3, crop, crop] 批次张量，uint8 图像直接归一化写入批次张量"""
+        batch = torch.empty((len(images), 3, self.crop_size, self.crop_size), dtype=torch.float32)
+        batch_np = batch.numpy()
+        for i, image in enumerate(images):
+            if isinstance(image, np.ndarray):
+                normalize_into(image, batch_np[i])
+            else:
+                batch[i].copy_(image)
+        return batch
+    
+    def predict_batch(self, images, top_k=5):
+        """对一组预处理结果做一次批量前向推理，按输入顺序返回每张图的结果
+
+        top_k 可以是一个整数，也可以是与 images 等长的列表（每张图各自的预测个数）
+        """
+        started = time.perf_counter()
+        # record_function 只在剖析时（见 app/profiling.py）产生事件
+        with record_function('batch_assemble'):
+            batch = self.make_batch(images).to(self.device)
+        assembled = time.perf_counter()
+        with torch.no_grad(), record_function('forward'):
+            outputs = self.backend(batch)
+        forwarded = time.perf_counter()
+        with torch.no_grad(), record_function('postprocess'):
+            probabilities = torch.nn.functional.softmax(outputs, dim=1)
+            results = self.format_results(probabilities, top_k)
+        # 每个批次记录一次（不是每张图）
+        metrics.STAGE_SECONDS.observe(assembled - started, 'batch_assemble')
+        metrics.STAGE_SECONDS.observe(forwarded - assembled, 'forward')
+        metrics.STAGE_SECONDS.observe(time.perf_counter() - forwarded, 'postprocess')
+        return results
+    
+    def _synthetic_images(self, count, seed=0):
+        rng = np.random.default_rng(seed)
+        return [rng.integers(0, 256, (self.crop_size, self.crop_size, 3), dtype=np.uint8) for _ in range(count)]
+    
+    def _run_synthetic(self, images):
+        # 与 predict_batch 相同的计算（组批 -> 前向推理 -> softmax/top-k），但不记录到 /metrics
+        with torch.no_grad():
+            outputs = self.backend(self.make_batch(images).to(self.device))
+            torch.topk(torch.nn.functional.softmax(outputs, dim=1), 5, dim=1)
+    
+    def warmup(self, batch_sizes, iterations=3):
+        """用合成输入按每个批大小跑几次推理，让分配器扩容、算子首次初始化、后端图优化发生在启动时而不是第一批请求上
+
+        fork 出的工作进程要各自预热（线程池和分配器状态都是进程内的）。
+        返回 {批大小: {"first_ms": 第一次耗时, "steady_ms": 之后几次的平均耗时}}
+        """
+        timings = {}
+        for size in batch_sizes:
+            images = self._synthetic_images(size, seed=size)
+            durations = []
+            for _ in range(max(2, iterations)):
+                started = time.perf_counter()
+                self._run_synthetic(images)
+                durations.append((time.perf_counter() - started) * 1000)
+            timings[size] = {
+                'first_ms': round(durations[0], 2),
+                'steady_ms': round(sum(durations[1:]) / len(durations[1:]), 2),
+            }
+        self.warmup_timings = timings
+        return timings
+    
+    def autotune_threads(self, candidates, batch_size, seconds=1.0, tolerance=0.03):
+        """在本机上依次测量各个 intra-op 线程数下的推理吞吐量（img/s），应用最快的设置
+
+        吞吐量与最快设置相差不到 tolerance 时选线程更少的，把核心留给解码/预处理。
+        inter-op 线程数只能在进程开始并行计算前设置一次，不参与测量。
+        返回 (选中的线程数, [{"intra_op": n, "images_per_second": x}, ...])
+        """
+        images = self._synthetic_images(batch_size)
+        results = []
+        for threads in candidates:
+            torch.set_num_threads(threads)
+            # 每个设置先跑一次，线程池按新的线程数创建
+            self._run_synthetic(images)
+            count = 0
+            started = time.perf_counter()
+            while True:
+                self._run_synthetic(images)
+                count += len(images)
+                elapsed = time.perf_counter() - started
+                if elapsed >= seconds:
+                    break
+            results.append({'intra_op': threads, 'images_per_second': round(count / elapsed, 1)})
+        best = max(r['images_per_second'] for r in results)
+        chosen = min(r['intra_op'] for r in results if r['images_per_second'] >= best * (1 - tolerance))
+        torch.set_num_threads(chosen)
+        return chosen, results
+    
+    @property
+    def feature_extractor(self):
+        """去掉最后一个全连接层的 eager 模型，输出倒数第二层的池化特征（ResNet18 为 512 维）
+
+        与分类模型共享同一份权重，不复制；不经过推理后端（后端只输出 logits）。
+        """
+        if getattr(self, '_feature_extractor', None) is None:
+            model = self.ensure_weights()
+            if hasattr(model, 'fc'):
+                # ResNet: conv ... layer4 -> avgpool -> fc
+                layers = [module for name, module in model.named_children() if name != 'fc']
+                layers.append(torch.nn.Flatten(1))
+            else:
+                # MobileNetV3: features -> avgpool -> classifier(Linear, Hardswish, Dropout, Linear)
+                layers = [model.features, model.avgpool, torch.nn.Flatten(1),
+                          *list(model.classifier.children())[:-1]]
+            self._feature_extractor = torch.nn.Sequential(*layers).eval()
+        return self._feature_extractor
+    
+    @property
+    def embedding_dim(self):
+        # 不需要加载权重（打开向量索引时服务进程中可能还没有权重）
+        return MODEL_SPECS[self.arch]['embedding_dim']
+    
+    def embed_batch(self, images):
+        """对一组预处理结果做一次批量前向推理，返回 [N, embedding_dim] float32 特征（未归一化）"""
+        started = time.perf_counter()
+        batch = self.make_batch(images).to(self.device)
+        assembled = time.perf_counter()
+        with torch.no_grad():
+            features = self.feature_extractor(batch)
+        metrics.STAGE_SECONDS.observe(assembled - started, 'batch_assemble')
+        metrics.STAGE_SECONDS.observe(time.perf_counter() - assembled, 'embed_forward')
+        return features.cpu().numpy()
+    
+    def format_results(self, probabilities, top_k=5):
+        """把 [N, num_classes] 概率矩阵整理成每张图的接口返回格式
+
+        top-k、标签查找和大类得分都对整个批次一次完成（大类得分 = 概率 @ 大类矩阵），
+        最后只把结果数组整体转成 Python 列表，不逐个调用 .item()。
+        top_k 可以是一个整数，也可以是每张图各自的预测个数。
+        """
+        count, num_classes = probabilities.shape
+        top_ks = top_k if isinstance(top_k, (list, tuple)) else [top_k] * count
+        k_max = min(max(top_ks), num_classes)
+        top_prob, top_idx = torch.topk(probabilities, k_max, dim=1)
+        group_scores = probabilities @ self.superclass_matrix[:num_classes]
+        # 每张图 top-1 类别所属的大类
+        top_groups = self.superclass_matrix[top_idx[:, 0]] > 0
+        
+        class_ids = top_idx.cpu().numpy()
+        names = self.label_array[class_ids].tolist()
+        confidences = np.round(top_prob.cpu().numpy().astype(np.float64) * 100, 2).tolist()
+        group_percent = np.round(group_scores.cpu().numpy().astype(np.float64) * 100, 2).tolist()
+        top_groups = top_groups.cpu().numpy().tolist()
+        class_ids = class_ids.tolist()
+        
+        results = []
+        for i in range(count):
+            k = min(top_ks[i], k_max)
+            predictions = [
+                {'class_id': class_id, 'class_name': name, 'confidence': confidence, 'rank': rank}
+                for rank, class_id, name, confidence in zip(range(1, k + 1), class_ids[i], names[i], confidences[i])
+            ]
+            top_prediction = predictions[0]
+            results.append({
                 'success': True,
-                'predictions': results,
+                'predictions': predictions,
                 'top_prediction': top_prediction,
                 'analysis': {
-                    'is_animal': is_animal,
+                    # top-1 类别是否属于动物大类（ImageNet 0~397）
+                    'is_animal': self._animal_column is not None and top_groups[i][self._animal_column],
+                    'superclasses': [name for name, member in zip(self.superclass_names, top_groups[i]) if member],
+                    'superclass_scores': dict(zip(self.superclass_names, group_percent[i])),
                     'top_confidence': top_prediction['confidence'],
                     'total_classes_available': len(self.labels)
                 },
                 'message': '识别成功!',
-                'model': 'ResNet18',
-                'device': str(self.device)
-            }
-            
-        except Exception as e:
-            return {
-                'success': False,
-                'error': str(e),
-                'message': '识别失败，请检查图片格式'
-            }
+                'model': self.display_name,
+                'device': self.device_label,
+                'backend': self.backend.name
+            })
+        return results
+    
+    def format_result(self, probabilities, top_k=5):
+        """把单张图的概率向量整理成接口返回格式（见 format_results）"""
+        return self.format_results(probabilities.unsqueeze(0), top_k)[0]
+    
+    @staticmethod
+    def error_result(e):
+        """识别失败时的统一返回格式"""
+        return {
+            'success': False,
+            'error': str(e),
+            'message': '识别失败，请检查图片格式'
+        }
 
-# ==== 文件末尾：创建全局实例 ====
-print("正在创建图像分类器实例...")
-try:
-    classifier = ImageClassifier()
-    print("✓ 图像分类器创建成功！")
-except Exception as e:
-    print(f"✗ 创建分类器失败: {e}")
-    # 创建一个标记对象，让服务至少能启动
-    classifier = None
-    print("⚠ 创建了空的分类器对象，/predict接口将不可用")
\ No newline at end of file
+class EmbeddingModel:
+    """把 embed_batch 包装成 MicroBatcher 需要的 predict_batch 接口，嵌入请求也能合并成批次"""
+    
+    def __init__(self, classifier):
+        self.classifier = classifier
+        self.arch = f"{classifier.arch}-embedding"
+    
+    def predict_batch(self, images, top_k=None):
+        return list(self.classifier.embed_batch(images))
+
+# ==== 默认模型的全局实例：不在导入时创建，由 load_classifier() 在服务启动后（后台）加载 ====
+# 其他模型由 app/registry.py 的 ModelRegistry 按需加载
+classifier = None
+load_error = None
+# load_classifier(defer_backend=True) 推迟构建的推理后端名，由 build_deferred_backend() 构建
+deferred_backend = None
+
+def load_classifier(defer_backend=False):
+    """创建默认模型（DEFAULT_MODEL）的全局分类器实例（幂等），失败时记录错误并返回 None
+
+    defer_backend=True 时只加载权重（eager 后端不做任何计算），配置的推理后端由
+    build_deferred_backend() 在 fork 出的工作进程中构建
+    """
+    global classifier, load_error, deferred_backend
+    if classifier is not None:
+        return classifier
+    print("正在创建图像分类器实例...")
+    try:
+        # 独立推理进程模式下服务进程只保留标签和结果整理数据，默认模型的权重在第一次计算嵌入时才加载
+        backend = None
+        if defer_backend and not config.INFERENCE_PROCESSES and config.INFERENCE_BACKEND != 'eager':
+            backend = 'eager'
+        classifier = ImageClassifier(backend=backend, load_model=not config.INFERENCE_PROCESSES)
+        if backend is not None:
+            deferred_backend = config.INFERENCE_BACKEND
+        load_error = None
+        print("✓ 图像分类器创建成功！")
+    except Exception as e:
+        load_error = str(e)
+        print(f"✗ 创建分类器失败: {e}")
+        print("⚠ /predict接口将不可用")
+    return classifier
+
+def build_deferred_backend():
+    """构建 load_classifier(defer_backend=True) 推迟的推理后端（每个进程只构建一次）"""
+    global deferred_backend
+    if classifier is None or deferred_backend is None:
+        return
+    name, deferred_backend = deferred_backend, None
+    # TorchScript 跟踪、int8 校准、ONNX 导出都会做前向计算，必须在 fork 之后的进程里进行
+    classifier.backend = classifier._build_backend(name)
@@ -0,0 +1,239 @@
+import gzip
+import json
+import os
+import queue
+import re
+import threading
+import time
+
+from app import metrics
+
+# 预测日志：每次识别的结果（图片哈希、top-k、耗时、模型、后端）写入压缩的 JSONL 文件，用于离线分析数据漂移。
+# 请求处理中只把一个小字典放进有上限的内存队列（不做任何 I/O），后台线程按批序列化、写入 .jsonl.gz，
+# 文件（压缩后）超过大小上限时换新文件，超过数量上限时删除最旧的。
+# 正在写入的文件名以 .current 结尾，写完（换新文件或服务退出）后才改名为 .jsonl.gz；
+# 清理旧文件时只考虑已经写完的文件，多个工作进程共用一个目录时不会删掉别的进程正在写的文件。
+# 写入跟不上时直接丢弃新记录并计数，识别请求永远不会因为日志而等待。
+
+RECORDS = metrics.Counter("cnn_prediction_log_records_total", "Prediction log records", ("outcome",))
+
+_NAME_PATTERN = re.compile(r"^predictions-[\w-]+\.jsonl\.gz$")
+# 正在写入的文件：predictions-<时间>-<pid>-<序号>.jsonl.gz.current
+_CURRENT_PATTERN = re.compile(r"^predictions-\d{8}-\d{6}-(\d+)-\d+\.jsonl\.gz\.current$")
+_CURRENT_SUFFIX = ".current"
+
+
+def make_record(digest, model, result, latency_seconds, **extra):
+    """从识别结果中取出需要记录的字段（在请求处理中调用，只做字典操作）"""
+    record = {
+        "ts": round(time.time(), 3),
+        "image": digest,
+        "model": model,
+        "backend": result.get("backend"),
+        "latency_ms": round(latency_seconds * 1000, 2),
+        "success": bool(result.get("success")),
+    }
+    if record["success"]:
+        record["top_k"] = [[p["class_id"], p["confidence"]] for p in result.get("predictions", [])]
+    else:
+        record["error"] = result.get("error")
+    if "cascade" in result:
+        record["cascade_stage"] = result["cascade"].get("stage")
+    record.update(extra)
+    return record
+
+
+class PredictionLog:
+    """有上限的队列 + 后台写入线程（多个工作进程可以共用同一个目录，文件名中带 pid，见模块说明）"""
+
+    def __init__(self, directory, max_file_bytes=64 * 1024 * 1024, max_files=20, queue_size=10000,
+                 flush_records=256, flush_seconds=1.0):
+        self.directory = directory
+        self.max_file_bytes = max(1, int(max_file_bytes))
+        self.max_files = max(1, int(max_files))
+        self.flush_records = max(1, int(flush_records))
+        self.flush_seconds = max(0.01, float(flush_seconds))
+        self._queue = queue.Queue(maxsize=max(1, int(queue_size)))
+        self._stopping = threading.Event()
+        self._thread = None
+        # 当前文件：(路径, 原始文件对象, GzipFile)
+        self._current = None
+        self._sequence = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.files_rotated = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._finish_orphans()
+        self._thread = threading.Thread(target=self._run, name="prediction-log", daemon=True)
+        self._thread.start()
+        print(f"✓ 预测日志: {self.directory} (单个文件 {self.max_file_bytes / 1024 / 1024:g}MB，"
+              f"最多 {self.max_files} 个，队列上限 {self._queue.maxsize})")
+
+    def stop(self, timeout=5.0):
+        """写完队列中剩余的记录并关闭当前文件"""
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def record(self, record):
+        """放入写入队列，不阻塞；队列已满时丢弃并返回 False"""
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            RECORDS.inc("dropped")
+            return False
+        return True
+
+    # ---- 后台写入 ----
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch:
+                self._write(batch)
+            elif self._stopping.is_set():
+                break
+        self._close_quietly()
+
+    def _collect(self):
+        """攒一批记录：够 flush_records 条，或第一条之后超过 flush_seconds 秒"""
+        batch = []
+        try:
+            batch.append(self._queue.get(timeout=self.flush_seconds))
+        except queue.Empty:
+            return batch
+        flush_at = time.monotonic() + self.flush_seconds
+        while len(batch) < self.flush_records:
+            remaining = flush_at - time.monotonic()
+            if remaining <= 0 or self._stopping.is_set():
+                # 停止时不再等待，剩余记录由后续循环写完
+                remaining = 0
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        lines = []
+        for record in batch:
+            try:
+                lines.append(json.dumps(record, ensure_ascii=False, separators=(",", ":")))
+            except (TypeError, ValueError):
+                self.failed += 1
+                RECORDS.inc("failed")
+        data = ("\n".join(lines) + "\n").encode("utf-8") if lines else b""
+        try:
+            if self._current is None:
+                self._open()
+            _, raw, gz = self._current
+            gz.write(data)
+            # 同步刷新：每批写完后文件中已有完整的压缩数据，进程异常退出最多丢失尚未写入的一批
+            gz.flush()
+        except OSError as e:
+            self.failed += len(lines)
+            RECORDS.inc("failed", amount=len(lines))
+            print(f"✗ 预测日志写入失败: {e}")
+            # 丢弃出错的文件，下一批写入新文件；关闭本身也可能失败（磁盘已满等），不能让写入线程退出
+            self._close_quietly()
+            return
+        self.written += len(lines)
+        RECORDS.inc("written", amount=len(lines))
+        if raw.tell() >= self.max_file_bytes and self._close_quietly():
+            self.files_rotated += 1
+
+    def _open(self):
+        self._sequence += 1
+        name = f"predictions-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{self._sequence}.jsonl.gz"
+        path = os.path.join(self.directory, name + _CURRENT_SUFFIX)
+        raw = open(path, "xb")
+        self._current = (path, raw, gzip.GzipFile(filename="", mode="wb", fileobj=raw))
+
+    def _close(self):
+        """写完当前文件：关闭、去掉 .current 后缀，再清理超出数量的旧文件"""
+        if self._current is None:
+            return
+        path, raw, gz = self._current
+        self._current = None
+        try:
+            gz.close()
+        finally:
+            raw.close()
+        os.replace(path, path[:-len(_CURRENT_SUFFIX)])
+        self._rotate()
+
+    def _close_quietly(self):
+        """_close()，失败时只打印错误（当前文件已丢弃），返回是否成功"""
+        try:
+            self._close()
+        except OSError as e:
+            print(f"✗ 预测日志文件关闭失败: {e}")
+            return False
+        return True
+
+    def _finish_orphans(self):
+        """上次异常退出的进程留下的 .current 文件（进程已不存在）改名为已写完的文件"""
+        for name in os.listdir(self.directory):
+            match = _CURRENT_PATTERN.match(name)
+            if match is None or _pid_alive(int(match.group(1))):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                os.replace(path, path[:-len(_CURRENT_SUFFIX)])
+            except FileNotFoundError:
+                pass
+
+    def _rotate(self):
+        # 只删除已经写完的文件（不带 .current），不会影响任何进程正在写的文件
+        for entry in self._entries()[self.max_files:]:
+            try:
+                os.unlink(os.path.join(self.directory, entry["name"]))
+            except FileNotFoundError:
+                pass
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not _NAME_PATTERN.match(name):
+                continue
+            try:
+                st = os.stat(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                continue
+            entries.append({"name": name, "bytes": st.st_size, "modified": st.st_mtime})
+        # 最新的在前
+        entries.sort(key=lambda e: e["modified"], reverse=True)
+        return entries
+
+    def stats(self):
+        current = self._current
+        return {
+            "enabled": True,
+            "directory": self.directory,
+            "queue_depth": self._queue.qsize(),
+            "queue_size": self._queue.maxsize,
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "files_rotated": self.files_rotated,
+            "current_file": os.path.basename(current[0]) if current is not None else None,
+        }
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
@@ -0,0 +1,75 @@
+import io
+
+import numpy as np
+from PIL import Image
+
+# 与 torchvision ResNet18_Weights.IMAGENET1K_V1.transforms() 相同的参数
+RESIZE_SIZE = 256
+CROP_SIZE = 224
+MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+
+# (x / 255 - mean) / std  ==  x * scale - shift，一次乘法一次减法完成归一化
+_SCALE = (1.0 / (255.0 * STD)).reshape(3, 1, 1)
+_SHIFT = (MEAN / STD).reshape(3, 1, 1)
+
+# 快速预处理与 torchvision 标准预处理的误差容限（见 benchmarks/bench_preprocess.py）：
+# - 不触发 JPEG draft 时（PNG/BMP 或原图小于 512），两条路径只在个别像素上相差 1 个灰度级
+#   （归一化后约 0.018），平均差值 < 1e-5
+# - 触发 draft 时，JPEG 在 DCT 域按 1/2、1/4、1/8 缩小解码，像素与全尺寸解码后再缩放略有差异，
+#   要求 top-1 类别一致，且 top-5 中每个类别的置信度差值不超过下面的百分点数
+FAST_PATH_MAX_CONFIDENCE_DIFF = 2.0
+
+
+def decode_reduced(image_bytes, target_size=RESIZE_SIZE):
+    """解码图像；JPEG 使用 draft 模式直接在解码阶段缩小到接近目标尺寸
+
+    draft 选择的缩放比例保证缩小后两条边都不小于 target_size，
+    因此后续缩放到短边 target_size 时不会损失清晰度。
+    """
+    image = Image.open(io.BytesIO(image_bytes))
+    if image.format == "JPEG":
+        image.draft("RGB", (target_size, target_size))
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    return image
+
+
+def resize_center_crop(image, resize_size=RESIZE_SIZE, crop_size=CROP_SIZE):
+    """等价于 Resize(resize_size) + CenterCrop(crop_size)，返回 [H, W, 3] 的 uint8 数组
+
+    只对裁剪区域做缩放（PIL resize 的 box 参数），不生成完整的 256 缩放图。
+    """
+    width, height = image.size
+    # 与 torchvision Resize 相同的目标尺寸计算方式：短边缩放到 resize_size
+    if width <= height:
+        new_w, new_h = resize_size, int(resize_size * height / width)
+    else:
+        new_w, new_h = int(resize_size * width / height), resize_size
+
+    # 与 torchvision CenterCrop 相同的裁剪位置（缩放后坐标）
+    top = int(round((new_h - crop_size) / 2.0))
+    left = int(round((new_w - crop_size) / 2.0))
+
+    # 映射回原图坐标
+    sx, sy = width / new_w, height / new_h
+    box = (left * sx, top * sy, (left + crop_size) * sx, (top + crop_size) * sy)
+    cropped = image.resize((crop_size, crop_size), Image.BILINEAR, box=box)
+    return np.asarray(cropped, dtype=np.uint8)
+
+
+def preprocess_fast(image_bytes, resize_size=RESIZE_SIZE, crop_size=CROP_SIZE):
+    """快速预处理：缩小解码 + 裁剪区域缩放，返回 [crop, crop, 3] uint8 数组
+
+    归一化推迟到组批时由 normalize_into 直接写入批次张量，
+    uint8 数组只有 float32 张量的 1/4 大小，进程池传输也更快。
+    """
+    image = decode_reduced(image_bytes, resize_size)
+    return resize_center_crop(image, resize_size, crop_size)
+
+
+def normalize_into(image_hwc, out_chw):
+    """把 [H, W, 3] uint8 图像归一化后写入 out_chw（[3, H, W] float32 数组，可以是批次张量的视图）"""
+    np.multiply(image_hwc.transpose(2, 0, 1), _SCALE, out=out_chw)
+    np.subtract(out_chw, _SHIFT, out=out_chw)
+    return out_chw
@@ -0,0 +1,183 @@
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+
+from torch.profiler import ProfilerActivity, profile, record_function
+
+from app import metrics
+
+# 请求剖析：管理员按请求开启（/predict?profile=1），或按 PROFILE_SAMPLE_RATE 抽样。
+# 被剖析的请求记录 Python 层各阶段（等待名额、解码、缩放/裁剪、等待组批）的时间，
+# 前向推理所在的批次在 torch.profiler 下执行，两者合并成一个 Chrome trace 文件
+# （chrome://tracing 或 https://ui.perfetto.dev 打开），保存在有数量上限的目录中，旧文件自动删除。
+# 使用独立推理进程时由推理进程剖析前向推理，导出的算子事件随结果传回（见 app/worker_pool.py）。
+
+TRACES = metrics.Counter("cnn_profile_traces_total", "Profiling traces written", ("trigger",))
+
+# 批次在 torch.profiler 下执行时外层的标记，用来对齐 Python 阶段和算子事件的时间轴
+_BATCH_MARKER = "cnn_profiled_batch"
+# Chrome trace 中 Python 阶段所在的“进程”
+_STAGES_PID = 0
+_NAME_PATTERN = re.compile(r"^[\w.-]+\.json$")
+
+# torch.profiler 在一个进程中同一时刻只能有一个在运行（多个模型的批处理线程可能同时需要）
+_profiler_lock = threading.Lock()
+
+
+class RequestTrace:
+    """一次被剖析的请求：各阶段的 perf_counter 时间 + 若干次批次剖析结果"""
+
+    def __init__(self, model, trigger):
+        self.id = uuid.uuid4().hex[:12]
+        self.model = model
+        # requested（管理员指定）/ sampled（抽样）
+        self.trigger = trigger
+        self.created = time.time()
+        self.name = f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(self.created))}-{trigger}-{model}-{self.id}.json"
+        self.stages = []
+        # [(profiler 或已导出的事件列表, perf_counter 时间, 批大小)]，级联时有两次
+        self.captures = []
+        self.notes = []
+
+    def add_stage(self, name, start, end, **args):
+        self.stages.append((name, start, end, args))
+
+    def add_capture(self, profiler, started, batch_size):
+        """profiler: 本进程的 torch.profiler，或其他进程中已经用 export_events 导出的事件列表"""
+        self.captures.append((profiler, started, batch_size))
+
+    def chrome_trace(self):
+        """合并成 Chrome trace（JSON 对象）"""
+        trace = {"traceEvents": [], "displayTimeUnit": "ms"}
+        # Python 阶段的时间轴对齐到第一次批次剖析的标记事件；没有剖析结果时从 0 开始
+        anchor = None
+        for profiler, started, batch_size in self.captures:
+            events = profiler if isinstance(profiler, list) else export_events(profiler)
+            marker = next((e for e in events if e.get("name") == _BATCH_MARKER), None)
+            if marker is not None:
+                marker["args"] = dict(marker.get("args", {}), batch_size=batch_size)
+                if anchor is None:
+                    anchor = (started, marker["ts"])
+            trace["traceEvents"].extend(events)
+        if anchor is None:
+            first = min((start for _, start, _, _ in self.stages), default=0.0)
+            anchor = (first, 0.0)
+
+        trace["traceEvents"].append({"ph": "M", "name": "process_name", "pid": _STAGES_PID, "tid": 0,
+                                     "args": {"name": f"request {self.id} ({self.model})"}})
+        for name, start, end, args in self.stages:
+            trace["traceEvents"].append({
+                "ph": "X", "cat": "stage", "name": name, "pid": _STAGES_PID, "tid": 0,
+                "ts": anchor[1] + (start - anchor[0]) * 1e6,
+                "dur": max(0.0, end - start) * 1e6,
+                "args": args,
+            })
+        trace["otherData"] = {
+            "trace_id": self.id,
+            "model": self.model,
+            "trigger": self.trigger,
+            "created": self.created,
+            "stages_ms": {name: round((end - start) * 1000, 3) for name, start, end, _ in self.stages},
+            "profiled_batches": len(self.captures),
+            "notes": self.notes,
+        }
+        return trace
+
+
+def export_events(profiler):
+    """导出 Chrome trace 事件列表（torch.profiler 只能导出到文件）"""
+    fd, path = tempfile.mkstemp(suffix=".json")
+    os.close(fd)
+    try:
+        profiler.export_chrome_trace(path)
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f).get("traceEvents", [])
+    finally:
+        os.unlink(path)
+
+
+def profile_call(fn, traces, batch_size):
+    """在 torch.profiler 下执行 fn()（一个批次的前向推理），剖析结果交给 traces 中的每个 RequestTrace
+
+    已有其他批次正在剖析时不剖析，直接执行。
+    """
+    if not _profiler_lock.acquire(blocking=False):
+        for trace in traces:
+            trace.notes.append("profiler busy: batch not profiled")
+        return fn()
+    try:
+        result, started, profiler = capture(fn)
+    finally:
+        _profiler_lock.release()
+    # 导出比较慢，留到保存时（不在批处理线程中）进行
+    for trace in traces:
+        trace.add_capture(profiler, started, batch_size)
+    return result
+
+
+def capture(fn):
+    """在 torch.profiler 下执行 fn()，返回 (结果, 开始时的 perf_counter 时间, profiler)
+
+    perf_counter 是系统范围的单调时钟，推理进程中的开始时间可以直接和服务进程中的阶段时间对齐。
+    """
+    with profile(activities=[ProfilerActivity.CPU], record_shapes=True) as profiler:
+        started = time.perf_counter()
+        with record_function(_BATCH_MARKER):
+            result = fn()
+    return result, started, profiler
+
+
+class TraceStore:
+    """剖析结果目录：最多保留 max_traces 个文件，超出时删除最旧的（多个工作进程可以共用同一个目录）"""
+
+    def __init__(self, directory, max_traces=50):
+        self.directory = directory
+        self.max_traces = max(1, int(max_traces))
+        os.makedirs(directory, exist_ok=True)
+
+    def save(self, trace):
+        """写入 trace 文件（阻塞，在线程中调用），返回文件名"""
+        data = json.dumps(trace.chrome_trace()).encode("utf-8")
+        tmp = os.path.join(self.directory, f".{trace.name}.tmp")
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, os.path.join(self.directory, trace.name))
+        TRACES.inc(trace.trigger)
+        self._rotate()
+        return trace.name
+
+    def _rotate(self):
+        entries = self._entries()
+        for entry in entries[self.max_traces:]:
+            try:
+                os.unlink(os.path.join(self.directory, entry["name"]))
+            except FileNotFoundError:
+                pass
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not _NAME_PATTERN.match(name):
+                continue
+            try:
+                st = os.stat(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                continue
+            entries.append({"name": name, "bytes": st.st_size, "created": st.st_mtime})
+        # 最新的在前
+        entries.sort(key=lambda e: e["created"], reverse=True)
+        return entries
+
+    def list(self, limit=100):
+        return self._entries()[:limit]
+
+    def path(self, name):
+        """trace 文件路径；名称不合法或文件不存在时返回 None"""
+        if not _NAME_PATTERN.match(name):
+            return None
+        path = os.path.join(self.directory, name)
+        return path if os.path.isfile(path) else None
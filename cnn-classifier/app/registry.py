@@ -0,0 +1,248 @@
+import asyncio
+import gc
+import time
+
+
+class UnknownModelError(KeyError):
+    """请求了未配置的模型"""
+
+    def __str__(self):
+        return f"未知的模型 {self.args[0]}"
+
+
+class ModelEntry:
+    """注册表中的一个模型：分类器（含自己的预处理参数）+ 自己的微批处理队列"""
+
+    def __init__(self, name):
+        self.name = name
+        self.classifier = None
+        self.batcher = None
+        self.memory_bytes = 0
+        self.in_use = 0
+        self.last_used = 0.0
+        self.loads = 0
+        self.evictions = 0
+        self.load_seconds = None
+        self.load_error = None
+        self._lock = None
+
+    @property
+    def loaded(self):
+        return self.classifier is not None
+
+    def lock(self):
+        # asyncio.Lock 需要在事件循环中创建
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+
+def estimate_model_bytes(classifier):
+    """估算模型在本进程中占用的内存：参数 + 缓冲区；非 eager 后端另有一份转换后的权重，按两倍计
+
+    只有标签、没有加载权重的分类器（独立推理进程模式）为 0，推理进程中的模型由 batcher.memory_bytes() 计入。
+    """
+    model = classifier.model
+    if model is None:
+        return 0
+    size = sum(t.numel() * t.element_size() for t in list(model.parameters()) + list(model.buffers()))
+    if classifier.backend.name != "eager" and not classifier.remote_inference:
+        size *= 2
+    return size
+
+
+class ModelRegistry:
+    """多模型注册表：按需加载、按请求路由，超出内存预算时淘汰最久未使用的空闲模型
+
+    - loader(name) 在线程中创建分类器（阻塞操作）
+    - batcher_factory(classifier) 为每个模型创建独立的微批处理器
+    - 默认模型常驻，不参与淘汰
+    只在 asyncio 事件循环中调用。
+    """
+
+    def __init__(self, names, default, loader, batcher_factory, memory_budget_bytes):
+        self.default = default
+        self.loader = loader
+        self.batcher_factory = batcher_factory
+        self.memory_budget_bytes = memory_budget_bytes
+        self._entries = {name: ModelEntry(name) for name in names}
+        if default not in self._entries:
+            self._entries[default] = ModelEntry(default)
+
+    @property
+    def names(self):
+        return list(self._entries)
+
+    def entry(self, name=None):
+        name = name or self.default
+        if name not in self._entries:
+            raise UnknownModelError(name)
+        return self._entries[name]
+
+    def adopt(self, name, classifier):
+        """登记一个已经加载好的分类器（例如启动时预加载的默认模型）"""
+        entry = self.entry(name)
+        self._activate(entry, classifier, 0.0)
+        return entry
+
+    def _activate(self, entry, classifier, load_seconds):
+        entry.classifier = classifier
+        entry.batcher = self.batcher_factory(classifier)
+        entry.batcher.start()
+        entry.memory_bytes = estimate_model_bytes(classifier)
+        entry.loads += 1
+        entry.load_seconds = round(load_seconds, 3)
+        entry.load_error = None
+        entry.last_used = time.monotonic()
+
+    async def acquire(self, name=None):
+        """取得模型（必要时在后台线程中加载），使用完必须调用 release"""
+        entry = self.entry(name)
+        # 先占用，避免加载期间被淘汰
+        entry.in_use += 1
+        try:
+            if not entry.loaded:
+                async with entry.lock():
+                    if not entry.loaded:
+                        await self._load(entry)
+        except BaseException:
+            entry.in_use -= 1
+            raise
+        entry.last_used = time.monotonic()
+        return entry
+
+    def release(self, entry):
+        entry.in_use -= 1
+        entry.last_used = time.monotonic()
+
+    def use(self, name=None):
+        """async with registry.use(name) as entry: ..."""
+        return _Use(self, name)
+
+    async def _load(self, entry):
+        started = time.monotonic()
+        try:
+            classifier = await asyncio.to_thread(self.loader, entry.name)
+        except Exception as e:
+            entry.load_error = str(e)
+            raise
+        self._activate(entry, classifier, time.monotonic() - started)
+        await self.wait_ready(entry)
+        print(f"✓ 模型 {entry.name} 已加载（{entry.memory_bytes / 1024 / 1024:.1f}MB，"
+              f"耗时 {entry.load_seconds}s）")
+        await self._evict_if_needed(keep=entry)
+
+    async def wait_ready(self, entry):
+        """等待模型可以推理：独立推理进程模式下等推理进程就绪（进程内推理立即返回），
+        再把推理进程中的模型内存计入 memory_bytes
+
+        推理进程启动失败或超时（见 INFERENCE_PROCESS_STARTUP_TIMEOUT）时记录 load_error、
+        停止该模型的批处理器（和推理进程）并抛出 RuntimeError，之后的请求会重新尝试加载。
+        """
+        try:
+            if not await asyncio.to_thread(entry.batcher.wait_ready):
+                raise RuntimeError(f"模型 {entry.name} 的推理进程没有在规定时间内就绪")
+        except Exception as e:
+            entry.load_error = str(e)
+            print(f"✗ 模型 {entry.name} 加载失败: {e}")
+            batcher = self._detach(entry)
+            await asyncio.to_thread(_release, [batcher])
+            raise RuntimeError(entry.load_error) from e
+        self._refresh_memory(entry)
+
+    @staticmethod
+    def _refresh_memory(entry):
+        # 服务进程中的权重（独立推理进程模式下可能在第一次计算嵌入时才加载）+ 推理进程中的权重
+        if entry.loaded:
+            entry.memory_bytes = estimate_model_bytes(entry.classifier) + entry.batcher.memory_bytes()
+
+    async def _evict_if_needed(self, keep):
+        for entry in self._entries.values():
+            self._refresh_memory(entry)
+        total = sum(e.memory_bytes for e in self._entries.values() if e.loaded)
+        if total <= self.memory_budget_bytes:
+            return
+        candidates = sorted(
+            (e for e in self._entries.values()
+             if e.loaded and e is not keep and e.name != self.default and e.in_use == 0),
+            key=lambda e: e.last_used)
+        batchers = []
+        for entry in candidates:
+            if total <= self.memory_budget_bytes:
+                break
+            total -= entry.memory_bytes
+            batchers.append(self._evict(entry))
+        if total > self.memory_budget_bytes:
+            print(f"⚠ 已加载模型占用 {total / 1024 / 1024:.1f}MB，超出预算但没有可淘汰的空闲模型")
+        if batchers:
+            # 停止批处理线程（最多等待数秒）和 gc.collect 都会阻塞，不在事件循环中执行
+            await asyncio.to_thread(_release, batchers)
+
+    def _evict(self, entry):
+        """把模型从注册表中摘下（之后的请求会重新加载），返回需要停止的批处理器"""
+        print(f"淘汰模型 {entry.name}（最久未使用，释放约 {entry.memory_bytes / 1024 / 1024:.1f}MB）")
+        entry.evictions += 1
+        return self._detach(entry)
+
+    @staticmethod
+    def _detach(entry):
+        batcher = entry.batcher
+        entry.batcher = None
+        entry.classifier = None
+        entry.memory_bytes = 0
+        return batcher
+
+    def stop(self):
+        for entry in self._entries.values():
+            if entry.batcher is not None:
+                entry.batcher.stop()
+
+    def stats(self):
+        models = {}
+        for name, entry in self._entries.items():
+            self._refresh_memory(entry)
+            info = {
+                "loaded": entry.loaded,
+                "default": name == self.default,
+                "in_use": entry.in_use,
+                "memory_mb": round(entry.memory_bytes / 1024 / 1024, 1),
+                "loads": entry.loads,
+                "evictions": entry.evictions,
+                "load_seconds": entry.load_seconds,
+            }
+            if entry.load_error:
+                info["load_error"] = entry.load_error
+            if entry.loaded:
+                info["display_name"] = entry.classifier.display_name
+                info["backend"] = entry.classifier.backend.name
+                info["batching"] = entry.batcher.stats()
+                if entry.classifier.warmup_timings:
+                    info["warmup_ms"] = entry.classifier.warmup_timings
+            models[name] = info
+        return {
+            "memory_budget_mb": round(self.memory_budget_bytes / 1024 / 1024, 1),
+            "memory_used_mb": round(sum(e.memory_bytes for e in self._entries.values()) / 1024 / 1024, 1),
+            "models": models,
+        }
+
+
+def _release(batchers):
+    # 队列中已有的请求会在 stop 时处理完
+    for batcher in batchers:
+        batcher.stop()
+    gc.collect()
+
+
+class _Use:
+    def __init__(self, registry, name):
+        self.registry = registry
+        self.name = name
+        self.entry = None
+
+    async def __aenter__(self):
+        self.entry = await self.registry.acquire(self.name)
+        return self.entry
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.registry.release(self.entry)
+        return False
@@ -0,0 +1,106 @@
+import json
+
+from fastapi import HTTPException
+from fastapi.responses import Response
+
+# 识别结果的精简与编码：
+#   - top_k：只返回前 k 个预测（缓存中保存的是前 max(5, k) 个，按需截断）
+#   - fields：只返回指定字段，例如 fields=predictions.class_id,predictions.confidence
+#   - Accept: application/msgpack 时返回 msgpack，否则返回 JSON（安装了 orjson 时使用 orjson 编码）
+# orjson / msgpack 都是可选依赖，没有安装时分别回退到标准库 json / 不支持 msgpack。
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# 缓存和批处理默认计算的预测个数（与原来的 top-5 一致）
+DEFAULT_TOP_K = 5
+MAX_TOP_K = 100
+
+JSON_MEDIA_TYPE = "application/json"
+MSGPACK_MEDIA_TYPES = ("application/msgpack", "application/x-msgpack")
+JSON_ENCODER = "orjson" if orjson is not None else "json"
+
+
+def dumps_json(obj):
+    """编码成 UTF-8 JSON 字节"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+
+def wants_msgpack(accept):
+    """根据 Accept 头选择编码；要求 msgpack 但没有安装时返回 406"""
+    accept = (accept or "").lower()
+    if not any(media_type in accept for media_type in MSGPACK_MEDIA_TYPES):
+        return False
+    if msgpack is None:
+        raise HTTPException(status_code=406, detail="服务端没有安装 msgpack，请使用 Accept: application/json")
+    return True
+
+
+def encode(obj, use_msgpack=False):
+    """返回 (字节, media_type)"""
+    if use_msgpack:
+        return msgpack.packb(obj, use_bin_type=True), MSGPACK_MEDIA_TYPES[0]
+    return dumps_json(obj), JSON_MEDIA_TYPE
+
+
+def encoded_response(obj, use_msgpack=False, status_code=200):
+    body, media_type = encode(obj, use_msgpack)
+    return Response(content=body, media_type=media_type, status_code=status_code)
+
+
+def parse_fields(spec):
+    """解析 fields 参数：逗号分隔的顶层字段名，或 字段.子字段（用于 predictions / top_prediction 中的每一项）
+
+    返回 {顶层字段: None（整个字段）或子字段集合}；spec 为空时返回 None（不筛选）。
+    """
+    if not spec:
+        return None
+    selected = {}
+    for name in spec.split(","):
+        name = name.strip()
+        if not name:
+            continue
+        top, _, sub = name.partition(".")
+        if not top.isidentifier() or (sub and not sub.isidentifier()):
+            raise HTTPException(status_code=400, detail=f"fields 参数格式错误: {name}")
+        if not sub:
+            selected[top] = None
+        elif top not in selected or selected[top] is not None:
+            selected.setdefault(top, set()).add(sub)
+    return selected
+
+
+def shape_result(result, top_k=DEFAULT_TOP_K, fields=None):
+    """按 top_k 和 fields 生成返回给客户端的结果（不修改缓存中的原始结果）
+
+    失败的结果原样返回；success 字段总是保留。
+    """
+    if not result.get("success"):
+        return result
+    predictions = result.get("predictions")
+    if predictions is not None and len(predictions) > top_k:
+        result = dict(result, predictions=predictions[:top_k])
+    if fields is None:
+        return result
+
+    shaped = {"success": True}
+    for top, subfields in fields.items():
+        if top not in result:
+            continue
+        value = result[top]
+        if subfields is not None:
+            if isinstance(value, list):
+                value = [{k: v for k, v in item.items() if k in subfields} for item in value]
+            elif isinstance(value, dict):
+                value = {k: v for k, v in value.items() if k in subfields}
+        shaped[top] = value
+    return shaped
@@ -0,0 +1,137 @@
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+
+import torch
+import uvicorn
+
+
+def process_memory():
+    """当前进程的内存占用（MB），读取 /proc/self/smaps_rollup，非 Linux 系统只返回 pid
+
+    fork 出的工作进程与父进程共享的页面也会计入 RSS，所以要看：
+    - private_mb: 本进程独占的内存，也就是每增加一个工作进程真正新增的内存
+    - pss_mb: 共享页面按进程数均摊后的占用，各进程相加即为总内存
+    """
+    result = {"pid": os.getpid()}
+    fields = {"Rss": "rss_mb", "Pss": "pss_mb", "Private_Clean": "private_mb", "Private_Dirty": "private_mb",
+              "Shared_Clean": "shared_mb", "Shared_Dirty": "shared_mb"}
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in fields:
+                    name = fields[key]
+                    result[name] = result.get(name, 0) + int(value.split()[0]) / 1024
+    except OSError:
+        return result
+    for name in fields.values():
+        if name in result:
+            result[name] = round(result[name], 1)
+    return result
+
+
+def share_model_memory(model):
+    """把模型参数移到共享内存，fork 后各工作进程直接映射同一份权重"""
+    try:
+        model.share_memory()
+        print("✓ 模型权重已放入共享内存")
+    except Exception as e:
+        # Docker 默认 /dev/shm 只有 64MB，放不下时退回到 fork 的写时复制共享
+        print(f"⚠ 无法放入共享内存，依赖 fork 写时复制共享权重: {e}")
+
+
+def _bind_socket(host, port):
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _run_worker(app, sock, index, torch_threads, log_level):
+    # 子进程：恢复默认信号处理，交给 uvicorn 接管
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    if torch_threads > 0:
+        torch.set_num_threads(torch_threads)
+    print(f"✓ 工作进程 #{index} 启动 (pid={os.getpid()}, torch线程={torch.get_num_threads()})")
+
+    config = uvicorn.Config(app, log_level=log_level)
+    server = uvicorn.Server(config)
+    server.run(sockets=[sock])
+
+
+def serve(app, host="0.0.0.0", port=8000, workers=1, torch_threads=0, model=None, log_level="info"):
+    """启动 HTTP 服务
+
+    workers == 1 时直接 uvicorn.run；workers > 1 时使用预先 fork 模式：
+    父进程已经加载好模型（见 app/main.py 的 __main__），先把权重放入共享内存并冻结 GC，
+    然后绑定端口并 fork 出 workers 个工作进程共享同一个监听 socket。
+    父进程只负责监控，工作进程异常退出时自动重启。
+    """
+    if workers <= 1:
+        uvicorn.run(app, host=host, port=port, log_level=log_level)
+        return
+
+    if model is not None:
+        share_model_memory(model)
+    # 把目前所有对象移出 GC 跟踪，避免子进程里 GC 扫描改写对象头导致写时复制
+    gc.collect()
+    gc.freeze()
+
+    sock = _bind_socket(host, port)
+    children = {}
+    stopping = False
+
+    def spawn(index):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                _run_worker(app, sock, index, torch_threads, log_level)
+            finally:
+                os._exit(0)
+        children[pid] = index
+
+    def shutdown(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, shutdown)
+    signal.signal(signal.SIGTERM, shutdown)
+
+    print(f"✓ 多进程模式: {workers} 个工作进程, 监听 {host}:{port} (父进程 pid={os.getpid()})")
+    mem = process_memory()
+    if "rss_mb" in mem:
+        print(f"  父进程内存: RSS={mem['rss_mb']}MB（工作进程与父进程共享这部分，实际新增内存见 /health 的 private_mb）")
+    for index in range(workers):
+        spawn(index)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        index = children.pop(pid, None)
+        if index is None or stopping:
+            continue
+        print(f"✗ 工作进程 #{index} (pid={pid}) 退出，状态码 {status}，1秒后重启")
+        time.sleep(1)
+        if not stopping:
+            spawn(index)
+
+    sock.close()
+    print("服务已停止")
+    sys.exit(0)
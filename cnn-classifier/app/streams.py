@@ -0,0 +1,140 @@
+import asyncio
+import struct
+
+from starlette.websockets import WebSocketDisconnect
+
+from app import metrics
+
+# WebSocket 逐帧识别（/ws/predict）的协议：
+#   客户端 -> 服务端：二进制消息 = 8 字节大端序列号（uint64）+ 帧数据（编码后的图片，或 input=tensor 时的 uint8 HWC 数组）
+#   服务端 -> 客户端：每帧一条消息 {"seq": 序列号, ...识别结果}，被丢弃的帧返回 {"seq", "success": false, "dropped": true}
+# 结果按完成顺序返回（可能与发送顺序不同），客户端用 seq 对应。
+
+SEQ_HEADER = struct.Struct("!Q")
+POLICIES = ("drop_stale", "queue")
+
+STREAMS = {"active": 0, "total": 0}
+FRAMES = metrics.Counter("cnn_ws_frames_total", "WebSocket frames by outcome", ("outcome",))
+metrics.Gauge("cnn_ws_streams_active", "Open WebSocket prediction streams", lambda: STREAMS["active"])
+
+
+class FrameStream:
+    """一个 WebSocket 连接上的帧流水线
+
+    同时最多 max_in_flight 帧在识别中（这些帧和其他连接、HTTP 请求一起进入同一个微批处理队列），
+    新帧到达时如果已满：
+      - drop_stale：只保留最新的一帧等待，之前等待的帧直接丢弃（摄像头场景只关心最新画面）
+      - queue：暂停读取新消息，直到有帧识别完成（所有帧都会被识别，客户端发送会被反压）
+    process(seq, payload) 是返回结果字典的协程函数，encode(obj) 返回 (text 或 bytes)。
+    """
+
+    def __init__(self, websocket, process, encode, policy="drop_stale", max_in_flight=2, max_frame_bytes=None):
+        if policy not in POLICIES:
+            raise ValueError(f"policy 必须是 {' / '.join(POLICIES)}")
+        self.websocket = websocket
+        self.process = process
+        self.encode = encode
+        self.policy = policy
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.max_frame_bytes = max_frame_bytes
+        self._tasks = set()
+        self._pending = None
+        # 连接结束后不再开始任何帧（被取消的任务完成回调里也不会启动等待中的帧）
+        self._closed = False
+        self._send_lock = asyncio.Lock()
+        self._slot_free = asyncio.Event()
+        self.received = 0
+        self.completed = 0
+        self.dropped = 0
+
+    async def run(self):
+        STREAMS["active"] += 1
+        STREAMS["total"] += 1
+        try:
+            while True:
+                message = await self.websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                data = message.get("bytes")
+                if data is None:
+                    await self._send({"success": False, "error": "只接受二进制消息（8 字节序列号 + 帧数据）"})
+                    continue
+                if len(data) <= SEQ_HEADER.size:
+                    await self._send({"success": False, "error": "消息太短，缺少序列号或帧数据"})
+                    continue
+                if self.max_frame_bytes is not None and len(data) - SEQ_HEADER.size > self.max_frame_bytes:
+                    FRAMES.inc("rejected")
+                    await self.websocket.close(code=1009, reason="frame too large")
+                    break
+                seq = SEQ_HEADER.unpack_from(data)[0]
+                # memoryview 切片不复制帧数据
+                payload = memoryview(data)[SEQ_HEADER.size:]
+                self.received += 1
+                await self._admit(seq, payload)
+        except WebSocketDisconnect:
+            pass
+        finally:
+            STREAMS["active"] -= 1
+            self._closed = True
+            # 释放等待中的帧数据
+            self._pending = None
+            for task in list(self._tasks):
+                task.cancel()
+
+    async def _admit(self, seq, payload):
+        if len(self._tasks) < self.max_in_flight:
+            self._start(seq, payload)
+            return
+        if self.policy == "queue":
+            while len(self._tasks) >= self.max_in_flight:
+                self._slot_free.clear()
+                await self._slot_free.wait()
+            self._start(seq, payload)
+            return
+        # drop_stale：替换掉还没开始识别的旧帧
+        if self._pending is not None:
+            await self._drop(self._pending[0])
+        self._pending = (seq, payload)
+
+    def _start(self, seq, payload):
+        task = asyncio.ensure_future(self._run_frame(seq, payload))
+        self._tasks.add(task)
+        task.add_done_callback(self._finished)
+
+    def _finished(self, task):
+        self._tasks.discard(task)
+        if self._closed:
+            return
+        if self._pending is not None and len(self._tasks) < self.max_in_flight:
+            seq, payload = self._pending
+            self._pending = None
+            self._start(seq, payload)
+        self._slot_free.set()
+
+    async def _run_frame(self, seq, payload):
+        try:
+            result = await self.process(seq, payload)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            result = {"success": False, "error": str(e)}
+        FRAMES.inc("processed" if result.get("success") else "error")
+        self.completed += 1
+        await self._send({"seq": seq, **result})
+
+    async def _drop(self, seq):
+        self.dropped += 1
+        FRAMES.inc("dropped")
+        await self._send({"seq": seq, "success": False, "dropped": True})
+
+    async def _send(self, obj):
+        data = self.encode(obj)
+        try:
+            async with self._send_lock:
+                if isinstance(data, bytes):
+                    await self.websocket.send_bytes(data)
+                else:
+                    await self.websocket.send_text(data)
+        except (WebSocketDisconnect, RuntimeError):
+            # 连接已经关闭，结果直接丢弃
+            pass
@@ -0,0 +1,102 @@
+import io
+
+import numpy as np
+
+# 已解码图像的输入格式（/predict/tensor）：
+#   - .npy 文件（Content-Type: application/x-npy）
+#   - 原始字节（Content-Type: application/octet-stream）+ X-Tensor-Shape 头，例如 "224,224,3" 或 "8,3,224,224"
+# 只接受 uint8、C 连续的 RGB 数据，形状为 HWC / CHW 或它们的堆叠 NHWC / NCHW，H、W 必须等于模型的输入尺寸。
+# 数组直接用 np.frombuffer 引用请求体，不复制；归一化时才写入批次张量。
+
+NPY_MEDIA_TYPES = ("application/x-npy", "application/npy")
+RAW_MEDIA_TYPE = "application/octet-stream"
+LAYOUTS = ("hwc", "chw")
+# .npy 头部的最大长度（numpy 写出的头部按 64 字节对齐，通常只有 128 字节）
+MAX_NPY_HEADER_BYTES = 4096
+
+
+class TensorError(ValueError):
+    """张量输入不合法（返回 400）"""
+
+
+def parse_npy(data):
+    """解析 .npy 字节，返回引用 data 的只读数组（不复制）"""
+    buffer = io.BytesIO(data)
+    try:
+        version = np.lib.format.read_magic(buffer)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(buffer)
+        elif version in ((2, 0), (3, 0)):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(buffer)
+        else:
+            raise TensorError(f"不支持的 .npy 版本 {version}")
+    except TensorError:
+        raise
+    except Exception as e:
+        raise TensorError(f".npy 头部格式错误: {e}")
+    offset = buffer.tell()
+    if offset > MAX_NPY_HEADER_BYTES:
+        raise TensorError(".npy 头部过长")
+    if fortran_order:
+        raise TensorError("只支持 C 顺序的数组（fortran_order=False）")
+    if dtype != np.uint8:
+        raise TensorError(f"dtype 必须是 uint8，收到 {dtype}")
+    return _from_buffer(data, shape, offset)
+
+
+def parse_raw(data, shape_header, dtype_header=None):
+    """解析原始字节，形状来自 X-Tensor-Shape 头（逗号分隔）"""
+    if dtype_header and dtype_header.strip().lower() != "uint8":
+        raise TensorError(f"dtype 必须是 uint8，收到 {dtype_header}")
+    if not shape_header:
+        raise TensorError("原始字节输入需要 X-Tensor-Shape 头，例如 224,224,3")
+    try:
+        shape = tuple(int(dim) for dim in shape_header.replace("x", ",").split(","))
+    except ValueError:
+        raise TensorError(f"X-Tensor-Shape 格式错误: {shape_header}")
+    if any(dim <= 0 for dim in shape):
+        raise TensorError(f"X-Tensor-Shape 中的维度必须为正数: {shape_header}")
+    return _from_buffer(data, shape, 0)
+
+
+def _from_buffer(data, shape, offset):
+    expected = int(np.prod(shape)) if shape else 1
+    if len(data) - offset != expected:
+        raise TensorError(f"数据长度 {len(data) - offset} 字节与形状 {tuple(shape)} 不符（应为 {expected} 字节）")
+    return np.frombuffer(data, dtype=np.uint8, count=expected, offset=offset).reshape(shape)
+
+
+def split_images(array, size, layout=None, max_images=None):
+    """校验形状并拆成单张 [H, W, 3] 图像（都是 array 的视图）
+
+    返回 (图像列表, 是否为堆叠输入)。layout 为空时根据通道维所在位置推断。
+    """
+    if array.ndim not in (3, 4):
+        raise TensorError(f"数组必须是 3 维（单张）或 4 维（堆叠），收到形状 {array.shape}")
+    stacked = array.ndim == 4
+    single_shape = array.shape[1:] if stacked else array.shape
+
+    if layout is None:
+        if single_shape[-1] == 3:
+            layout = "hwc"
+        elif single_shape[0] == 3:
+            layout = "chw"
+        else:
+            raise TensorError(f"无法判断通道维，形状 {array.shape} 中没有大小为 3 的通道维")
+    elif layout not in LAYOUTS:
+        raise TensorError(f"layout 必须是 {' / '.join(LAYOUTS)}")
+
+    expected = (size, size, 3) if layout == "hwc" else (3, size, size)
+    if tuple(single_shape) != expected:
+        raise TensorError(f"{layout.upper()} 输入的单张形状必须是 {expected}，收到 {tuple(single_shape)}")
+
+    if not stacked:
+        array = array[None]
+    if array.shape[0] == 0:
+        raise TensorError("堆叠输入中没有图像")
+    if max_images is not None and array.shape[0] > max_images:
+        raise TensorError(f"一次最多输入{max_images}张图像")
+    if layout == "chw":
+        # 转置只是改变视图的步长，normalize_into 会再转回 CHW，整个过程没有复制
+        array = array.transpose(0, 2, 3, 1)
+    return list(array), stacked
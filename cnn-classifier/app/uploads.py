@@ -0,0 +1,180 @@
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+from multipart.multipart import MultipartParseError, MultipartParser, parse_options_header
+
+from app import metrics
+
+# 上传处理：
+#   1. UploadLimitMiddleware 按路径限制整个请求体：Content-Length 超限时不读取请求体直接返回 413，
+#      没有 Content-Length（分块传输）时边接收边计数，超限立即中止
+#   2. read_image_upload 边接收边解析 multipart，只保留图片字段的数据块，
+#      结束时拼接一次得到 bytes（解码器用 io.BytesIO(bytes) 直接引用，不再复制），
+#      不经过 UploadFile 的临时文件（大于 1MB 时会写入磁盘再读回）
+
+# multipart 边界、字段头等额外开销的余量
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+
+class UploadError(ValueError):
+    """上传内容不合法（返回 400）"""
+
+
+class UploadTooLargeError(UploadError):
+    """上传内容超过大小限制（返回 413）"""
+
+
+def format_size(num_bytes):
+    return f"{num_bytes / 1024 / 1024:g}MB"
+
+
+class UploadLimitMiddleware:
+    """ASGI 中间件：按路径限制请求体大小
+
+    limits 为 {路径: 上传内容的最大字节数}，请求体允许再多出 overhead 字节（multipart 的边界和字段头）。
+    """
+
+    def __init__(self, app, limits, overhead=MULTIPART_OVERHEAD_BYTES):
+        self.app = app
+        self.limits = dict(limits)
+        self.overhead = overhead
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get(scope["path"]) if scope["type"] == "http" else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+        detail = f"上传内容不能超过{format_size(limit)}"
+        limit += self.overhead
+
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > limit:
+            # 不读取请求体，直接拒绝
+            metrics.REJECTIONS.inc("too_large")
+            response = JSONResponse({"detail": detail}, status_code=413)
+            await response(scope, receive, send)
+            return
+
+        received = [0]
+
+        async def limited_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                received[0] += len(message.get("body", b""))
+                if received[0] > limit:
+                    metrics.REJECTIONS.inc("too_large")
+                    # 由路由中的异常处理转换成 413 响应
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+async def read_image_upload(request, max_bytes, field_name="file"):
+    """从请求中流式读取一张图片，返回 (bytes, 文件名, content_type)
+
+    支持两种上传方式：
+    - multipart/form-data，图片在 field_name 字段中（网页和 curl -F 的方式）
+    - 请求体直接是图片，Content-Type 为 image/*（curl --data-binary 的方式）
+    图片超过 max_bytes 时在接收过程中立即抛出 UploadTooLargeError。
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    content_type = content_type.decode("latin-1").lower()
+
+    if content_type.startswith("image/"):
+        chunks = []
+        size = 0
+        async for chunk in request.stream():
+            size += len(chunk)
+            if size > max_bytes:
+                raise UploadTooLargeError(f"图片大小不能超过{format_size(max_bytes)}")
+            chunks.append(chunk)
+        if not size:
+            raise UploadError("请求体为空")
+        return b"".join(chunks), None, content_type
+
+    if content_type != "multipart/form-data":
+        raise UploadError("请上传图像文件（multipart/form-data 或 image/* 请求体）")
+    if b"boundary" not in params:
+        raise UploadError("multipart 请求缺少 boundary")
+
+    part = _ImagePart(field_name, max_bytes)
+    parser = MultipartParser(params[b"boundary"], part.callbacks())
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+        parser.finalize()
+    except MultipartParseError as e:
+        raise UploadError(f"multipart 请求格式错误: {e}")
+
+    if not part.found:
+        raise UploadError(f"缺少文件字段 {field_name}")
+    return b"".join(part.chunks), part.filename, part.content_type
+
+
+class _ImagePart:
+    """multipart 解析回调：只收集 field_name 字段的数据，其他字段直接丢弃"""
+
+    def __init__(self, field_name, max_bytes):
+        self.field_name = field_name.encode()
+        self.max_bytes = max_bytes
+        self.chunks = []
+        self.size = 0
+        self.found = False
+        self.filename = None
+        self.content_type = ""
+        self._capturing = False
+        self._headers = {}
+        self._header_name = b""
+        self._header_value = b""
+
+    def callbacks(self):
+        return {
+            "on_part_begin": self.on_part_begin,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+            "on_part_data": self.on_part_data,
+        }
+
+    def on_part_begin(self):
+        self._headers = {}
+        self._capturing = False
+
+    def on_header_field(self, data, start, end):
+        self._header_name += data[start:end]
+
+    def on_header_value(self, data, start, end):
+        self._header_value += data[start:end]
+
+    def on_header_end(self):
+        self._headers[self._header_name.lower()] = self._header_value
+        self._header_name = b""
+        self._header_value = b""
+
+    def on_headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        if options.get(b"name") != self.field_name or self.found:
+            return
+        content_type = self._headers.get(b"content-type", b"").decode("latin-1").lower()
+        # 在接收图片数据之前就检查类型
+        if not content_type.startswith("image/"):
+            raise UploadError("请上传图像文件")
+        self.found = True
+        self._capturing = True
+        self.content_type = content_type
+        if b"filename" in options:
+            self.filename = options[b"filename"].decode("utf-8", "replace")
+
+    def on_part_data(self, data, start, end):
+        if not self._capturing:
+            return
+        self.size += end - start
+        if self.size > self.max_bytes:
+            raise UploadTooLargeError(f"图片大小不能超过{format_size(self.max_bytes)}")
+        if isinstance(data, bytes):
+            # memoryview 不复制数据块，最后 join 时只复制一次
+            self.chunks.append(memoryview(data)[start:end])
+        else:
+            # 解析器跨数据块匹配边界时传入的是会被复用的缓冲区，必须复制
+            self.chunks.append(bytes(data[start:end]))
@@ -0,0 +1,443 @@
+import fcntl
+import json
+import os
+import threading
+import uuid
+
+import numpy as np
+
+# 磁盘上的向量索引（/index/add、/index/query），目录结构：
+#   meta.json        维度、条数、模型版本、粗量化器状态（写入时整体替换，count 以这里为准）
+#   vectors.f32      float32 原始行，容量按倍数增长，通过 np.memmap 映射，不读入内存
+#   items.jsonl      每行一个 {"id", "metadata"}，与向量行一一对应（只追加），搜索时只读取命中的行
+#   items.offsets    int64 定长表，第 i 个值是第 i 行在 items.jsonl 中的起始位置（共 count+1 个，最后一个是结尾），
+#                    打开索引时不解析 items.jsonl，百万级索引也只占几 MB 的页缓存
+#   centroids.npy    粗量化器（IVF）的聚类中心
+#   ivf_order.i32    训练时已有的向量按所属聚类排序后的行号，ivf_offsets.npy 是每个聚类的起止位置
+# 向量写入前做 L2 归一化，相似度就是点积（余弦相似度）。
+# 没有粗量化器时分块做精确的矩阵-向量乘；有粗量化器时只计算最近 nprobe 个聚类中的向量，
+# 训练之后新加入的向量（tail）总是精确计算，tail 超过已训练部分的一半时在后台线程中自动重新训练。
+# 训练在已有向量的快照上进行，不持有写锁（写入和搜索照常进行），完成后原子地替换 meta.json 中的粗量化器。
+# 多个工作进程打开同一个目录时，写入用文件锁串行，训练用另一个文件锁保证同一时刻只有一个进程在训练，
+# 其他进程在 meta.json 变化时重新映射。
+
+ROW_ALIGN = 1024
+# 精确搜索时每次参与矩阵乘的行数，限制临时内存
+SEARCH_CHUNK_ROWS = 65536
+# 每个聚类至少需要的训练样本数，向量数不足时不训练粗量化器
+MIN_POINTS_PER_LIST = 32
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLE_PER_LIST = 256
+
+
+class VectorIndexError(ValueError):
+    """索引参数或内容不合法（返回 400 / 409）"""
+
+
+def normalize(vectors):
+    """按行 L2 归一化（float32）"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class VectorIndex:
+    """追加写入、内存映射的向量索引"""
+
+    def __init__(self, directory, dim, model_version="", nlist=0, nprobe=8):
+        self.directory = directory
+        self.dim = int(dim)
+        self.model_version = model_version
+        self.nlist = max(0, int(nlist))
+        self.nprobe = max(1, int(nprobe))
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.RLock()
+        self._meta_path = os.path.join(directory, "meta.json")
+        self._vectors_path = os.path.join(directory, "vectors.f32")
+        self._items_path = os.path.join(directory, "items.jsonl")
+        self._offsets_path = os.path.join(directory, "items.offsets")
+        self._lock_path = os.path.join(directory, ".lock")
+        self._train_lock_path = os.path.join(directory, ".train.lock")
+
+        self._meta_mtime = None
+        self._vectors = None
+        self._capacity = 0
+        self._ivf = None
+        # 后台训练线程（同一时刻最多一个）；训练锁在进程内和进程间都互斥
+        self._training = None
+        self._train_mutex = threading.Lock()
+
+        with self._write_lock():
+            if not os.path.exists(self._meta_path):
+                self._write_meta({"dim": self.dim, "count": 0, "capacity": 0,
+                                  "model": model_version, "ivf": None})
+            self._refresh(force=True)
+            self._ensure_offsets()
+        meta = self._meta
+        if meta["dim"] != self.dim or (model_version and meta.get("model") and meta["model"] != model_version):
+            raise VectorIndexError(
+                f"索引目录 {directory} 由 {meta.get('model')}（{meta['dim']} 维）生成，"
+                f"与当前模型 {model_version}（{self.dim} 维）不一致，请更换 EMBEDDING_INDEX_DIR 或删除旧索引")
+
+    # ==== 持久化 ====
+
+    def _write_lock(self):
+        return _FileLock(self._lock_path, self._lock)
+
+    def _write_meta(self, meta):
+        tmp_path = self._meta_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._meta_path)
+
+    def _refresh(self, force=False):
+        """meta.json 变化时（本进程或其他进程写入）重新映射向量文件、加载新的粗量化器"""
+        try:
+            mtime = os.stat(self._meta_path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if not force and mtime == self._meta_mtime:
+            return
+        with self._lock:
+            with open(self._meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta["capacity"] != self._capacity:
+                self._capacity = meta["capacity"]
+                self._vectors = (np.memmap(self._vectors_path, dtype=np.float32, mode="r",
+                                           shape=(self._capacity, meta["dim"]))
+                                 if self._capacity else None)
+            ivf = meta.get("ivf")
+            if ivf is None:
+                self._ivf = None
+            elif self._ivf is None or self._ivf["version"] != ivf["version"]:
+                self._ivf = self._load_ivf(ivf)
+            self._meta = meta
+            self._meta_mtime = mtime
+
+    def _ensure_offsets(self):
+        """旧版本的索引没有 items.offsets：逐行扫描 items.jsonl 生成一次（只保存偏移量，不保存内容）"""
+        count = self._meta["count"]
+        if os.path.exists(self._offsets_path) and os.path.getsize(self._offsets_path) >= (count + 1) * 8:
+            return
+        offsets = np.zeros(count + 1, dtype=np.int64)
+        if count and os.path.exists(self._items_path):
+            with open(self._items_path, "rb") as f:
+                for row in range(count):
+                    line = f.readline()
+                    offsets[row + 1] = offsets[row] + len(line)
+        offsets.tofile(self._offsets_path)
+
+    def _offsets(self, start, end):
+        """items.offsets 中 [start, end) 的值"""
+        with open(self._offsets_path, "rb") as f:
+            f.seek(start * 8)
+            return np.frombuffer(f.read((end - start) * 8), dtype=np.int64)
+
+    def _read_items(self, rows):
+        """读取指定行的 {"id", "metadata"}（只读这些行，按行号顺序读文件）"""
+        items = {}
+        with open(self._offsets_path, "rb") as offsets, open(self._items_path, "rb") as f:
+            for row in sorted(set(int(r) for r in rows)):
+                offsets.seek(row * 8)
+                start, end = np.frombuffer(offsets.read(16), dtype=np.int64)
+                f.seek(int(start))
+                items[row] = json.loads(f.read(int(end - start)))
+        return items
+
+    def _load_ivf(self, ivf):
+        suffix = ivf["version"]
+        return {
+            "version": suffix,
+            "trained_count": ivf["trained_count"],
+            "centroids": np.load(os.path.join(self.directory, f"centroids.{suffix}.npy")),
+            "offsets": np.load(os.path.join(self.directory, f"ivf_offsets.{suffix}.npy")),
+            "order": np.memmap(os.path.join(self.directory, f"ivf_order.{suffix}.i32"), dtype=np.int32, mode="r",
+                               shape=(ivf["trained_count"],)),
+        }
+
+    def _ensure_capacity(self, needed):
+        if needed <= self._capacity:
+            return
+        capacity = max(ROW_ALIGN, self._capacity)
+        while capacity < needed:
+            capacity *= 2
+        # 只扩展文件，已有的映射（包括其他线程正在搜索的）仍然有效
+        with open(self._vectors_path, "ab") as f:
+            f.truncate(capacity * self.dim * 4)
+        self._capacity = capacity
+        self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode="r",
+                                  shape=(capacity, self.dim))
+
+    # ==== 写入 ====
+
+    def add(self, vectors, ids, metadata=None):
+        """追加一组向量（[n, dim]），返回它们的行号"""
+        vectors = normalize(np.atleast_2d(vectors))
+        if vectors.shape[1] != self.dim:
+            raise VectorIndexError(f"向量维度应为 {self.dim}，收到 {vectors.shape[1]}")
+        if len(ids) != len(vectors):
+            raise VectorIndexError("ids 与向量数量不一致")
+        metadata = metadata or [None] * len(ids)
+
+        with self._write_lock():
+            self._refresh()
+            start = self._meta["count"]
+            end = start + len(vectors)
+            self._ensure_capacity(end)
+            writable = np.memmap(self._vectors_path, dtype=np.float32, mode="r+",
+                                 shape=(len(vectors), self.dim), offset=start * self.dim * 4)
+            writable[:] = vectors
+            writable.flush()
+            del writable
+
+            # 上次中断时可能留下未计入 count 的行，先截掉再追加
+            offsets = [int(self._offsets(start, start + 1)[0])]
+            with open(self._items_path, "ab") as f:
+                f.truncate(offsets[0])
+                for item_id, meta in zip(ids, metadata):
+                    line = json.dumps({"id": item_id, "metadata": meta}, ensure_ascii=False).encode("utf-8") + b"\n"
+                    f.write(line)
+                    offsets.append(offsets[-1] + len(line))
+                f.flush()
+                os.fsync(f.fileno())
+            with open(self._offsets_path, "r+b") as f:
+                f.truncate((start + 1) * 8)
+                f.seek((start + 1) * 8)
+                f.write(np.asarray(offsets[1:], dtype=np.int64).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+
+            self._write_meta(dict(self._meta, count=end, capacity=self._capacity))
+            self._refresh(force=True)
+            needs_training = self._needs_training(end)
+        if needs_training:
+            self._train_in_background()
+        return list(range(start, end))
+
+    def _needs_training(self, count):
+        if not self.nlist or count < self.nlist * MIN_POINTS_PER_LIST:
+            return False
+        ivf = self._meta.get("ivf")
+        return ivf is None or ivf["nlist"] != self.nlist or count - ivf["trained_count"] > ivf["trained_count"] // 2
+
+    def train(self, nlist=None):
+        """（重新）训练粗量化器（阻塞，直到训练完成）；nlist=0 时删除粗量化器，恢复精确搜索"""
+        nlist = self.nlist if nlist is None else max(0, int(nlist))
+        count = self.count
+        if nlist and count < nlist * MIN_POINTS_PER_LIST:
+            raise VectorIndexError(f"训练 {nlist} 个聚类至少需要 {nlist * MIN_POINTS_PER_LIST} 个向量，"
+                                   f"当前只有 {count} 个")
+        self.nlist = nlist
+        with _FileLock(self._train_lock_path, self._train_mutex):
+            if nlist:
+                self._train(nlist)
+            else:
+                with self._write_lock():
+                    self._refresh()
+                    self._write_meta(dict(self._meta, ivf=None))
+                    self._refresh(force=True)
+                    self._remove_old_ivf(keep=None)
+        return self.stats()
+
+    def _train_in_background(self):
+        with self._lock:
+            if self._training is not None and self._training.is_alive():
+                return
+            self._training = threading.Thread(target=self._background_training, name="index-training", daemon=True)
+            self._training.start()
+
+    def _background_training(self):
+        # 其他进程正在训练时跳过，它完成后 meta.json 会更新
+        train_lock = _FileLock(self._train_lock_path, self._train_mutex, blocking=False)
+        if not train_lock.acquire():
+            return
+        try:
+            self._refresh()
+            if self._needs_training(self._meta["count"]):
+                self._train(self.nlist)
+        except Exception as e:
+            print(f"✗ 向量索引粗量化器训练失败: {e}")
+        finally:
+            train_lock.release()
+
+    def _train(self, nlist):
+        """在当前向量的快照上训练（不持有写锁），完成后替换 meta.json 中的粗量化器（持有训练锁时调用）"""
+        self._refresh()
+        with self._lock:
+            vectors, count = self._vectors, self._meta["count"]
+        ivf = self._fit(vectors, count, nlist)
+        with self._write_lock():
+            self._refresh()
+            # 训练期间加入的向量成为 tail，精确计算，下次重新训练时再分配聚类
+            self._write_meta(dict(self._meta, ivf=ivf))
+            self._refresh(force=True)
+            self._remove_old_ivf(keep=ivf["version"])
+        print(f"✓ 向量索引粗量化器训练完成（{count} 个向量，{nlist} 个聚类）")
+
+    def _fit(self, vectors, count, nlist):
+        """球面 k-means：在采样上迭代，最后把 [0, count) 行分配到最近的聚类并按聚类排序，写入新版本的文件"""
+        vectors = vectors[:count]
+        rng = np.random.default_rng(0)
+        sample_size = min(count, nlist * KMEANS_SAMPLE_PER_LIST)
+        sample = np.asarray(vectors[np.sort(rng.choice(count, sample_size, replace=False))])
+        centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+        for _ in range(KMEANS_ITERATIONS):
+            assign = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, sample)
+            empty = np.bincount(assign, minlength=nlist) == 0
+            # 空聚类保留原来的中心
+            sums[empty] = centroids[empty]
+            centroids = normalize(sums)
+
+        assign = np.empty(count, dtype=np.int32)
+        for start in range(0, count, SEARCH_CHUNK_ROWS):
+            chunk = vectors[start:start + SEARCH_CHUNK_ROWS]
+            assign[start:start + len(chunk)] = np.argmax(chunk @ centroids.T, axis=1)
+        order = np.argsort(assign, kind="stable").astype(np.int32)
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=nlist))]).astype(np.int64)
+
+        # 每次训练的文件名都不同，正在使用旧版本的搜索不受影响
+        version = f"{count}-{nlist}-{uuid.uuid4().hex[:8]}"
+        np.save(os.path.join(self.directory, f"centroids.{version}.npy"), centroids)
+        np.save(os.path.join(self.directory, f"ivf_offsets.{version}.npy"), offsets)
+        order.tofile(os.path.join(self.directory, f"ivf_order.{version}.i32"))
+        return {"version": version, "nlist": nlist, "trained_count": count}
+
+    def _remove_old_ivf(self, keep):
+        # 已被其他进程映射的旧文件在 unlink 后仍可读，直到它们重新映射
+        for name in os.listdir(self.directory):
+            if name.startswith(("centroids.", "ivf_offsets.", "ivf_order.")) and (keep is None or f".{keep}." not in name):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+
+    # ==== 查询 ====
+
+    def search(self, vector, k=10, nprobe=None):
+        """返回最相似的 k 个 [{"id", "index", "score", "metadata"}]，score 是余弦相似度"""
+        query = normalize(vector).reshape(-1)
+        if query.shape[0] != self.dim:
+            raise VectorIndexError(f"向量维度应为 {self.dim}，收到 {query.shape[0]}")
+        self._refresh()
+        with self._lock:
+            vectors, count, ivf = self._vectors, self._meta["count"], self._ivf
+        if count == 0:
+            return []
+        k = min(int(k), count)
+
+        if ivf is None:
+            rows, scores = _top_k_chunked(vectors, 0, count, query, k)
+        else:
+            rows, scores = self._search_ivf(vectors, count, ivf, query, k, nprobe or self.nprobe)
+        items = self._read_items(rows)
+        return [{"id": items[row]["id"], "index": int(row), "score": round(float(score), 6),
+                 "metadata": items[row]["metadata"]}
+                for row, score in zip(rows, scores)]
+
+    def _search_ivf(self, vectors, count, ivf, query, k, nprobe):
+        centroids, offsets, order = ivf["centroids"], ivf["offsets"], ivf["order"]
+        nprobe = min(nprobe, len(centroids))
+        probe = np.argpartition(-(centroids @ query), nprobe - 1)[:nprobe]
+        candidates = np.concatenate([order[offsets[c]:offsets[c + 1]] for c in probe])
+        candidates.sort()
+        rows, scores = [], []
+        if len(candidates):
+            candidate_scores = np.asarray(vectors[candidates]) @ query
+            best = _top_k(candidate_scores, k)
+            rows.append(candidates[best])
+            scores.append(candidate_scores[best])
+        # 训练之后加入的向量还没有分配聚类，精确计算
+        if count > ivf["trained_count"]:
+            tail_rows, tail_scores = _top_k_chunked(vectors, ivf["trained_count"], count, query, k)
+            rows.append(tail_rows)
+            scores.append(tail_scores)
+        rows, scores = np.concatenate(rows), np.concatenate(scores)
+        best = _top_k(scores, k)
+        return rows[best], scores[best]
+
+    @property
+    def count(self):
+        self._refresh()
+        return self._meta["count"]
+
+    def stats(self):
+        self._refresh()
+        meta = self._meta
+        ivf = meta.get("ivf")
+        return {
+            "directory": self.directory,
+            "dim": meta["dim"],
+            "count": meta["count"],
+            "capacity": meta["capacity"],
+            "model": meta.get("model"),
+            "file_mb": round(meta["capacity"] * meta["dim"] * 4 / 1024 / 1024, 2),
+            "search": "ivf" if ivf else "exact",
+            "nlist": ivf["nlist"] if ivf else 0,
+            "nprobe": self.nprobe,
+            "trained_count": ivf["trained_count"] if ivf else 0,
+            "training": self._training is not None and self._training.is_alive(),
+        }
+
+
+def _top_k(scores, k):
+    """分数最高的 k 个位置（按分数从高到低）"""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top], kind="stable")]
+
+
+def _top_k_chunked(vectors, start, end, query, k):
+    """分块精确搜索 [start, end) 行，每块只保留 top-k"""
+    rows, scores = [], []
+    for chunk_start in range(start, end, SEARCH_CHUNK_ROWS):
+        chunk_end = min(end, chunk_start + SEARCH_CHUNK_ROWS)
+        chunk_scores = vectors[chunk_start:chunk_end] @ query
+        best = _top_k(chunk_scores, k)
+        rows.append(best + chunk_start)
+        scores.append(chunk_scores[best])
+    rows, scores = np.concatenate(rows), np.concatenate(scores)
+    best = _top_k(scores, k)
+    return rows[best], scores[best]
+
+
+class _FileLock:
+    """进程内的 RLock + 跨进程的 flock（多个工作进程共用同一个索引目录）"""
+
+    def __init__(self, path, lock, blocking=True):
+        self.path = path
+        self.lock = lock
+        self.blocking = blocking
+        self._file = None
+
+    def acquire(self):
+        """取得锁；blocking=False 时已被占用则返回 False"""
+        if not self.lock.acquire(self.blocking):
+            return False
+        self._file = open(self.path, "a")
+        try:
+            fcntl.flock(self._file, fcntl.LOCK_EX if self.blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self._file.close()
+            self.lock.release()
+            return False
+        return True
+
+    def release(self):
+        fcntl.flock(self._file, fcntl.LOCK_UN)
+        self._file.close()
+        self.lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+        return False
@@ -0,0 +1,451 @@
+import itertools
+import socket
+import subprocess
+import sys
+import threading
+import time
+from multiprocessing import shared_memory
+from multiprocessing.connection import Connection
+
+import numpy as np
+import torch
+
+from app import config, metrics
+from app.batcher import MicroBatcher
+from app.model_handler import NUM_CLASSES
+from app.preprocess import normalize_into
+
+# 独立推理进程：服务进程（HTTP、解码、组批、整理结果）和若干个推理进程（只做前向推理）分开，
+# 推理不再和请求处理争抢 GIL。批次的输入张量和输出概率放在共享内存中，
+# 控制消息只有 (序号, 缓冲区编号, 图片数, 是否剖析) 这样的几个值，张量本身不经过 pickle。
+
+RESTARTS = metrics.Counter("cnn_inference_process_restarts_total",
+                           "Inference worker processes restarted after exiting or hanging", ("model",))
+RETRIES = metrics.Counter("cnn_inference_batch_retries_total",
+                          "Batches retried on another inference worker after theirs exited", ("model",))
+
+class TensorRing:
+    """共享内存中的批次缓冲区环：segments 个缓冲区，每个可放 batch_size 张图
+
+    inputs:  [segments, batch_size, 3, crop, crop] float32（归一化后的输入，推理进程直接在上面前向推理，不复制）
+    outputs: [segments, batch_size, num_classes] float32（softmax 概率）
+    每个推理进程轮流使用自己的 depth 个缓冲区，同一个缓冲区同一时刻只属于一个批次。
+    """
+
+    def __init__(self, segments, batch_size, crop, num_classes, name=None):
+        self.segments = segments
+        self.batch_size = batch_size
+        self.crop = crop
+        self.num_classes = num_classes
+        input_shape = (segments, batch_size, 3, crop, crop)
+        output_shape = (segments, batch_size, num_classes)
+        input_bytes = int(np.prod(input_shape)) * 4
+        self.nbytes = input_bytes + int(np.prod(output_shape)) * 4
+        self.owner = name is None
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=self.nbytes)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            # 只是挂载，不归本进程管理：避免本进程退出时 resource_tracker 删除共享内存
+            try:
+                from multiprocessing import resource_tracker
+                resource_tracker.unregister(self.shm._name, "shared_memory")
+            except Exception:
+                pass
+        self.inputs = np.ndarray(input_shape, dtype=np.float32, buffer=self.shm.buf)
+        self.outputs = np.ndarray(output_shape, dtype=np.float32, buffer=self.shm.buf, offset=input_bytes)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def close(self):
+        self.inputs = self.outputs = None
+        try:
+            self.shm.close()
+        except BufferError:
+            # 还有张量引用着共享内存（例如尚未释放的结果），交给进程退出时回收
+            pass
+        if self.owner:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
+
+
+class WorkerLostError(RuntimeError):
+    """批次已经发给推理进程，但进程退出或卡死，没有返回结果（可以换一个推理进程重试）"""
+
+
+class _StartupFailed(Exception):
+    """推理进程报告模型加载失败（消息中已带原始异常类型）"""
+
+
+class _Waiter:
+    def __init__(self):
+        self.event = threading.Event()
+        self.error = None
+        # 推理进程退出导致的失败（而不是推理本身出错）
+        self.lost = False
+        self.seconds = 0.0
+        # 剖析的批次：(推理进程中开始时的 perf_counter 时间, 导出的 Chrome trace 事件)
+        self.profile = None
+
+
+class _Worker:
+    """一个推理进程及其控制连接；由 WorkerPoolBatcher._supervise 线程启动、监控和重启"""
+
+    def __init__(self, index, segments):
+        self.index = index
+        # 本进程使用的缓冲区编号
+        self.segments = segments
+        self.proc = None
+        self.conn = None
+        self.ready = threading.Event()
+        self._send_lock = threading.Lock()
+        self._seq = itertools.count()
+        self._waiters = {}
+        self.restarts = 0
+        self.batches = 0
+        self.last_exit = None
+        self.started_at = None
+        self.warmup_ms = None
+        # 最近一次启动失败（还没有就绪就退出）的原因，就绪后清空
+        self.startup_error = None
+        # 推理进程中模型权重占用的内存（就绪时由推理进程报告）
+        self.memory_bytes = 0
+
+    def submit(self, segment, count, profile=False):
+        """通知推理进程计算 segment 缓冲区中的前 count 张图，返回 _Waiter
+
+        profile 为 True 时推理进程在 torch.profiler 下执行，导出的事件放在 waiter.profile 中。
+        """
+        waiter = _Waiter()
+        with self._send_lock:
+            if not self.ready.is_set() or self.conn is None:
+                raise WorkerLostError(f"推理进程 #{self.index} 不可用")
+            seq = next(self._seq)
+            self._waiters[seq] = waiter
+            try:
+                self.conn.send((seq, segment, count, profile))
+            except OSError as e:
+                self._waiters.pop(seq, None)
+                raise WorkerLostError(f"推理进程 #{self.index} 不可用: {e}")
+        return waiter
+
+    def shutdown(self):
+        """通知推理进程退出（它会先算完已经收到的批次）"""
+        with self._send_lock:
+            self.ready.clear()
+            try:
+                if self.conn is not None:
+                    self.conn.send(None)
+            except OSError:
+                pass
+
+    def resolve(self, seq, error, seconds, profile):
+        waiter = self._waiters.pop(seq, None)
+        if waiter is not None:
+            waiter.error = error
+            waiter.seconds = seconds
+            waiter.profile = profile
+            waiter.event.set()
+
+    def fail_all(self, error):
+        with self._send_lock:
+            waiters, self._waiters = self._waiters, {}
+        for waiter in waiters.values():
+            waiter.error = error
+            waiter.lost = True
+            waiter.event.set()
+
+    def kill(self):
+        proc = self.proc
+        if proc is not None and proc.poll() is None:
+            proc.kill()
+
+    def stats(self):
+        alive = self.proc is not None and self.proc.poll() is None
+        return {
+            "pid": self.proc.pid if self.proc is not None else None,
+            "alive": alive,
+            "ready": self.ready.is_set(),
+            "batches": self.batches,
+            "restarts": self.restarts,
+            "last_exit_code": self.last_exit,
+            "uptime_seconds": round(time.monotonic() - self.started_at, 1) if alive and self.started_at else None,
+            "warmup_ms": self.warmup_ms,
+            "model_mb": round(self.memory_bytes / 1024 / 1024, 1),
+            "startup_error": self.startup_error,
+        }
+
+
+class WorkerPoolBatcher(MicroBatcher):
+    """与 MicroBatcher 相同的接口（submit -> Future），前向推理在独立的推理进程中执行
+
+    - 组批、截止时间、优先级通道与 MicroBatcher 完全相同；每个推理进程有 depth 个分发线程，
+      各自取一个批次写入自己的共享内存缓冲区后通知推理进程，推理进程按顺序计算
+    - 结果整理（top-k、标签、大类得分）仍在服务进程中用 classifier.format_results 完成，/predict 返回格式不变；
+      服务进程中的分类器可以不加载权重（ImageClassifier(load_model=False)），后端名和模型版本以推理进程报告的为准
+    - 每个推理进程由一个监控线程负责启动、接收结果和重启：进程退出后 1 秒重启；
+      批次超过 timeout 秒没有返回时杀掉进程（随后重启）
+    - 已经发出的批次因推理进程退出或卡死没有返回时，换一个就绪的推理进程重试一次，仍失败才返回错误
+    - 被剖析的请求所在的批次由推理进程在 torch.profiler 下执行，算子事件随结果传回，合并到请求的 trace 中
+    """
+
+    def __init__(self, classifier, max_batch_size=8, max_wait_ms=5.0, processes=1, depth=2, threads=0,
+                 timeout=30.0, startup_timeout=600.0):
+        super().__init__(classifier, max_batch_size, max_wait_ms)
+        self.processes = max(1, int(processes))
+        self.depth = max(1, int(depth))
+        self.threads = threads if threads > 0 else max(1, config.CPU_PER_WORKER // self.processes)
+        self.timeout = timeout
+        self.startup_timeout = startup_timeout
+        self.ring = None
+        self._workers = []
+        self._threads = []
+        self._local = threading.local()
+        # 每个缓冲区一把锁：平时只有所属的分发线程使用，重试时其他分发线程借用
+        self._segment_locks = []
+
+    @property
+    def arch(self):
+        return self.classifier.arch
+
+    def start(self):
+        if self._threads:
+            return
+        self._stopping = False
+        self.ring = TensorRing(self.processes * self.depth, self.max_batch_size, self.classifier.crop_size,
+                               NUM_CLASSES)
+        self._workers = [_Worker(i, list(range(i * self.depth, (i + 1) * self.depth)))
+                         for i in range(self.processes)]
+        self._segment_locks = [threading.Lock() for _ in range(self.ring.segments)]
+        for worker in self._workers:
+            self._spawn_thread(self._supervise, worker, name=f"inference-supervisor-{worker.index}")
+            for segment in worker.segments:
+                self._spawn_thread(self._dispatch, worker, segment, name=f"inference-dispatch-{segment}")
+        print(f"✓ 独立推理进程启动中: {self.arch} x{self.processes} (每个 {self.threads} 线程，"
+              f"共享内存 {self.ring.nbytes / 1024 / 1024:.1f}MB，每个进程 {self.depth} 个批次缓冲区)")
+
+    def _spawn_thread(self, target, *args, name):
+        thread = threading.Thread(target=target, args=args, name=name, daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def wait_ready(self, timeout=None):
+        """等待全部推理进程加载完模型并预热完成；超时返回 False
+
+        timeout 为 None 时最多等待 startup_timeout 秒。推理进程还没有就绪就退出（例如模型文件缺失）时
+        不再等待重启，直接抛出 RuntimeError（带推理进程报告的原因）。
+        """
+        timeout = self.startup_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        for worker in self._workers:
+            while not worker.ready.wait(min(0.2, max(0.0, deadline - time.monotonic()))):
+                if worker.startup_error is not None:
+                    raise RuntimeError(f"推理进程 #{worker.index} 启动失败: {worker.startup_error}")
+                if time.monotonic() >= deadline:
+                    return False
+        return True
+
+    def stop(self, timeout=5.0):
+        if not self._threads:
+            return
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        deadline = time.monotonic() + timeout
+        # 先让分发线程处理完队列中的请求，再关闭推理进程
+        for thread in self._threads:
+            if thread.name.startswith("inference-dispatch"):
+                thread.join(max(0.0, deadline - time.monotonic()))
+        for worker in self._workers:
+            worker.shutdown()
+        for worker in self._workers:
+            if worker.proc is not None:
+                try:
+                    worker.proc.wait(max(0.1, deadline - time.monotonic()))
+                except subprocess.TimeoutExpired:
+                    worker.kill()
+        for thread in self._threads:
+            thread.join(max(0.1, deadline - time.monotonic()))
+        self._threads = []
+        self.ring.close()
+
+    # ---- 推理进程的启动与监控 ----
+
+    def _launch(self, worker):
+        parent_sock, child_sock = socket.socketpair()
+        args = [sys.executable, "-m", "app.inference_worker",
+                "--fd", str(child_sock.fileno()),
+                "--index", str(worker.index),
+                "--arch", self.arch,
+                "--shm", self.ring.name,
+                "--segments", str(self.ring.segments),
+                "--batch-size", str(self.max_batch_size),
+                "--crop", str(self.ring.crop),
+                "--classes", str(self.ring.num_classes),
+                "--threads", str(self.threads)]
+        try:
+            worker.proc = subprocess.Popen(args, cwd=config.PROJECT_DIR, pass_fds=(child_sock.fileno(),))
+        finally:
+            child_sock.close()
+        worker.conn = Connection(parent_sock.detach())
+        worker.started_at = time.monotonic()
+
+    def _supervise(self, worker):
+        backoff = 1.0
+        while not self._stopping:
+            try:
+                self._launch(worker)
+                if not worker.conn.poll(self.startup_timeout):
+                    raise TimeoutError(f"{self.startup_timeout:g} 秒内没有就绪")
+                message = worker.conn.recv()
+                if isinstance(message, tuple) and message[0] == "failed":
+                    raise _StartupFailed(message[2])
+                if not (isinstance(message, tuple) and message[0] == "ready"):
+                    raise RuntimeError(f"意外的消息 {message!r}")
+                worker.warmup_ms = message[2]
+                info = message[3]
+                worker.memory_bytes = info["memory_bytes"]
+                worker.startup_error = None
+                # 结果中的 backend 字段和缓存键使用推理进程实际的后端和模型版本
+                self.classifier.set_remote_backend(info["backend"], info["backend_description"],
+                                                   info["model_version"])
+                worker.ready.set()
+                print(f"✓ 推理进程 #{worker.index} 就绪 (pid={worker.proc.pid}, 模型 {self.arch})")
+                backoff = 1.0
+                while True:
+                    seq, error, seconds, profile = worker.conn.recv()
+                    worker.batches += 1
+                    worker.resolve(seq, error, seconds, profile)
+            except EOFError:
+                reason = "连接断开"
+            except _StartupFailed as e:
+                reason = str(e)
+            except Exception as e:
+                # 任何异常都不能结束监控线程，否则这个推理进程再也不会重启
+                reason = f"{type(e).__name__}: {e}"
+            if not worker.ready.is_set():
+                # 还没有就绪就失败：记录原因，wait_ready 据此报错而不是一直等待重启
+                worker.startup_error = reason
+            worker.ready.clear()
+            worker.kill()
+            pid = worker.proc.pid if worker.proc is not None else None
+            worker.last_exit = worker.proc.wait() if worker.proc is not None else None
+            if worker.conn is not None:
+                worker.conn.close()
+                worker.conn = None
+            worker.fail_all(f"推理进程 #{worker.index} 异常退出（状态码 {worker.last_exit}）")
+            if self._stopping:
+                break
+            worker.restarts += 1
+            RESTARTS.inc(self.arch)
+            print(f"✗ 推理进程 #{worker.index} (pid={pid}) 退出，状态码 {worker.last_exit}"
+                  f"（{reason}），{backoff:g} 秒后重启")
+            time.sleep(backoff)
+            # 连续启动失败（例如模型文件缺失）时逐渐拉长间隔
+            backoff = min(30.0, backoff * 2)
+
+    # ---- 分发 ----
+
+    def _dispatch(self, worker, segment):
+        self._local.slot = (worker, segment)
+        while True:
+            # 推理进程重启期间不取批次，交给其他进程
+            if not worker.ready.wait(0.5):
+                if self._stopping:
+                    break
+                continue
+            batch = self._next_batch()
+            if batch is None:
+                break
+            self._run_batch(batch)
+
+    def _profile(self, run, traces, batch_size):
+        # 服务进程中只有组批和结果整理，前向推理在推理进程中剖析（见 _run_on）
+        self._local.traces = traces
+        try:
+            return run()
+        finally:
+            self._local.traces = None
+
+    def _predict(self, images, top_ks):
+        worker, segment = self._local.slot
+        try:
+            with self._segment_locks[segment]:
+                return self._run_on(worker, segment, images, top_ks)
+        except WorkerLostError as e:
+            # 推理进程在计算这个批次时退出或卡死：换一个就绪的推理进程重试一次
+            slot = self._borrow_segment(exclude=worker)
+            if slot is None:
+                raise
+            other, other_segment = slot
+            RETRIES.inc(self.arch)
+            print(f"⚠ {e}，批次 ({len(images)} 张) 改由推理进程 #{other.index} 重试")
+            try:
+                return self._run_on(other, other_segment, images, top_ks)
+            finally:
+                self._segment_locks[other_segment].release()
+
+    def _borrow_segment(self, exclude):
+        """找一个就绪的其他推理进程并占用它的一个缓冲区，返回 (worker, segment)，没有可用的返回 None"""
+        candidates = [w for w in self._workers if w is not exclude and w.ready.is_set()]
+        # 先试空闲的缓冲区，都在使用时等待排队最短的那个进程的第一个缓冲区
+        for worker in candidates:
+            for segment in worker.segments:
+                if self._segment_locks[segment].acquire(blocking=False):
+                    return worker, segment
+        for worker in sorted(candidates, key=lambda w: len(w._waiters)):
+            segment = worker.segments[0]
+            if self._segment_locks[segment].acquire(timeout=self.timeout):
+                if worker.ready.is_set():
+                    return worker, segment
+                self._segment_locks[segment].release()
+        return None
+
+    def _run_on(self, worker, segment, images, top_ks):
+        # 调用方持有 segment 的锁
+        started = time.perf_counter()
+        inputs = self.ring.inputs[segment]
+        for i, image in enumerate(images):
+            if isinstance(image, np.ndarray):
+                normalize_into(image, inputs[i])
+            else:
+                inputs[i] = image.numpy()
+        metrics.STAGE_SECONDS.observe(time.perf_counter() - started, "batch_assemble")
+        traces = getattr(self._local, "traces", None)
+        waiter = worker.submit(segment, len(images), profile=bool(traces))
+        if not waiter.event.wait(self.timeout):
+            # 卡死：杀掉进程，监控线程负责重启
+            worker.kill()
+            raise WorkerLostError(f"推理进程 #{worker.index} 超过 {self.timeout:g} 秒没有返回，已重启")
+        if waiter.error:
+            raise (WorkerLostError if waiter.lost else RuntimeError)(waiter.error)
+        metrics.STAGE_SECONDS.observe(waiter.seconds, "forward")
+        if traces and waiter.profile is not None:
+            profile_started, events = waiter.profile
+            for trace in traces:
+                trace.add_capture(events, profile_started, len(images))
+        started = time.perf_counter()
+        probabilities = torch.from_numpy(self.ring.outputs[segment, :len(images)])
+        results = self.classifier.format_results(probabilities, top_ks)
+        metrics.STAGE_SECONDS.observe(time.perf_counter() - started, "postprocess")
+        return results
+
+    def memory_bytes(self):
+        """各推理进程中的模型权重（每个进程各一份）"""
+        return sum(worker.memory_bytes for worker in self._workers)
+
+    def stats(self):
+        stats = super().stats()
+        stats["processes"] = {
+            "count": self.processes,
+            "threads_per_process": self.threads,
+            "ring_depth": self.depth,
+            "ring_mb": round(self.ring.nbytes / 1024 / 1024, 1) if self.ring is not None else 0,
+            "timeout_seconds": self.timeout,
+            "workers": [worker.stats() for worker in self._workers],
+        }
+        return stats
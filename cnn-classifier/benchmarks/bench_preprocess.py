@@ -0,0 +1,150 @@
+"""预处理前后对比基准：torchvision 标准预处理 vs 快速预处理（JPEG 缩小解码 + NumPy 归一化）
+
+用法（在 cnn-classifier 目录下）:
+    python benchmarks/bench_preprocess.py
+    python benchmarks/bench_preprocess.py --images ~/photos --repeat 5 --json result.json
+
+默认使用合成的多百万像素图片；--images 指定目录时额外测试目录中的真实照片。
+同时检查两条路径的 top-1 是否一致、top-5 置信度差值是否在 app/preprocess.py 记录的容限内。
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+from PIL import Image, ImageDraw, ImageFilter
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.model_handler import ImageClassifier  # noqa: E402
+from app.preprocess import FAST_PATH_MAX_CONFIDENCE_DIFF, preprocess_fast  # noqa: E402
+
+# (名称, 宽, 高, 格式)
+SYNTHETIC_CASES = [
+    ("2MP jpeg", 1920, 1080, "JPEG"),
+    ("12MP jpeg", 4000, 3000, "JPEG"),
+    ("24MP jpeg", 6000, 4000, "JPEG"),
+    ("2MP png", 1920, 1080, "PNG"),
+]
+
+
+def synthetic_photo(width, height, fmt, seed=0):
+    """生成带渐变、色块和噪声的“类照片”图像，避免纯色图让解码器走捷径"""
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 1, width, dtype=np.float32)
+    y = np.linspace(0, 1, height, dtype=np.float32)[:, None]
+    base = np.stack([
+        200 * x + 30 * y,
+        120 + 80 * np.sin(6 * x + 3 * y),
+        180 * y + 40 * x,
+    ], axis=-1)
+    image = Image.fromarray(np.clip(base, 0, 255).astype(np.uint8))
+    draw = ImageDraw.Draw(image)
+    for _ in range(40):
+        x0, y0 = rng.integers(0, width), rng.integers(0, height)
+        r = int(rng.integers(min(width, height) // 40, min(width, height) // 6))
+        draw.ellipse((x0 - r, y0 - r, x0 + r, y0 + r), fill=tuple(int(c) for c in rng.integers(0, 255, 3)))
+    image = image.filter(ImageFilter.GaussianBlur(2))
+    noisy = np.asarray(image, dtype=np.int16) + rng.integers(-12, 12, (height, width, 3))
+    image = Image.fromarray(np.clip(noisy, 0, 255).astype(np.uint8))
+
+    buffer = io.BytesIO()
+    if fmt == "JPEG":
+        image.save(buffer, fmt, quality=90)
+    else:
+        image.save(buffer, fmt)
+    return buffer.getvalue()
+
+
+def time_it(fn, data, repeat):
+    fn(data)  # 预热
+    start = time.perf_counter()
+    for _ in range(repeat):
+        out = fn(data)
+    return (time.perf_counter() - start) / repeat * 1000, out
+
+
+def top5(classifier, image):
+    with torch.no_grad():
+        probs = torch.softmax(classifier.model(classifier.make_batch([image])), dim=1)[0] * 100
+    conf, idx = torch.topk(probs, 5)
+    return probs, idx.tolist()
+
+
+def compare(classifier, name, data, repeat):
+    std_ms, std_input = time_it(classifier.preprocess_standard, data, repeat)
+    # 不受 FAST_PREPROCESS 环境变量影响，始终直接对比两条路径
+    fast_ms, fast_input = time_it(preprocess_fast, data, repeat)
+
+    std_probs, std_top5 = top5(classifier, std_input)
+    fast_probs, fast_top5 = top5(classifier, fast_input)
+    max_diff = float((std_probs[std_top5] - fast_probs[std_top5]).abs().max())
+    input_diff = float((classifier.make_batch([std_input]) - classifier.make_batch([fast_input])).abs().mean())
+
+    with Image.open(io.BytesIO(data)) as image:
+        size = f"{image.width}x{image.height}"
+    return {
+        "case": name,
+        "size": size,
+        "bytes": len(data),
+        "standard_ms": round(std_ms, 2),
+        "fast_ms": round(fast_ms, 2),
+        "speedup": round(std_ms / fast_ms, 2) if fast_ms else None,
+        "top1_match": std_top5[0] == fast_top5[0],
+        "top5_overlap": len(set(std_top5) & set(fast_top5)),
+        "max_top5_confidence_diff": round(max_diff, 3),
+        "mean_abs_input_diff": round(input_diff, 5),
+        "within_tolerance": std_top5[0] == fast_top5[0] and max_diff <= FAST_PATH_MAX_CONFIDENCE_DIFF,
+    }
+
+
+def iter_cases(images_dir):
+    for i, (name, width, height, fmt) in enumerate(SYNTHETIC_CASES):
+        yield name, synthetic_photo(width, height, fmt, seed=i)
+    if images_dir:
+        for filename in sorted(os.listdir(images_dir)):
+            path = os.path.join(images_dir, filename)
+            if os.path.isfile(path):
+                with open(path, "rb") as f:
+                    yield filename, f.read()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--images", help="额外测试的真实图片目录")
+    parser.add_argument("--repeat", type=int, default=10, help="每张图重复次数")
+    parser.add_argument("--json", help="把结果写入 JSON 文件")
+    args = parser.parse_args()
+
+    classifier = ImageClassifier(fast_preprocess=False)
+    rows = []
+    print(f"{'case':<24}{'size':>12}{'standard ms':>14}{'fast ms':>10}{'speedup':>9}"
+          f"{'top1':>6}{'max Δconf':>11}")
+    for name, data in iter_cases(args.images):
+        try:
+            row = compare(classifier, name, data, args.repeat)
+        except Exception as e:
+            print(f"{name:<24} 跳过: {e}")
+            continue
+        rows.append(row)
+        print(f"{row['case'][:23]:<24}{row['size']:>12}{row['standard_ms']:>14.2f}{row['fast_ms']:>10.2f}"
+              f"{row['speedup']:>8.2f}x{'✓' if row['top1_match'] else '✗':>6}"
+              f"{row['max_top5_confidence_diff']:>11.3f}")
+
+    failed = [row["case"] for row in rows if not row["within_tolerance"]]
+    print(f"\n容限: top-1 一致且 top-5 置信度差值 ≤ {FAST_PATH_MAX_CONFIDENCE_DIFF} 个百分点")
+    print("✓ 全部在容限内" if not failed else f"✗ 超出容限: {', '.join(failed)}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"tolerance_confidence_diff": FAST_PATH_MAX_CONFIDENCE_DIFF, "results": rows},
+                      f, ensure_ascii=False, indent=2)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,133 @@
+"""推理后端对比：延迟、吞吐量以及与 eager FP32 的 top-1/top-5 一致率
+
+用法（在 cnn-classifier 目录下）:
+    python benchmarks/compare_backends.py --images ~/val_images
+    python benchmarks/compare_backends.py --images ~/val_images --backends eager torchscript int8_static \\
+        --batch-size 16 --json backends.json
+
+--images 应该是真实照片（例如 ImageNet 验证集的一部分），不指定时使用合成图片，
+此时只有速度数据有参考价值。int8_static 默认用同一批图片的前 --calibration-images 张做校准。
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+import torch
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.backends import BACKENDS, build_backend  # noqa: E402
+from app.model_handler import ImageClassifier  # noqa: E402
+from bench_preprocess import synthetic_photo  # noqa: E402
+
+
+def load_inputs(classifier, images_dir, limit):
+    inputs = []
+    if images_dir:
+        for filename in sorted(os.listdir(images_dir)):
+            if len(inputs) >= limit:
+                break
+            try:
+                with open(os.path.join(images_dir, filename), "rb") as f:
+                    inputs.append(classifier.preprocess(f.read()))
+            except Exception:
+                continue
+    else:
+        print("⚠ 未指定 --images，使用合成图片：一致率没有参考意义，只看速度")
+        for i in range(min(limit, 32)):
+            inputs.append(classifier.preprocess(synthetic_photo(800, 600, "JPEG", seed=i)))
+    return inputs
+
+
+def run_backend(backend, classifier, inputs, batch_size, repeat):
+    # 预热（TorchScript/ONNX Runtime 首次运行会做图优化）
+    for _ in range(2):
+        backend(classifier.make_batch(inputs[:batch_size]))
+
+    latencies = []
+    for image in inputs[:min(len(inputs), 50)]:
+        batch = classifier.make_batch([image])
+        start = time.perf_counter()
+        backend(batch)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    batches = [classifier.make_batch(inputs[i:i + batch_size]) for i in range(0, len(inputs), batch_size)]
+    logits = []
+    start = time.perf_counter()
+    for r in range(repeat):
+        outputs = [backend(batch) for batch in batches]
+        if r == 0:
+            logits = torch.cat([o.float() for o in outputs])
+    elapsed = time.perf_counter() - start
+    return latencies, len(inputs) * repeat / elapsed, logits
+
+
+def agreement(reference, logits):
+    ref_top5 = torch.topk(reference, 5, dim=1).indices
+    top5 = torch.topk(logits, 5, dim=1).indices
+    top1 = (ref_top5[:, 0] == top5[:, 0]).float().mean().item()
+    overlap = [len(set(a.tolist()) & set(b.tolist())) / 5 for a, b in zip(ref_top5, top5)]
+    return top1, sum(overlap) / len(overlap)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--images", help="本地图片目录")
+    parser.add_argument("--limit", type=int, default=256, help="最多使用的图片数")
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=BACKENDS)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=3, help="吞吐量测试重复轮数")
+    parser.add_argument("--calibration-images", type=int, default=64)
+    parser.add_argument("--json", help="把结果写入 JSON 文件")
+    args = parser.parse_args()
+
+    classifier = ImageClassifier(backend="eager")
+    inputs = load_inputs(classifier, args.images, args.limit)
+    if not inputs:
+        print("✗ 没有可用的图片")
+        return 1
+    calibration = [classifier.make_batch(inputs[i:i + args.batch_size])
+                   for i in range(0, min(len(inputs), args.calibration_images), args.batch_size)]
+
+    rows = []
+    reference = None
+    print(f"{'backend':<15}{'p50 ms (bs=1)':>15}{'p95 ms':>9}{'img/s (bs=' + str(args.batch_size) + ')':>16}"
+          f"{'top-1 agree':>13}{'top-5 agree':>13}")
+    for name in ["eager"] + [b for b in args.backends if b != "eager"]:
+        try:
+            backend = build_backend(name, classifier.model, arch=classifier.arch,
+                                    calibration_batches=calibration, work_dir=classifier.model_dir)
+            latencies, throughput, logits = run_backend(backend, classifier, inputs, args.batch_size, args.repeat)
+        except Exception as e:
+            print(f"{name:<15} 跳过: {e}")
+            continue
+        if reference is None:
+            reference = logits
+        top1, top5 = agreement(reference, logits)
+        latencies.sort()
+        row = {
+            "backend": name,
+            "description": backend.description,
+            "latency_p50_ms": round(statistics.median(latencies), 2),
+            "latency_p95_ms": round(latencies[int(len(latencies) * 0.95) - 1], 2),
+            "throughput_ips": round(throughput, 1),
+            "batch_size": args.batch_size,
+            "top1_agreement": round(top1, 4),
+            "top5_agreement": round(top5, 4),
+            "images": len(inputs),
+        }
+        rows.append(row)
+        print(f"{name:<15}{row['latency_p50_ms']:>15.2f}{row['latency_p95_ms']:>9.2f}"
+              f"{row['throughput_ips']:>16.1f}{top1:>13.2%}{top5:>13.2%}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"torch_threads": torch.get_num_threads(), "results": rows}, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,170 @@
+"""模型级联评估：不同阈值下的升级率、相对只用大模型的加速比，以及与大模型 top-1 结果的一致率
+
+用法（在 cnn-classifier 目录下）:
+    python benchmarks/eval_cascade.py --images ~/val_images
+    python benchmarks/eval_cascade.py --images ~/val_images --first mobilenet_v3_small --final resnet18 \\
+        --confidences 40 50 60 70 --margins 0 10 --json cascade.json
+
+只统计前向推理时间（服务中两级共用一次解码，解码开销与是否级联无关）。
+--images 应该是真实照片，不指定时使用合成图片，此时置信度普遍很低，结果没有参考价值。
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import torch
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import config  # noqa: E402
+from app.cascade import Cascade  # noqa: E402
+from app.model_handler import ImageClassifier  # noqa: E402
+from bench_preprocess import synthetic_photo  # noqa: E402
+
+
+def load_images(images_dir, limit):
+    images = []
+    if images_dir:
+        for filename in sorted(os.listdir(images_dir)):
+            if len(images) >= limit:
+                break
+            path = os.path.join(images_dir, filename)
+            if os.path.isfile(path):
+                with open(path, "rb") as f:
+                    images.append(f.read())
+    else:
+        print("⚠ 未指定 --images，使用合成图片：升级率和一致率没有参考意义")
+        for i in range(min(limit, 32)):
+            images.append(synthetic_photo(800, 600, "JPEG", seed=i))
+    return images
+
+
+def preprocess_all(classifier, images):
+    inputs = []
+    for data in images:
+        try:
+            inputs.append(classifier.preprocess(data))
+        except Exception:
+            inputs.append(None)
+    return inputs
+
+
+def run_model(classifier, inputs, batch_size, repeat):
+    """返回 (概率矩阵, 最快一轮的总推理秒数)"""
+    batches = [classifier.make_batch(inputs[i:i + batch_size]) for i in range(0, len(inputs), batch_size)]
+    if not batches:
+        return torch.empty(0, 1000), 0.0
+    # 预热
+    with torch.no_grad():
+        classifier.backend(batches[0])
+    best = None
+    probabilities = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with torch.no_grad():
+            outputs = [classifier.backend(batch).float() for batch in batches]
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+        if probabilities is None:
+            probabilities = torch.softmax(torch.cat(outputs), dim=1)
+    return probabilities, best
+
+
+def first_stage_results(probabilities):
+    """把概率整理成 Cascade.should_escalate 使用的结果格式（只需要前两个预测的置信度）"""
+    top2 = torch.topk(probabilities, 2, dim=1)
+    values = (top2.values * 100).tolist()
+    return [{"success": True, "predictions": [{"confidence": round(a, 2)}, {"confidence": round(b, 2)}]}
+            for a, b in values], top2.indices[:, 0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--images", help="本地图片目录")
+    parser.add_argument("--limit", type=int, default=256, help="最多使用的图片数")
+    parser.add_argument("--first", default=config.CASCADE_FIRST_MODEL, help="第一级（小）模型")
+    parser.add_argument("--final", default=config.CASCADE_FINAL_MODEL, help="第二级（大）模型")
+    parser.add_argument("--confidences", type=float, nargs="+", default=[30, 40, 50, 60, 70, 80, 90],
+                        help="要评估的 CASCADE_MIN_CONFIDENCE（百分比）")
+    parser.add_argument("--margins", type=float, nargs="+", default=[0],
+                        help="要评估的 CASCADE_MIN_MARGIN（百分比）")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=3, help="计时重复轮数（取最快一轮）")
+    parser.add_argument("--json", help="把结果写入 JSON 文件")
+    args = parser.parse_args()
+
+    first = ImageClassifier(arch=args.first)
+    final = ImageClassifier(arch=args.final)
+    images = load_images(args.images, args.limit)
+    first_inputs = preprocess_all(first, images)
+    if final.preprocess_args == first.preprocess_args:
+        final_inputs = first_inputs
+    else:
+        final_inputs = preprocess_all(final, images)
+    # 两个模型都能解码的图片才参与评估
+    keep = [i for i in range(len(images)) if first_inputs[i] is not None and final_inputs[i] is not None]
+    if not keep:
+        print("✗ 没有可用的图片")
+        return 1
+    first_inputs = [first_inputs[i] for i in keep]
+    final_inputs = [final_inputs[i] for i in keep]
+    count = len(keep)
+
+    final_probs, final_seconds = run_model(final, final_inputs, args.batch_size, args.repeat)
+    first_probs, first_seconds = run_model(first, first_inputs, args.batch_size, args.repeat)
+    reference = final_probs.argmax(dim=1)
+    first_results, first_top1 = first_stage_results(first_probs)
+    print(f"{count} 张图片，batch={args.batch_size}: {args.final} {count / final_seconds:.1f} img/s，"
+          f"{args.first} {count / first_seconds:.1f} img/s，"
+          f"两者 top-1 一致率 {(first_top1 == reference).float().mean().item():.2%}")
+
+    rows = []
+    print(f"{'min_conf %':>11}{'min_margin %':>14}{'escalated':>11}{'speedup':>9}{'top-1 agree':>13}"
+          f"{'agree (kept)':>14}")
+    for min_margin in args.margins:
+        for min_confidence in args.confidences:
+            rule = Cascade(args.first, args.final, min_confidence=min_confidence, min_margin=min_margin)
+            escalated = [i for i, result in enumerate(first_results) if rule.should_escalate(result)]
+            # 只对升级的图片再跑一次大模型，计时和服务中的第二级一致
+            _, escalated_seconds = run_model(final, [final_inputs[i] for i in escalated], args.batch_size,
+                                             args.repeat)
+            answers = first_top1.clone()
+            answers[escalated] = reference[escalated]
+            kept = torch.ones(count, dtype=torch.bool)
+            kept[escalated] = False
+            cascade_seconds = first_seconds + escalated_seconds
+            row = {
+                "min_confidence": min_confidence,
+                "min_margin": min_margin,
+                "escalation_rate": round(len(escalated) / count, 4),
+                "speedup": round(final_seconds / cascade_seconds, 3),
+                "top1_agreement": round((answers == reference).float().mean().item(), 4),
+                # 第一级自己回答的图片中与大模型一致的比例
+                "kept_agreement": round((first_top1[kept] == reference[kept]).float().mean().item(), 4)
+                if kept.any() else None,
+                "cascade_ips": round(count / cascade_seconds, 1),
+            }
+            rows.append(row)
+            kept_text = f"{row['kept_agreement']:.2%}" if row["kept_agreement"] is not None else "-"
+            print(f"{min_confidence:>11g}{min_margin:>14g}{row['escalation_rate']:>11.1%}"
+                  f"{row['speedup']:>8.2f}x{row['top1_agreement']:>13.2%}{kept_text:>14}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({
+                "first": args.first,
+                "final": args.final,
+                "images": count,
+                "batch_size": args.batch_size,
+                "torch_threads": torch.get_num_threads(),
+                "final_ips": round(count / final_seconds, 1),
+                "first_ips": round(count / first_seconds, 1),
+                "results": rows,
+            }, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
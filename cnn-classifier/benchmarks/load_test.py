@@ -0,0 +1,365 @@
+"""识别接口的离线基准 / 压测（替代原来的 test_api.py）
+
+用法（在 cnn-classifier 目录下）:
+    python benchmarks/load_test.py                               # 进程内，经 ASGI 直接调用 app
+    python benchmarks/load_test.py --mode server                 # 启动真实的 uvicorn 服务（python app/main.py）
+    python benchmarks/load_test.py --url http://10.0.0.5:8000    # 压测已经在运行的服务
+    python benchmarks/load_test.py --concurrency 1 8 32 --requests 200 --json after.json
+    python benchmarks/load_test.py --baseline before.json --json after.json --tolerance 0.1
+    python benchmarks/load_test.py --query top_k=1 fields=predictions.class_id --accept application/msgpack
+
+测试图片是固定随机种子合成的多种尺寸/格式图片，每次运行完全一致，不需要手工准备。
+默认每个请求在图片末尾追加几个不影响解码的字节，避免结果缓存命中（--allow-cache 关闭）。
+每个场景（图片 × 并发数）报告吞吐量、p50/p95/p99 延迟，以及从 /metrics 差分得到的各阶段平均耗时；
+指定 --baseline 时与之前的结果对比，吞吐量下降或 p95/p99 上升超过 --tolerance 记为回退，退出码为 1。
+模型服务的配置（WORKERS、BATCH_MAX_SIZE、INFERENCE_BACKEND 等）沿用当前环境变量，会记录在结果中。
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import re
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+import numpy as np
+from PIL import features
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(PROJECT_DIR)
+
+from benchmarks.bench_preprocess import synthetic_photo  # noqa: E402
+
+# (名称, 宽, 高, 格式)
+IMAGE_CASES = [
+    ("vga jpeg", 640, 480, "JPEG"),
+    ("2MP jpeg", 1920, 1080, "JPEG"),
+    ("12MP jpeg", 4000, 3000, "JPEG"),
+    ("1MP png", 1024, 1024, "PNG"),
+    ("xga webp", 1024, 768, "WEBP"),
+]
+CONTENT_TYPES = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp"}
+
+# 结果中记录的服务配置
+CONFIG_ENV = ("WORKERS", "CPU_PER_WORKER", "BATCH_MAX_SIZE", "BATCH_MAX_WAIT_MS", "INFERENCE_EXECUTOR",
+              "INFERENCE_WORKERS", "INFERENCE_MAX_CONCURRENCY", "INFERENCE_BACKEND", "TORCH_NUM_THREADS",
+              "DEFAULT_MODEL", "FAST_PREPROCESS", "CACHE_ENABLED")
+
+_METRIC_LINE = re.compile(r'^(cnn_stage_duration_seconds|cnn_batch_size)_(sum|count)\{([^}]*)\} (\S+)$')
+
+
+def build_images(names=None):
+    """生成测试图片（固定种子，结果可复现）"""
+    images = []
+    for seed, (name, width, height, fmt) in enumerate(IMAGE_CASES):
+        if names and name not in names:
+            continue
+        if fmt == "WEBP" and not features.check("webp"):
+            print(f"⚠ Pillow 不支持 WebP，跳过 {name}")
+            continue
+        images.append({"name": name, "format": fmt, "data": synthetic_photo(width, height, fmt, seed=seed)})
+    return images
+
+
+def parse_metrics(text):
+    """从 /metrics 中取出各阶段和批大小的 sum/count"""
+    values = {}
+    for line in text.splitlines():
+        match = _METRIC_LINE.match(line)
+        if match:
+            name, kind, labels, value = match.groups()
+            values[(name, labels, kind)] = float(value)
+    return values
+
+
+def stage_breakdown(before, after):
+    """两次抓取之间各阶段的平均耗时（毫秒）和记录次数"""
+    stages = {}
+    avg_batch_size = None
+    for (name, labels, kind), value in after.items():
+        if kind != "count":
+            continue
+        count = value - before.get((name, labels, "count"), 0)
+        if count <= 0:
+            continue
+        total = after[(name, labels, "sum")] - before.get((name, labels, "sum"), 0)
+        if name == "cnn_batch_size":
+            avg_batch_size = round(total / count, 2)
+        else:
+            stage = labels.split('"')[1]
+            stages[stage] = {"mean_ms": round(total / count * 1000, 3), "count": int(count)}
+    return stages, avg_batch_size
+
+
+def decode_body(response):
+    if "msgpack" in response.headers.get("content-type", ""):
+        import msgpack
+        return msgpack.unpackb(response.content)
+    return response.json()
+
+
+def percentiles(latencies):
+    values = np.asarray(latencies) * 1000
+    return {
+        "mean": round(float(values.mean()), 2),
+        "p50": round(float(np.percentile(values, 50)), 2),
+        "p95": round(float(np.percentile(values, 95)), 2),
+        "p99": round(float(np.percentile(values, 99)), 2),
+        "max": round(float(values.max()), 2),
+    }
+
+
+async def wait_ready(client, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            response = await client.get("/ready")
+            if response.status_code == 200:
+                return response.json()
+            if response.json().get("model_status") == "failed":
+                raise RuntimeError(f"模型加载失败: {response.json().get('error')}")
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise TimeoutError(f"服务在 {timeout}s 内没有就绪")
+
+
+async def smoke_check(client):
+    """原 test_api.py 的接口检查：各页面/接口的状态码"""
+    checks = {}
+    for path in ("/health", "/ready", "/", "/docs", "/metrics"):
+        try:
+            checks[path] = (await client.get(path)).status_code
+        except httpx.HTTPError as e:
+            checks[path] = str(e)
+    return checks
+
+
+async def run_scenario(client, image, concurrency, total, warmup, params, bust_cache, headers=None):
+    content_type = CONTENT_TYPES[image["format"]]
+    counter = {"next": 0}
+    # 每个场景、每次运行都不同，避免命中之前场景（或之前运行）留下的缓存
+    nonce = f"{time.time_ns()}-{concurrency}-"
+    latencies = []
+    errors = {}
+
+    async def send(index):
+        data = image["data"]
+        if bust_cache:
+            # 解码器忽略图片结束标记之后的字节，但内容哈希不同，不会命中结果缓存
+            data = data + b"\0" + (nonce + str(index)).encode()
+        started = time.perf_counter()
+        try:
+            response = await client.post("/predict", params=params, headers=headers,
+                                         files={"file": (f"bench.{image['format'].lower()}", data, content_type)})
+            ok = response.status_code == 200 and decode_body(response).get("success")
+            reason = "ok" if ok else f"http {response.status_code}"
+        except httpx.HTTPError as e:
+            reason = type(e).__name__
+        return time.perf_counter() - started, reason
+
+    for i in range(warmup):
+        await send(-1 - i)
+
+    async def worker():
+        while counter["next"] < total:
+            index = counter["next"]
+            counter["next"] += 1
+            elapsed, reason = await send(index)
+            if reason == "ok":
+                latencies.append(elapsed)
+            else:
+                errors[reason] = errors.get(reason, 0) + 1
+
+    before = parse_metrics((await client.get("/metrics")).text)
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall = time.perf_counter() - started
+    after = parse_metrics((await client.get("/metrics")).text)
+    stages, avg_batch_size = stage_breakdown(before, after)
+
+    return {
+        "name": f"{image['name']} @c{concurrency}",
+        "image": image["name"],
+        "image_bytes": len(image["data"]),
+        "concurrency": concurrency,
+        "requests": total,
+        "errors": errors,
+        "wall_seconds": round(wall, 3),
+        "throughput_rps": round(len(latencies) / wall, 2) if wall > 0 else 0.0,
+        "latency_ms": percentiles(latencies) if latencies else None,
+        "stages_ms": stages,
+        "avg_batch_size": avg_batch_size,
+    }
+
+
+def find_regressions(results, baseline, tolerance):
+    """与基准结果逐场景对比：吞吐量下降或 p95/p99 上升超过 tolerance（相对值）"""
+    previous = {s["name"]: s for s in baseline.get("scenarios", [])}
+    regressions = []
+    for scenario in results:
+        old = previous.get(scenario["name"])
+        if not old or not old.get("latency_ms") or not scenario.get("latency_ms"):
+            continue
+        checks = [("throughput_rps", old["throughput_rps"], scenario["throughput_rps"], -1)]
+        for p in ("p95", "p99"):
+            checks.append((f"latency_ms.{p}", old["latency_ms"][p], scenario["latency_ms"][p], 1))
+        for metric, before, after, direction in checks:
+            if before <= 0:
+                continue
+            change = (after - before) / before
+            if change * direction > tolerance:
+                regressions.append({"scenario": scenario["name"], "metric": metric,
+                                    "baseline": before, "current": after, "change": round(change, 3)})
+    return regressions
+
+
+def environment_info(mode):
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=PROJECT_DIR,
+                                capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except Exception:
+        commit = None
+    info = {
+        "mode": mode,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_commit": commit,
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "config": {k: os.environ[k] for k in CONFIG_ENV if k in os.environ},
+    }
+    try:
+        import torch
+        info["torch"] = torch.__version__
+    except ImportError:
+        pass
+    return info
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def run_all(args, images):
+    server = None
+    app = None
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=args.timeout)
+    elif args.mode == "server":
+        port = _free_port()
+        env = dict(os.environ, HOST="127.0.0.1", PORT=str(port))
+        print(f"启动 uvicorn 服务: 127.0.0.1:{port}")
+        server = subprocess.Popen([sys.executable, os.path.join("app", "main.py")], cwd=PROJECT_DIR, env=env,
+                                  stdout=subprocess.DEVNULL if args.quiet_server else None,
+                                  stderr=subprocess.STDOUT if args.quiet_server else None)
+        client = httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=args.timeout)
+    else:
+        # 进程内：不经过网络，直接通过 ASGI 调用 app（与压测客户端共用一个事件循环）
+        from app import main
+        app = main.app
+        await app.router.startup()
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://asgi",
+                                   timeout=args.timeout)
+
+    try:
+        ready = await wait_ready(client, args.ready_timeout)
+        print(f"✓ 服务就绪: {ready.get('startup')}")
+        smoke = await smoke_check(client)
+        print(f"接口检查: {smoke}")
+        params = dict(item.split("=", 1) for item in args.query)
+        if args.model:
+            params["model"] = args.model
+        headers = {"accept": args.accept} if args.accept else None
+        scenarios = []
+        for image in images:
+            for concurrency in args.concurrency:
+                result = await run_scenario(client, image, concurrency, args.requests, args.warmup,
+                                            params, bust_cache=not args.allow_cache, headers=headers)
+                scenarios.append(result)
+                print_scenario(result)
+        return smoke, scenarios
+    finally:
+        await client.aclose()
+        if app is not None:
+            await app.router.shutdown()
+        if server is not None:
+            server.terminate()
+            try:
+                server.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                server.kill()
+
+
+def print_scenario(result):
+    latency = result["latency_ms"] or {}
+    errors = sum(result["errors"].values())
+    print(f"{result['name']:<22} {result['throughput_rps']:>8.1f} req/s  "
+          f"p50 {latency.get('p50', 0):>8.1f}ms  p95 {latency.get('p95', 0):>8.1f}ms  "
+          f"p99 {latency.get('p99', 0):>8.1f}ms  batch {result['avg_batch_size'] or 0:>5}  errors {errors}")
+    if result["stages_ms"]:
+        print("    " + "  ".join(f"{stage} {v['mean_ms']:.2f}ms" for stage, v in result["stages_ms"].items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="识别接口基准 / 压测")
+    parser.add_argument("--mode", choices=("asgi", "server"), default="asgi",
+                        help="asgi: 进程内调用；server: 启动 python app/main.py")
+    parser.add_argument("--url", help="压测已经在运行的服务（忽略 --mode）")
+    parser.add_argument("--images", nargs="+", metavar="NAME",
+                        help=f"只测试这些图片，可选: {', '.join(c[0] for c in IMAGE_CASES)}")
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 8])
+    parser.add_argument("--requests", type=int, default=64, help="每个场景的请求数")
+    parser.add_argument("--warmup", type=int, default=4, help="每个场景的预热请求数（不计入结果）")
+    parser.add_argument("--model", help="?model= 参数")
+    parser.add_argument("--query", nargs="+", default=[], metavar="KEY=VALUE",
+                        help="其他查询参数，例如 top_k=1 fields=predictions.class_id")
+    parser.add_argument("--accept", help="Accept 请求头，例如 application/msgpack")
+    parser.add_argument("--allow-cache", action="store_true", help="不追加随机字节，允许命中结果缓存")
+    parser.add_argument("--timeout", type=float, default=60.0, help="单个请求的超时（秒）")
+    parser.add_argument("--ready-timeout", type=float, default=300.0, help="等待服务就绪的超时（秒）")
+    parser.add_argument("--quiet-server", action="store_true", help="server 模式下不输出服务日志")
+    parser.add_argument("--json", help="把结果写入 JSON 文件")
+    parser.add_argument("--baseline", help="与之前的 JSON 结果对比，检查性能回退")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="允许的相对变化（默认 10%%）")
+    args = parser.parse_args()
+
+    images = build_images(args.images)
+    if not images:
+        parser.error("没有可用的测试图片")
+    mode = "url" if args.url else args.mode
+    print(f"模式: {mode}，并发: {args.concurrency}，每个场景 {args.requests} 个请求")
+
+    smoke, scenarios = asyncio.run(run_all(args, images))
+    report = {"environment": environment_info(mode), "smoke": smoke, "scenarios": scenarios}
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        report["baseline"] = {"file": args.baseline, "git_commit": baseline.get("environment", {}).get("git_commit"),
+                              "tolerance": args.tolerance}
+        report["regressions"] = find_regressions(scenarios, baseline, args.tolerance)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入 {args.json}")
+
+    failed = any(s["errors"] for s in scenarios)
+    if failed:
+        print("✗ 部分请求失败，见结果中的 errors")
+    for item in report.get("regressions", []):
+        print(f"✗ 性能回退: {item['scenario']} {item['metric']} "
+              f"{item['baseline']} -> {item['current']} ({item['change']:+.1%})")
+    if args.baseline and not report["regressions"]:
+        print(f"✓ 与 {args.baseline} 相比没有超过 {args.tolerance:.0%} 的回退")
+    sys.exit(1 if failed or report.get("regressions") else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,354 @@
+"""离线批量识别：不经过 HTTP 服务，直接用 ImageClassifier 识别目录或 tar 分片中的全部图片
+
+用法（在 cnn-classifier 目录下）:
+    python scripts/classify_offline.py /data/photos --output results.jsonl
+    python scripts/classify_offline.py shards/train-000.tar shards/train-001.tar --output results.csv \\
+        --workers 8 --batch-size 128 --top-k 5
+
+流水线：主进程按固定顺序枚举图片 -> 解码/预处理进程池（每个任务一小组图片）-> 主进程组成大批次做前向推理
+-> 按枚举顺序写出结果。解码进程池提前工作，推理和解码同时进行。
+
+输出格式由 --format 或输出文件扩展名决定（.jsonl / .csv）。每 --checkpoint-every 张图片刷盘一次并写
+<output>.checkpoint.json（已完成的图片数和输出文件长度），中断后用同样的参数再次运行会从上次的检查点继续：
+输出文件截断到检查点位置，跳过已完成的图片。
+"""
+import argparse
+import collections
+import csv
+import json
+import multiprocessing
+import os
+import signal
+import sys
+import tarfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import config  # noqa: E402
+from app.archive import is_image_name  # noqa: E402
+from app.executor import configure_torch_threads  # noqa: E402
+from app.model_handler import MODEL_SPECS, ImageClassifier, preprocess_image_timed  # noqa: E402
+
+TAR_SUFFIXES = (".tar", ".tar.gz", ".tgz")
+CSV_FIELDS = ["path", "success", "class_id", "class_name", "confidence", "top_k_ids", "top_k_confidences", "error"]
+
+
+def iter_sources(inputs):
+    """按固定顺序产出 (名称, 文件路径 或 图片字节)；目录递归、按名称排序，tar 分片按成员顺序
+
+    顺序必须稳定，检查点只记录已完成的数量。
+    """
+    for source in inputs:
+        if os.path.isdir(source):
+            for root, dirs, files in os.walk(source):
+                dirs.sort()
+                for filename in sorted(files):
+                    if is_image_name(filename):
+                        yield os.path.join(root, filename), os.path.join(root, filename)
+        elif source.lower().endswith(TAR_SUFFIXES):
+            with tarfile.open(source, "r:*") as tf:
+                for member in tf:
+                    if member.isfile() and is_image_name(member.name):
+                        # 延迟读取：恢复时跳过的成员不读数据（未压缩的 tar 可以直接跳过）
+                        yield f"{source}::{member.name}", (lambda tf=tf, member=member: tf.extractfile(member).read())
+        elif is_image_name(source):
+            yield source, source
+        else:
+            print(f"⚠ 跳过不支持的输入: {source}")
+
+
+def _init_decode_worker():
+    # 解码子进程只做预处理，单线程即可；Ctrl+C 只由主进程处理（保存检查点）
+    import torch
+    torch.set_num_threads(1)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def decode_chunk(chunk, preprocess_args):
+    """在子进程中解码一组图片，返回 [(名称, 图像或 None, 错误, 解码秒数, 缩放秒数)]"""
+    decoded = []
+    for name, data in chunk:
+        try:
+            if isinstance(data, str):
+                with open(data, "rb") as f:
+                    data = f.read()
+            image, decode_seconds, transform_seconds = preprocess_image_timed(data, *preprocess_args)
+            decoded.append((name, image, None, decode_seconds, transform_seconds))
+        except Exception as e:
+            decoded.append((name, None, str(e), 0.0, 0.0))
+    return decoded
+
+
+def iter_decoded(pool, sources, preprocess_args, chunk_size, window):
+    """把图片分组提交到进程池，最多 window 组同时在途，按提交顺序产出解码结果"""
+    pending = collections.deque()
+    chunk = []
+    for name, data in sources:
+        # tar 成员在主进程中读出字节再交给子进程
+        chunk.append((name, data() if callable(data) else data))
+        if len(chunk) >= chunk_size:
+            pending.append(pool.submit(decode_chunk, chunk, preprocess_args))
+            chunk = []
+            while len(pending) >= window:
+                yield from pending.popleft().result()
+    if chunk:
+        pending.append(pool.submit(decode_chunk, chunk, preprocess_args))
+    while pending:
+        yield from pending.popleft().result()
+
+
+def skip(iterable, count):
+    iterator = iter(iterable)
+    for _ in range(count):
+        if next(iterator, None) is None:
+            break
+    return iterator
+
+
+class ResultWriter:
+    """JSONL / CSV 输出 + 检查点"""
+
+    def __init__(self, path, fmt, checkpoint_path, run_config):
+        self.path = path
+        self.fmt = fmt
+        self.checkpoint_path = checkpoint_path
+        self.run_config = run_config
+        self.done = 0
+        self._file = None
+        self._csv = None
+
+    def open(self, resume):
+        if resume is not None:
+            self.done = resume["done"]
+            self._file = open(self.path, "r+", encoding="utf-8", newline="")
+            # 丢掉检查点之后写入的部分（中断时可能写了半行）
+            self._file.truncate(resume["output_bytes"])
+            self._file.seek(resume["output_bytes"])
+        else:
+            self._file = open(self.path, "w", encoding="utf-8", newline="")
+        if self.fmt == "csv":
+            self._csv = csv.writer(self._file)
+            if resume is None:
+                self._csv.writerow(CSV_FIELDS)
+
+    def write(self, name, result, top_k):
+        if self.fmt == "csv":
+            self._csv.writerow(csv_row(name, result, top_k))
+        else:
+            self._file.write(json.dumps(jsonl_row(name, result, top_k), ensure_ascii=False) + "\n")
+        self.done += 1
+
+    def checkpoint(self, complete=False):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        state = dict(self.run_config, done=self.done, output_bytes=self._file.tell(), complete=complete,
+                     updated_at=time.strftime("%Y-%m-%d %H:%M:%S"))
+        tmp_path = self.checkpoint_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+
+def jsonl_row(name, result, top_k):
+    if not result.get("success"):
+        return {"path": name, "success": False, "error": result.get("error")}
+    return {
+        "path": name,
+        "success": True,
+        "predictions": [{"class_id": p["class_id"], "class_name": p["class_name"], "confidence": p["confidence"]}
+                        for p in result["predictions"][:top_k]],
+    }
+
+
+def csv_row(name, result, top_k):
+    if not result.get("success"):
+        return [name, 0, "", "", "", "", "", result.get("error")]
+    predictions = result["predictions"][:top_k]
+    top = predictions[0]
+    return [name, 1, top["class_id"], top["class_name"], top["confidence"],
+            "|".join(str(p["class_id"]) for p in predictions),
+            "|".join(str(p["confidence"]) for p in predictions), ""]
+
+
+def load_checkpoint(args, run_config):
+    """返回可以继续的检查点；参数不一致或输出文件已存在但没有检查点时报错退出"""
+    if args.restart or not os.path.exists(args.checkpoint):
+        if os.path.exists(args.output) and not args.restart:
+            sys.exit(f"✗ 输出文件 {args.output} 已存在但没有检查点，请换一个输出文件或使用 --restart 覆盖")
+        return None
+    with open(args.checkpoint, encoding="utf-8") as f:
+        state = json.load(f)
+    changed = [key for key in run_config if state.get(key) != run_config[key]]
+    if changed:
+        sys.exit(f"✗ 检查点 {args.checkpoint} 的参数与本次运行不同（{', '.join(changed)}），"
+                 f"请使用相同的参数继续，或使用 --restart 重新开始")
+    if not os.path.exists(args.output) or os.path.getsize(args.output) < state["output_bytes"]:
+        sys.exit(f"✗ 输出文件 {args.output} 比检查点记录的短，无法继续，请使用 --restart 重新开始")
+    return state
+
+
+class Stats:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.images = 0
+        self.errors = 0
+        self.decode_seconds = 0.0
+        self.transform_seconds = 0.0
+        self.inference_seconds = 0.0
+        # 主进程等待解码结果的时间：越大说明解码是瓶颈（应该增加 --workers）
+        self.wait_seconds = 0.0
+        self.batches = 0
+
+    def summary(self, workers):
+        elapsed = time.perf_counter() - self.started
+        return {
+            "images": self.images,
+            "errors": self.errors,
+            "elapsed_seconds": round(elapsed, 2),
+            "images_per_second": round(self.images / elapsed, 1) if elapsed else 0.0,
+            "batches": self.batches,
+            # 解码/缩放是所有子进程的 CPU 时间之和，除以进程数才是墙钟时间
+            "decode_cpu_seconds": round(self.decode_seconds, 2),
+            "transform_cpu_seconds": round(self.transform_seconds, 2),
+            "decode_wall_seconds": round((self.decode_seconds + self.transform_seconds) / workers, 2),
+            "inference_seconds": round(self.inference_seconds, 2),
+            "wait_for_decode_seconds": round(self.wait_seconds, 2),
+        }
+
+
+def print_progress(stats, done, workers):
+    s = stats.summary(workers)
+    print(f"  已完成 {done} 张 | 本次 {s['images']} 张 {s['images_per_second']} 张/秒 | "
+          f"解码 {s['decode_wall_seconds']}s（{workers} 进程）推理 {s['inference_seconds']}s "
+          f"等待解码 {s['wait_for_decode_seconds']}s | 失败 {s['errors']}", flush=True)
+
+
+def run(args):
+    fmt = args.format or ("csv" if args.output.lower().endswith(".csv") else "jsonl")
+    run_config = {
+        "inputs": [os.path.abspath(path) for path in args.inputs],
+        "format": fmt,
+        "arch": args.arch,
+        "top_k": args.top_k,
+    }
+    resume = load_checkpoint(args, run_config)
+    if resume is not None and resume.get("complete"):
+        print(f"✓ {args.output} 已经全部完成（{resume['done']} 张），无需继续；重新识别请使用 --restart")
+        return
+
+    # 先创建解码进程池（fork 出的子进程不带模型），再加载模型
+    pool = ProcessPoolExecutor(max_workers=args.workers, mp_context=multiprocessing.get_context("fork"),
+                               initializer=_init_decode_worker)
+    configure_torch_threads(num_threads=args.threads, cpu_count=config.CPU_COUNT, preprocess_workers=args.workers)
+    classifier = ImageClassifier(arch=args.arch, backend=args.backend)
+
+    writer = ResultWriter(args.output, fmt, args.checkpoint, run_config)
+    writer.open(resume)
+    if resume is not None:
+        print(f"✓ 从检查点继续：跳过已完成的 {resume['done']} 张")
+
+    stats = Stats()
+    sources = skip(iter_sources(args.inputs), writer.done)
+    decoded = iter_decoded(pool, sources, classifier.preprocess_args, args.chunk_size, window=args.workers * 4)
+    last_checkpoint = writer.done
+    last_report = time.perf_counter()
+
+    def flush(batch):
+        images = [item[1] for item in batch if item[1] is not None]
+        started = time.perf_counter()
+        results = iter(classifier.predict_batch(images, top_k=args.top_k) if images else [])
+        stats.inference_seconds += time.perf_counter() - started
+        stats.batches += 1
+        for name, image, error in batch:
+            result = next(results) if image is not None else ImageClassifier.error_result(error)
+            if not result.get("success"):
+                stats.errors += 1
+            writer.write(name, result, args.top_k)
+        stats.images += len(batch)
+
+    try:
+        batch = []
+        while True:
+            waited = time.perf_counter()
+            item = next(decoded, None)
+            stats.wait_seconds += time.perf_counter() - waited
+            if item is None:
+                break
+            name, image, error, decode_seconds, transform_seconds = item
+            stats.decode_seconds += decode_seconds
+            stats.transform_seconds += transform_seconds
+            batch.append((name, image, error))
+            if len(batch) < args.batch_size:
+                continue
+            flush(batch)
+            batch = []
+            if writer.done - last_checkpoint >= args.checkpoint_every:
+                writer.checkpoint()
+                last_checkpoint = writer.done
+            if time.perf_counter() - last_report >= args.report_seconds:
+                print_progress(stats, writer.done, args.workers)
+                last_report = time.perf_counter()
+        if batch:
+            flush(batch)
+        writer.checkpoint(complete=True)
+    except KeyboardInterrupt:
+        # 只保存到最近一个完整的批次，下次从这里继续
+        writer.checkpoint()
+        print(f"\n⚠ 已中断，检查点保存在 {args.checkpoint}（已完成 {writer.done} 张），用同样的参数再次运行即可继续")
+        raise SystemExit(130)
+    except Exception:
+        # 已写出的结果都是完整的行，保存检查点后再报错
+        writer.checkpoint()
+        raise
+    finally:
+        writer.close()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    summary = stats.summary(args.workers)
+    summary["total_done"] = writer.done
+    print("=" * 60)
+    print(f"✓ 完成：本次识别 {summary['images']} 张（失败 {summary['errors']}），累计 {writer.done} 张 -> {args.output}")
+    print(f"  吞吐量: {summary['images_per_second']} 张/秒，耗时 {summary['elapsed_seconds']}s，"
+          f"{summary['batches']} 个批次")
+    print(f"  解码+缩放: {summary['decode_wall_seconds']}s（{args.workers} 个进程共 "
+          f"{summary['decode_cpu_seconds'] + summary['transform_cpu_seconds']:.2f}s CPU，其中解码 "
+          f"{summary['decode_cpu_seconds']}s）")
+    print(f"  前向推理: {summary['inference_seconds']}s，主进程等待解码: {summary['wait_for_decode_seconds']}s"
+          f"（等待时间长说明解码是瓶颈，可以增加 --workers）")
+    if args.summary_json:
+        with open(args.summary_json, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="离线批量识别目录或 tar 分片中的图片（可中断后继续）")
+    parser.add_argument("inputs", nargs="+", help="图片目录、tar/tar.gz 分片或单个图片文件")
+    parser.add_argument("--output", required=True, help="结果文件（.jsonl 或 .csv）")
+    parser.add_argument("--format", choices=["jsonl", "csv"], help="输出格式，默认根据扩展名判断")
+    parser.add_argument("--arch", default=config.DEFAULT_MODEL, choices=sorted(MODEL_SPECS), help="模型")
+    parser.add_argument("--backend", default=config.INFERENCE_BACKEND, help="推理后端（见 app/backends.py）")
+    parser.add_argument("--top-k", type=int, default=5, help="每张图输出的预测个数")
+    parser.add_argument("--batch-size", type=int, default=64, help="每次前向推理的图片数")
+    parser.add_argument("--workers", type=int, default=max(1, config.CPU_COUNT // 2), help="解码进程数")
+    parser.add_argument("--threads", type=int, default=0, help="前向推理线程数，0 表示 CPU 核数 - 解码进程数")
+    parser.add_argument("--chunk-size", type=int, default=16, help="每个解码任务包含的图片数")
+    parser.add_argument("--checkpoint-every", type=int, default=1000, help="每识别多少张图片保存一次检查点")
+    parser.add_argument("--checkpoint", help="检查点文件，默认 <output>.checkpoint.json")
+    parser.add_argument("--restart", action="store_true", help="忽略已有的检查点，重新识别并覆盖输出文件")
+    parser.add_argument("--report-seconds", type=float, default=10.0, help="进度输出间隔（秒）")
+    parser.add_argument("--summary-json", help="把吞吐量和耗时拆分写入 JSON 文件")
+    args = parser.parse_args()
+    args.checkpoint = args.checkpoint or args.output + ".checkpoint.json"
+    if args.top_k < 1 or args.batch_size < 1 or args.workers < 1 or args.chunk_size < 1:
+        parser.error("--top-k / --batch-size / --workers / --chunk-size 必须为正数")
+    run(args)
+
+
+if __name__ == "__main__":
+    main()
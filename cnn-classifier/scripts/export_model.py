@@ -0,0 +1,68 @@
+"""导出本地模型文件，供离线启动使用
+
+在有网络的环境（例如 docker build 阶段）运行一次：
+    python scripts/export_model.py                       # 下载 ResNet18 预训练权重并导出到 models/
+    python scripts/export_model.py --arch resnet18 resnet50 mobilenet_v3_small
+    python scripts/export_model.py --from-pth resnet18.pth --output /data/models
+
+生成 <arch>.weights.bin / <arch>.weights.json（可内存映射）并复制 imagenet_classes.json，
+之后把 MODEL_DIR 指向该目录、设置 ALLOW_MODEL_DOWNLOAD=0 即可在离线节点上启动。
+"""
+import argparse
+import os
+import shutil
+import sys
+
+import torch
+import torchvision.models as models
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import artifacts, config  # noqa: E402
+from app.model_handler import MODEL_SPECS  # noqa: E402
+
+
+def export(arch, output, from_pth=None):
+    builder = getattr(models, arch)
+    if from_pth:
+        print(f"正在读取 {from_pth} ...")
+        model = builder(weights=None)
+        model.load_state_dict(torch.load(from_pth, map_location="cpu"))
+        version = f"{arch}/{os.path.basename(from_pth)}"
+    else:
+        print(f"正在下载{MODEL_SPECS[arch]['display_name']}预训练模型...")
+        weights = getattr(models, MODEL_SPECS[arch]["weights"]).IMAGENET1K_V1
+        model = builder(weights=weights)
+        version = f"{arch}/{weights.name}"
+
+    bin_path, meta_path = artifacts.save_weights(model.eval(), output, arch, version)
+    print(f"✓ 已导出 {bin_path} ({os.path.getsize(bin_path) / 1024 / 1024:.1f}MB)")
+    print(f"✓ 已导出 {meta_path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="导出可内存映射的本地模型文件")
+    parser.add_argument("--output", default=config.MODEL_DIR, help="输出目录（默认 MODEL_DIR）")
+    parser.add_argument("--arch", nargs="+", default=[config.DEFAULT_MODEL], choices=sorted(MODEL_SPECS),
+                        help="要导出的模型（默认 DEFAULT_MODEL）")
+    parser.add_argument("--from-pth", help="从已有的 state_dict 文件导出，而不是下载（只能配合单个 --arch）")
+    parser.add_argument("--labels", default=os.path.join(config.PROJECT_DIR, "imagenet_classes.json"),
+                        help="要一起复制的类别标签文件")
+    args = parser.parse_args()
+
+    if args.from_pth and len(args.arch) != 1:
+        parser.error("--from-pth 只能配合单个 --arch 使用")
+    for arch in args.arch:
+        export(arch, args.output, args.from_pth)
+
+    if os.path.exists(args.labels):
+        target = os.path.join(args.output, "imagenet_classes.json")
+        if os.path.abspath(args.labels) != os.path.abspath(target):
+            shutil.copyfile(args.labels, target)
+        print(f"✓ 已复制类别标签到 {target}")
+    else:
+        print(f"⚠ 找不到类别标签文件 {args.labels}，请手动放入 {args.output}")
+
+
+if __name__ == "__main__":
+    main()